@@ -1,28 +1,54 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify
 import os
 import sqlite3
-from sqlalchemy import text
-from db_sa import SessionLocal
+import db_sa
+from db_sa import text
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import threading
+import time
+
+import assets
+import compress
+import fragcache
+import jsonprovider
+import maintenance
+import metrics
+import passwords
+import profiler
+import ratelimit
+import slowlog
+import streaming
 
 try:
     from zoneinfo import ZoneInfo
 except Exception:
     ZoneInfo = None
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
-print("DATABASE_URL =", DATABASE_URL)
-
 
 APP_SECRET = "change_this_to_a_random_string"
 
 app = Flask(__name__)
 app.secret_key = APP_SECRET
-
-DB_PATH = "database.db"
-print("DB absolute path =", os.path.abspath(DB_PATH))
+metrics.install(app)
+jsonprovider.install(app)
+compress.install(app)
+slowlog.install()
+ratelimit.install(app)
+fragcache.install(app)
+assets.install(app)
+db_sa.engine_hooks.append(metrics.instrument_engine)
+
+DB_READS = metrics.Counter(
+    "mini_social_db_reads_total",
+    "Read connections handed out, by target (primary, pinned, or the replica name).",
+    ("target",),
+)
+
+DB_PATH = os.environ.get("SQLITE_PATH", "database.db")
+if os.environ.get("SHARD_PATHS"):
+    # 分片只接在 app_api 上（shards.py）
+    raise SystemExit("SHARD_PATHS is only supported by app_api")
 
 
 def get_db():
@@ -31,11 +57,39 @@ def get_db():
     Render 有 DATABASE_URL：回 SQLAlchemy Session（Postgres）
     """
     if os.environ.get("DATABASE_URL"):
-        return SessionLocal()  # SQLAlchemy session
-    conn = sqlite3.connect(DB_PATH)
+        return db_sa.SessionLocal()  # SQLAlchemy session
+    conn = sqlite3.connect(DB_PATH, factory=metrics.InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def get_read_db():
+    """
+    給只讀的 GET 用：有健康的 replica 就輪流用 replica，否則回 primary。
+    剛寫過的使用者（READ_PIN_SECONDS 內）固定讀 primary，看得到自己的寫入。
+    """
+    if session.get("pin_primary_until", 0) > time.time():
+        DB_READS.inc("pinned")
+        return get_db()
+    replica = db_sa.read_router.pick()
+    if replica is None:
+        DB_READS.inc("primary")
+        return get_db()
+    DB_READS.inc(replica.name)
+    if os.environ.get("DATABASE_URL"):
+        return replica.sessions()
+    conn = replica.connect(factory=metrics.InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+
+@app.after_request
+def pin_writer_to_primary(response):
+    # a successful write: this user's next reads go to the primary until replicas catch up
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400 and session.get("user_id"):
+        session["pin_primary_until"] = time.time() + db_sa.READ_PIN_SECONDS
+    return response
+
+
 def db_execute(db, sql, params=None):
     params = params or {}
 
@@ -56,7 +110,7 @@ def db_close(db):
 
 def init_db():
     if os.environ.get("DATABASE_URL"):
-        db = SessionLocal()
+        db = db_sa.SessionLocal()
         try:
             db.execute(
                 text(
@@ -78,12 +132,15 @@ def init_db():
                         id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
                         user_id INTEGER NOT NULL REFERENCES users(id),
                         content TEXT NOT NULL,
-                        created_at TEXT NOT NULL
+                        created_at TEXT NOT NULL,
+                        version INTEGER NOT NULL DEFAULT 0
                     );
                     """
                 )
             )
 
+            db.execute(text("ALTER TABLE posts ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0"))
+
             db.execute(
                 text(
                     """
@@ -133,6 +190,11 @@ def init_db():
     conn.row_factory = sqlite3.Row
     conn.executescript(
         """
+        -- only takes effect on a new, empty file; see maintenance.py vacuum
+        PRAGMA auto_vacuum = INCREMENTAL;
+        -- readers and writers do not block each other; maintenance.py relies on it
+        PRAGMA journal_mode = WAL;
+
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
@@ -145,6 +207,7 @@ def init_db():
             user_id INTEGER NOT NULL,
             content TEXT NOT NULL,
             created_at TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY(user_id) REFERENCES users(id)
         );
 
@@ -177,12 +240,61 @@ def init_db():
         );
         """
     )
+
+    # databases created before posts.version existed
+    post_columns = [r["name"] for r in conn.execute("PRAGMA table_info(posts)").fetchall()]
+    if "version" not in post_columns:
+        conn.execute("ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
     conn.commit()
     conn.close()
 
+# -- startup --
+# 匯入時不碰資料庫：建表在 create_app()（gunicorn --preload 時只在 master 跑一次），
+# 其他每個 process 的工作在第一個 request 前才做
+
+_schema_ready = False
+_started_pid = None
+_startup_lock = threading.Lock()
+
+
+def create_app():
+    """App factory for gunicorn ("app:create_app()"); see gunicorn.conf.py."""
+    global _schema_ready
+    with _startup_lock:
+        if not _schema_ready:
+            init_db()
+            _schema_ready = True
+    return app
+
+
+def start_worker():
+    """Per-process startup; runs before the first request of every worker."""
+    global _schema_ready, _started_pid
+    with _startup_lock:
+        if _started_pid == os.getpid():
+            return
+        if not _schema_ready:  # started without the factory, e.g. python app.py
+            init_db()
+            _schema_ready = True
+        if not os.environ.get("DATABASE_URL"):
+            db_sa.start_replica_sync(DB_PATH)
+            maintenance.start(DB_PATH)
+        _started_pid = os.getpid()
 
 
-init_db()
+def _ensure_worker_started():
+    if _started_pid != os.getpid():
+        start_worker()
+
+
+# ahead of every other before_request hook
+app.before_request_funcs.setdefault(None, []).insert(0, _ensure_worker_started)
+
+
+def bump_post_version(conn, post_id: int):
+    """Invalidates cached fragments of this post; call in the same transaction as the write."""
+    db_execute(conn, "UPDATE posts SET version = version + 1 WHERE id = ?", (post_id,))
 
 
 def current_user():
@@ -190,7 +302,7 @@ def current_user():
     if not uid:
         return None
 
-    db = get_db()
+    db = get_read_db()
     try:
         # Render: SQLAlchemy Session
         if hasattr(db, "bind"):
@@ -210,6 +322,8 @@ def current_user():
         db_close(db)
 
 
+profiler.install(app, current_user)
+
 
 def format_time(iso_str: str) -> str:
     if not iso_str:
@@ -241,89 +355,10 @@ def format_time(iso_str: str) -> str:
 def index():
     user = current_user()
 
-    conn = get_db()
-    if user:
-        rows = conn.execute(
-            """
-            SELECT
-                p.id,
-                p.content,
-                p.created_at,
-                u.username,
-                (
-                    SELECT COUNT(*) FROM likes l
-                    WHERE l.post_id = p.id
-                ) AS like_count,
-                (
-                    SELECT COUNT(*) FROM comments c
-                    WHERE c.post_id = p.id
-                ) AS comment_count,
-                EXISTS(
-                    SELECT 1 FROM likes l2
-                    WHERE l2.post_id = p.id AND l2.user_id = ?
-                ) AS liked_by_me
-            FROM posts p
-            JOIN users u ON u.id = p.user_id
-            ORDER BY p.created_at DESC
-            """,
-            (user["id"],),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            """
-            SELECT
-                p.id,
-                p.content,
-                p.created_at,
-                u.username,
-                (
-                    SELECT COUNT(*) FROM likes l
-                    WHERE l.post_id = p.id
-                ) AS like_count,
-                (
-                    SELECT COUNT(*) FROM comments c
-                    WHERE c.post_id = p.id
-                ) AS comment_count,
-                0 AS liked_by_me
-            FROM posts p
-            JOIN users u ON u.id = p.user_id
-            ORDER BY p.created_at DESC
-            """
-        ).fetchall()
-
-    posts = [dict(r) for r in rows]
-    for p in posts:
-        p["created_at"] = format_time(p.get("created_at", ""))
-
-    cur = db_execute(
-        conn,
-        """
-        SELECT
-            c.post_id,
-            c.content,
-            c.created_at,
-            u.username
-        FROM comments c
-        JOIN users u ON u.id = c.user_id
-        ORDER BY c.created_at ASC
-        """
-    )
-    comments_rows = cur.fetchall()
-
-
-    comments_by_post = {}
-    for r in comments_rows:
-        d = dict(r)
-        d["created_at"] = format_time(d.get("created_at", ""))
-        comments_by_post.setdefault(d["post_id"], []).append(d)
-
-    conn.close()
-
+    # the feed itself is loaded by the page from /api/posts
     return render_template(
         "index.html",
         user=user,
-        posts=posts,
-        comments_by_post=comments_by_post,
         feed_mode="public",
     )
 
@@ -334,67 +369,9 @@ def following_feed():
     if not user:
         return redirect(url_for("login"))
 
-    conn = get_db()
-    rows = conn.execute(
-        """
-        SELECT
-            p.id,
-            p.content,
-            p.created_at,
-            u.username,
-            (
-                SELECT COUNT(*) FROM likes l
-                WHERE l.post_id = p.id
-            ) AS like_count,
-            (
-                SELECT COUNT(*) FROM comments c
-                WHERE c.post_id = p.id
-            ) AS comment_count,
-            EXISTS(
-                SELECT 1 FROM likes l2
-                WHERE l2.post_id = p.id AND l2.user_id = ?
-            ) AS liked_by_me
-        FROM posts p
-        JOIN users u ON u.id = p.user_id
-        WHERE p.user_id IN (
-            SELECT followee_id FROM follows
-            WHERE follower_id = ?
-        )
-        ORDER BY p.created_at DESC
-        """,
-        (user["id"], user["id"]),
-    ).fetchall()
-
-    posts = [dict(r) for r in rows]
-    for p in posts:
-        p["created_at"] = format_time(p.get("created_at", ""))
-
-    comments_rows = conn.execute(
-        """
-        SELECT
-            c.post_id,
-            c.content,
-            c.created_at,
-            u.username
-        FROM comments c
-        JOIN users u ON u.id = c.user_id
-        ORDER BY c.created_at ASC
-        """
-    ).fetchall()
-
-    comments_by_post = {}
-    for r in comments_rows:
-        d = dict(r)
-        d["created_at"] = format_time(d.get("created_at", ""))
-        comments_by_post.setdefault(d["post_id"], []).append(d)
-
-    conn.close()
-
     return render_template(
         "index.html",
         user=user,
-        posts=posts,
-        comments_by_post=comments_by_post,
         feed_mode="following",
     )
 
@@ -403,10 +380,9 @@ def following_feed():
 def api_posts():
     user = current_user()
 
-    conn = get_db()
+    conn = get_read_db()
     if user:
-        rows = conn.execute(
-            """
+        sql = """
             SELECT
                 p.id,
                 p.content,
@@ -424,15 +400,13 @@ def api_posts():
                     SELECT 1 FROM likes l2
                     WHERE l2.post_id = p.id AND l2.user_id = ?
                 ) AS liked_by_me
-            FROM posts p
+            FROM {posts} p
             JOIN users u ON u.id = p.user_id
-            ORDER BY p.created_at DESC
-            """,
-            (user["id"],),
-        ).fetchall()
-    else:
-        rows = conn.execute(
+            ORDER BY p.created_at DESC, p.id DESC
             """
+        params = [user["id"]]
+    else:
+        sql = """
             SELECT
                 p.id,
                 p.content,
@@ -447,13 +421,36 @@ def api_posts():
                     WHERE c.post_id = p.id
                 ) AS comment_count,
                 0 AS liked_by_me
-            FROM posts p
+            FROM {posts} p
             JOIN users u ON u.id = p.user_id
-            ORDER BY p.created_at DESC
+            ORDER BY p.created_at DESC, p.id DESC
             """
-        ).fetchall()
-
-    posts = [dict(r) for r in rows]
+        params = []
+
+    def fetch(after=None, size=None):
+        # 串流時一批一批查完再輸出：子查詢只挑這一批的貼文，計數也只算這一批
+        posts_sql, page_params = "posts", []
+        if size is not None:
+            keyset = "WHERE (created_at, id) < (?, ?)" if after else ""
+            posts_sql = f"(SELECT * FROM posts {keyset} ORDER BY created_at DESC, id DESC LIMIT ?)"
+            page_params = [*(after or ()), size]
+        cur = conn.execute(sql.format(posts=posts_sql), [*params, *page_params])
+        cur.row_factory = jsonprovider.dict_row
+        return cur.fetchall()
+
+    if streaming.enabled():
+        def stream_posts():
+            try:
+                for rows in streaming.pages(fetch, lambda p: (p["created_at"], p["id"])):
+                    for p in rows:
+                        p["created_at"] = format_time(p.get("created_at", ""))
+                        yield p
+            finally:
+                conn.close()
+
+        return streaming.json_list_response({}, "posts", stream_posts(), lambda: {"user": user})
+
+    posts = fetch()
     for p in posts:
         p["created_at"] = format_time(p.get("created_at", ""))
 
@@ -497,6 +494,7 @@ def api_like_post(post_id: int):
             "INSERT INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)",
             (user["id"], post_id, now),
         )
+        bump_post_version(conn, post_id)
         conn.commit()
     except sqlite3.IntegrityError:
         pass
@@ -517,10 +515,12 @@ def api_unlike_post(post_id: int):
         return jsonify({"error": "Authentication required."}), 401
 
     conn = get_db()
-    conn.execute(
+    cur = conn.execute(
         "DELETE FROM likes WHERE user_id = ? AND post_id = ?",
         (user["id"], post_id),
     )
+    if cur.rowcount:
+        bump_post_version(conn, post_id)
     conn.commit()
 
     like_count = conn.execute(
@@ -545,7 +545,7 @@ def api_create_comment(post_id: int):
 
     now = datetime.utcnow().isoformat()
 
-    db = SessionLocal()
+    db = db_sa.SessionLocal()
     try:
         row = db.execute(
             text("SELECT id FROM posts WHERE id = :pid"),
@@ -568,6 +568,10 @@ def api_create_comment(post_id: int):
                 "created_at": now,
             },
         )
+        db.execute(
+            text("UPDATE posts SET version = version + 1 WHERE id = :pid"),
+            {"pid": post_id},
+        )
         db.commit()
 
         count = db.execute(
@@ -604,7 +608,7 @@ def register():
         return redirect(url_for("register"))
 
     now = datetime.utcnow().isoformat()
-    pw_hash = generate_password_hash(password)
+    pw_hash = passwords.hash_password(password)
 
     conn = get_db()
     try:
@@ -638,10 +642,20 @@ def login():
     row = conn.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,)).fetchone()
     conn.close()
 
-    if not row or not check_password_hash(row["password_hash"], password):
+    password_ok, new_hash = False, None
+    if row:
+        password_ok, new_hash = passwords.verify_password(row["password_hash"], password)
+
+    if not password_ok:
         flash("Invalid username or password.")
         return redirect(url_for("login"))
 
+    if new_hash:
+        conn = get_db()
+        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, row["id"]))
+        conn.commit()
+        conn.close()
+
     session["user_id"] = row["id"]
     flash("Signed in.")
     return redirect(url_for("index"))
@@ -654,11 +668,40 @@ def logout():
     return redirect(url_for("index"))
 
 
+def fetch_comments_by_post(conn, post_ids):
+    """Comments of the given posts, grouped by post_id (used per batch when streaming)."""
+    if not post_ids:
+        return {}
+
+    placeholders = ",".join(["?"] * len(post_ids))
+    rows = conn.execute(
+        f"""
+        SELECT
+            c.post_id,
+            c.content,
+            c.created_at,
+            u.username
+        FROM comments c
+        JOIN users u ON u.id = c.user_id
+        WHERE c.post_id IN ({placeholders})
+        ORDER BY c.created_at ASC
+        """,
+        tuple(post_ids),
+    ).fetchall()
+
+    comments_by_post = {}
+    for r in rows:
+        d = dict(r)
+        d["created_at"] = format_time(d.get("created_at", ""))
+        comments_by_post.setdefault(d["post_id"], []).append(d)
+    return comments_by_post
+
+
 @app.route("/u/<username>", methods=["GET"])
 def profile(username: str):
     viewer = current_user()
 
-    conn = get_db()
+    conn = get_read_db()
     user_row = conn.execute(
         "SELECT id, username FROM users WHERE username = ?",
         (username,),
@@ -691,12 +734,12 @@ def profile(username: str):
     ).fetchone()["c"]
 
     if viewer:
-        posts_rows = conn.execute(
-            """
+        sql = """
             SELECT
                 p.id,
                 p.content,
                 p.created_at,
+                p.version,
                 u.username,
                 (
                     SELECT COUNT(*) FROM likes l
@@ -710,20 +753,19 @@ def profile(username: str):
                     SELECT 1 FROM likes l2
                     WHERE l2.post_id = p.id AND l2.user_id = ?
                 ) AS liked_by_me
-            FROM posts p
+            FROM {posts} p
             JOIN users u ON u.id = p.user_id
             WHERE p.user_id = ?
-            ORDER BY p.created_at DESC
-            """,
-            (viewer["id"], user_row["id"]),
-        ).fetchall()
-    else:
-        posts_rows = conn.execute(
+            ORDER BY p.created_at DESC, p.id DESC
             """
+        params = [viewer["id"]]
+    else:
+        sql = """
             SELECT
                 p.id,
                 p.content,
                 p.created_at,
+                p.version,
                 u.username,
                 (
                     SELECT COUNT(*) FROM likes l
@@ -734,15 +776,51 @@ def profile(username: str):
                     WHERE c.post_id = p.id
                 ) AS comment_count,
                 0 AS liked_by_me
-            FROM posts p
+            FROM {posts} p
             JOIN users u ON u.id = p.user_id
             WHERE p.user_id = ?
-            ORDER BY p.created_at DESC
-            """,
-            (user_row["id"],),
-        ).fetchall()
+            ORDER BY p.created_at DESC, p.id DESC
+            """
+        params = []
+
+    def fetch(after=None, size=None):
+        # 串流時一批一批查完再輸出，同 api_posts
+        posts_sql, page_params = "posts", []
+        if size is not None:
+            keyset = "AND (created_at, id) < (?, ?)" if after else ""
+            posts_sql = f"(SELECT * FROM posts WHERE user_id = ? {keyset} ORDER BY created_at DESC, id DESC LIMIT ?)"
+            page_params = [user_row["id"], *(after or ()), size]
+        return conn.execute(sql.format(posts=posts_sql), [*params, *page_params, user_row["id"]]).fetchall()
+
+    context = dict(
+        user=viewer,
+        profile_user=user_row,
+        is_following=is_following,
+        followers_count=followers_count,
+        following_count=following_count,
+    )
 
-    posts = [dict(r) for r in posts_rows]
+    if streaming.enabled():
+        # 分批讀貼文與留言，邊讀邊輸出；comments_by_post 只保留目前這一批
+        comments_by_post = {}
+
+        def stream_posts():
+            try:
+                for rows in streaming.pages(fetch, lambda r: (r["created_at"], r["id"])):
+                    batch = [dict(r) for r in rows]
+                    comments_by_post.clear()
+                    comments_by_post.update(fetch_comments_by_post(conn, [p["id"] for p in batch]))
+                    for p in batch:
+                        p["created_at"] = format_time(p.get("created_at", ""))
+                        yield p
+            finally:
+                conn.close()
+
+        return streaming.template_response(
+            "profile.html", posts=stream_posts(), comments_by_post=comments_by_post, **context
+        )
+
+    posts = [dict(r) for r in fetch()]
     for p in posts:
         p["created_at"] = format_time(p.get("created_at", ""))
 
@@ -773,13 +851,9 @@ def profile(username: str):
 
     return render_template(
         "profile.html",
-        user=viewer,
-        profile_user=user_row,
         posts=posts,
         comments_by_post=comments_by_post,
-        is_following=is_following,
-        followers_count=followers_count,
-        following_count=following_count,
+        **context,
     )
 
 
@@ -854,6 +928,7 @@ def like(post_id: int):
             "INSERT INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)",
             (user["id"], post_id, now),
         )
+        bump_post_version(conn, post_id)
         conn.commit()
     except sqlite3.IntegrityError:
         pass
@@ -869,10 +944,12 @@ def unlike(post_id: int):
         abort(401)
 
     conn = get_db()
-    conn.execute(
+    cur = conn.execute(
         "DELETE FROM likes WHERE user_id = ? AND post_id = ?",
         (user["id"], post_id),
     )
+    if cur.rowcount:
+        bump_post_version(conn, post_id)
     conn.commit()
     conn.close()
 
@@ -896,6 +973,7 @@ def comment(post_id: int):
         "INSERT INTO comments (user_id, post_id, content, created_at) VALUES (?, ?, ?, ?)",
         (user["id"], post_id, content, now),
     )
+    bump_post_version(conn, post_id)
     conn.commit()
     conn.close()
 
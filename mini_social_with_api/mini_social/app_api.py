@@ -1,8 +1,28 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify
 import sqlite3
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import threading
+
+import archive
+import assets
+import compress
+import export
+import feedrank
+import fieldsets
+import fragcache
+import jsonprovider
+import maintenance
+import metrics
+import passwords
+import profiler
+import ratelimit
+import recommend
+import shards
+import slowlog
+import streaming
+import trending
+import writer
 
 try:
     from zoneinfo import ZoneInfo
@@ -14,9 +34,18 @@ APP_SECRET = "change_this_to_a_random_string"
 
 app = Flask(__name__)
 app.secret_key = APP_SECRET
+metrics.install(app)
+jsonprovider.install(app)
+compress.install(app)
+slowlog.install()
+ratelimit.install(app)
+fragcache.install(app)
+assets.install(app)
 
-DB_PATH = "database.db"
-print("DB absolute path =", os.path.abspath(DB_PATH))
+DB_PATH = os.environ.get("SQLITE_PATH", "database.db")
+maintenance.install(app, DB_PATH)
+# SHARD_PATHS: posts / likes / comments live in shard files, see shards.py
+sharded = shards.install(app, DB_PATH)
 
 
 def get_toronto_tz():
@@ -54,7 +83,7 @@ def format_time(iso_str: str) -> str:
 
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=metrics.InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -63,6 +92,11 @@ def init_db():
     conn = get_db()
     cur = conn.cursor()
 
+    # 只對新建的空檔案有效；舊檔案見 maintenance.py vacuum --enable
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # 讀寫互不阻塞；maintenance.py 的 backup / checkpoint 也靠 WAL
+    cur.execute("PRAGMA journal_mode = WAL")
+
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -81,11 +115,17 @@ def init_db():
             user_id INTEGER NOT NULL,
             content TEXT NOT NULL,
             created_at TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
         """
     )
 
+    # databases created before posts.version existed
+    post_columns = [r["name"] for r in cur.execute("PRAGMA table_info(posts)").fetchall()]
+    if "version" not in post_columns:
+        cur.execute("ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS follows (
@@ -126,8 +166,24 @@ def init_db():
         """
     )
 
+    # 排序版 following feed（feedrank.py）：依作者找貼文、依貼文數讚與留言
+    cur.execute("CREATE INDEX IF NOT EXISTS posts_user_id ON posts (user_id, id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS likes_post_id ON likes (post_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS comments_post_id ON comments (post_id, created_at)")
+
+    trending.init(conn)
+    recommend.init(conn)
+
     conn.commit()
     conn.close()
+    archive.init()
+    if sharded is not None:
+        sharded.init()
+
+
+def bump_post_version(conn, post_id: int):
+    """Invalidates cached fragments of this post; call in the same transaction as the write."""
+    conn.execute("UPDATE posts SET version = version + 1 WHERE id = ?", (post_id,))
 
 
 def current_user():
@@ -140,6 +196,17 @@ def current_user():
     return user
 
 
+profiler.install(app, current_user)
+writes = sharded if sharded is not None else writer.install(app, get_db)
+# writer.WriteError（寫入程序失敗、分片搬移中）：API 回 503，表單 flash 後導回
+WRITE_FAILED = "Could not save that right now. Please try again in a moment."
+if sharded is None:
+    # these read posts and likes from the main database only
+    export.install(app, archive.reading(get_db), current_user)
+    trending.install(app, DB_PATH, format_time)
+    recommend.install(app, get_db, current_user)
+
+
 def get_followee_ids(follower_id: int):
     conn = get_db()
     rows = conn.execute(
@@ -150,91 +217,6 @@ def get_followee_ids(follower_id: int):
     return [r["followee_id"] for r in rows]
 
 
-def fetch_posts(feed: str, viewer_id: int | None):
-    conn = get_db()
-
-    where_sql = ""
-    where_params: list = []
-
-    if feed == "following":
-        if viewer_id is None:
-            conn.close()
-            return [], {}
-        ids = get_followee_ids(viewer_id)
-        ids.append(viewer_id)
-        placeholders = ",".join(["?"] * len(ids))
-        where_sql = f"WHERE posts.user_id IN ({placeholders})"
-        where_params.extend(ids)
-
-    posts = conn.execute(
-        f"""
-        SELECT
-            posts.id,
-            posts.content,
-            posts.created_at,
-            users.username,
-            COALESCE(lc.cnt, 0) AS like_count,
-            COALESCE(cc.cnt, 0) AS comment_count,
-            CASE
-                WHEN ? IS NULL THEN 0
-                WHEN EXISTS (
-                    SELECT 1
-                    FROM likes
-                    WHERE likes.post_id = posts.id AND likes.user_id = ?
-                ) THEN 1
-                ELSE 0
-            END AS liked_by_me
-        FROM posts
-        JOIN users ON users.id = posts.user_id
-        LEFT JOIN (
-            SELECT post_id, COUNT(*) AS cnt
-            FROM likes
-            GROUP BY post_id
-        ) AS lc ON lc.post_id = posts.id
-        LEFT JOIN (
-            SELECT post_id, COUNT(*) AS cnt
-            FROM comments
-            GROUP BY post_id
-        ) AS cc ON cc.post_id = posts.id
-        {where_sql}
-        ORDER BY posts.id DESC
-        """,
-        (viewer_id, viewer_id, *where_params),
-    ).fetchall()
-
-    posts = [dict(p) for p in posts]
-    for p in posts:
-        p["created_at"] = format_time(p.get("created_at", ""))
-
-    post_ids = [p["id"] for p in posts]
-    comments_by_post: dict[int, list[dict]] = {}
-
-    if post_ids:
-        placeholders = ",".join(["?"] * len(post_ids))
-        rows = conn.execute(
-            f"""
-            SELECT
-                comments.id,
-                comments.post_id,
-                comments.content,
-                comments.created_at,
-                users.username
-            FROM comments
-            JOIN users ON users.id = comments.user_id
-            WHERE comments.post_id IN ({placeholders})
-            ORDER BY comments.id ASC
-            """,
-            tuple(post_ids),
-        ).fetchall()
-
-        rows = [dict(r) for r in rows]
-        for r in rows:
-            r["created_at"] = format_time(r.get("created_at", ""))
-            comments_by_post.setdefault(r["post_id"], []).append(r)
-
-    conn.close()
-    return posts, comments_by_post
-
 def _parse_int(value: str | None, default: int | None = None) -> int | None:
     if value is None or value == "":
         return default
@@ -244,16 +226,23 @@ def _parse_int(value: str | None, default: int | None = None) -> int | None:
         return default
 
 
-def fetch_posts_api(feed: str, viewer_id: int | None, limit: int, before_id: int | None):
-    conn = get_db()
+def _page_limit() -> int:
+    limit = _parse_int(request.args.get("limit"), default=20) or 20
+    if limit < 1:
+        limit = 1
+    if limit > 50:
+        limit = 50
+    return limit
 
+
+def feed_where(feed: str, viewer_id: int | None, before_id: int | None):
+    """(where_sql, params) selecting one feed's posts, or None when there is nothing to read."""
     conditions: list[str] = []
-    params: list = [viewer_id, viewer_id]
+    params: list = []
 
     if feed == "following":
         if viewer_id is None:
-            conn.close()
-            return []
+            return None
         ids = get_followee_ids(viewer_id)
         ids.append(viewer_id)
         placeholders = ",".join(["?"] * len(ids))
@@ -267,9 +256,27 @@ def fetch_posts_api(feed: str, viewer_id: int | None, limit: int, before_id: int
     where_sql = ""
     if conditions:
         where_sql = "WHERE " + " AND ".join(conditions)
+    return where_sql, params
 
-    rows = conn.execute(
-        f"""
+
+def feed_shards(feed: str, viewer_id: int | None) -> list[int] | None:
+    """Shards holding the feed's authors; None when the app is not sharded."""
+    if sharded is None:
+        return None
+    if feed == "following":
+        return sharded.shards_of_users([*get_followee_ids(viewer_id), viewer_id])
+    return list(range(len(sharded.paths)))
+
+
+def posts_api_query(feed: str, viewer_id: int | None, limit: int, before_id: int | None):
+    """(sql, params) for one page of the feed API, or None when there is nothing to read."""
+    where = feed_where(feed, viewer_id, before_id)
+    if where is None:
+        return None
+    where_sql, where_params = where
+    params: list = [viewer_id, viewer_id, *where_params]
+
+    sql = f"""
         SELECT
             posts.id,
             posts.content,
@@ -301,26 +308,74 @@ def fetch_posts_api(feed: str, viewer_id: int | None, limit: int, before_id: int
         {where_sql}
         ORDER BY posts.id DESC
         LIMIT ?
-        """,
-        (*params, limit),
-    ).fetchall()
+        """
+    return sql, (*params, limit)
 
-    posts = [dict(r) for r in rows]
+
+def fetch_posts_api(feed: str, viewer_id: int | None, limit: int, before_id: int | None):
+    query = posts_api_query(feed, viewer_id, limit, before_id)
+    if query is None:
+        return []
+
+    shard_ids = feed_shards(feed, viewer_id)
+    if shard_ids is not None:
+        posts = sharded.scatter(*query, shard_ids, order_by="id", reverse=True, limit=limit)
+    else:
+        conn = get_db()
+        cur = conn.execute(*query)
+        cur.row_factory = jsonprovider.dict_row
+        posts = cur.fetchall()
+        conn.close()
     for p in posts:
         p["created_at"] = format_time(p.get("created_at", ""))
 
-    conn.close()
     return posts
 
-def fetch_comments_for_posts(post_ids: list[int], limit_per_post: int = 50):
+
+RANKED_POSTS_SQL = """
+    SELECT
+        posts.id,
+        posts.content,
+        posts.created_at,
+        users.username,
+        (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id) AS like_count,
+        (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) AS comment_count,
+        EXISTS (
+            SELECT 1 FROM likes WHERE likes.user_id = ? AND likes.post_id = posts.id
+        ) AS liked_by_me
+    FROM posts
+    JOIN users ON users.id = posts.user_id
+    WHERE posts.id IN ({placeholders})
+"""
+
+
+def fetch_ranked_posts(viewer_id: int, limit: int, cursor: str | None, before_id: int | None = None):
+    """(posts, next_cursor) of one page of the ranked following feed; see feedrank.py."""
+    author_ids = get_followee_ids(viewer_id)
+    author_ids.append(viewer_id)
+
+    conn = get_db()
+    post_ids, next_cursor = feedrank.rank(conn, viewer_id, author_ids, limit, cursor, before_id=before_id)
+    posts = []
+    if post_ids:
+        # a page is a handful of ids: counting through the post_id indexes beats
+        # the full GROUP BY of posts_api_query
+        cur = conn.execute(RANKED_POSTS_SQL.format(placeholders=",".join(["?"] * len(post_ids))), (viewer_id, *post_ids))
+        cur.row_factory = jsonprovider.dict_row
+        by_id = {p["id"]: p for p in cur.fetchall()}
+        posts = [by_id[i] for i in post_ids if i in by_id]
+        for p in posts:
+            p["created_at"] = format_time(p.get("created_at", ""))
+    conn.close()
+    return posts, next_cursor
+
+
+def fetch_comments_for_posts(post_ids: list[int], limit_per_post: int = 50, conn=None):
     if not post_ids:
         return {}
 
-    conn = get_db()
     placeholders = ",".join(["?"] * len(post_ids))
-
-    rows = conn.execute(
-        f"""
+    sql = f"""
         SELECT
             comments.post_id,
             comments.content,
@@ -330,15 +385,22 @@ def fetch_comments_for_posts(post_ids: list[int], limit_per_post: int = 50):
         JOIN users ON users.id = comments.user_id
         WHERE comments.post_id IN ({placeholders})
         ORDER BY comments.created_at ASC
-        """,
-        post_ids,
-    ).fetchall()
+        """
 
-    conn.close()
+    if conn is None and sharded is not None:
+        rows = sharded.scatter(sql, post_ids, sharded.shards_of_posts(post_ids), order_by="created_at")
+    else:
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        cur = conn.execute(sql, post_ids)
+        cur.row_factory = jsonprovider.dict_row
+        rows = cur.fetchall()
+        if own_conn:
+            conn.close()
 
     out: dict[int, list[dict]] = {}
-    for r in rows:
-        d = dict(r)
+    for d in rows:
         d["created_at"] = format_time(d.get("created_at", ""))
         out.setdefault(d["post_id"], []).append(d)
 
@@ -350,9 +412,79 @@ def fetch_comments_for_posts(post_ids: list[int], limit_per_post: int = 50):
 
 
 
+def sparse_posts_payload(conn, fs, where_sql: str, where_params, viewer, limit: int, shard_ids=None) -> dict:
+    """
+    posts / next_cursor / users (and viewer) for a fieldsets.Fieldset; see
+    fieldsets.py.  With shard_ids, posts and comments are gathered from those
+    shards and conn only answers for users.
+    """
+    viewer_id = viewer["id"] if viewer else None
+    sql, params = fieldsets.posts_sql(fs, where_sql, viewer_id)
+    if shard_ids is not None:
+        posts = sharded.scatter(sql, (*params, *where_params, limit), shard_ids, order_by="id", reverse=True, limit=limit)
+    else:
+        cur = conn.execute(sql, (*params, *where_params, limit))
+        cur.row_factory = jsonprovider.dict_row
+        posts = cur.fetchall()
+
+    author_ids = set()
+    for p in posts:
+        if "created_at" in p:
+            p["created_at"] = format_time(p["created_at"])
+        if "author_id" in p:
+            author_ids.add(p["author_id"])
+
+    if "comments" in fs and posts:
+        post_ids = [p["id"] for p in posts]
+        if shard_ids is not None:
+            comment_rows = sharded.scatter(
+                *fieldsets.comments_sql(post_ids), sharded.shards_of_posts(post_ids), order_by="created_at"
+            )
+        else:
+            cur = conn.execute(*fieldsets.comments_sql(post_ids))
+            cur.row_factory = jsonprovider.dict_row
+            comment_rows = cur.fetchall()
+        comments_map: dict[int, list[dict]] = {}
+        for c in comment_rows:
+            c["created_at"] = format_time(c["created_at"])
+            comments_map.setdefault(c.pop("post_id"), []).append(c)
+        for p in posts:
+            p["comments"] = comments_map.get(p["id"], [])[-20:]
+            author_ids.update(c["author_id"] for c in p["comments"])
+
+    body = {
+        "posts": posts,
+        "next_cursor": posts[-1]["id"] if len(posts) == limit else None,
+    }
+    if author_ids:
+        cur = conn.execute(*fieldsets.users_sql(author_ids))
+        body["users"] = {str(r["id"]): {"username": r["username"]} for r in cur.fetchall()}
+    if "viewer_state" in fs:
+        body["viewer"] = {"id": viewer["id"], "username": viewer["username"]} if viewer else None
+    return body
+
+
+
+_schema_ready = False
+_startup_lock = threading.Lock()
+
+
+def create_app():
+    """App factory for gunicorn ("app_api:create_app()"); see gunicorn.conf.py."""
+    ensure_db()
+    return app
+
+
 @app.before_request
 def ensure_db():
-    init_db()
+    # 每個 process 建一次表就好，不是每個 request 都跑
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _startup_lock:
+        if not _schema_ready:
+            init_db()
+            _schema_ready = True
 
 
 @app.route("/")
@@ -364,8 +496,8 @@ def index():
         flash("Please log in to view the following feed.")
         return redirect(url_for("login"))
 
-    posts, comments_by_post = fetch_posts(feed, user["id"] if user else None)
-    return render_template("index.html", user=user, posts=posts, comments_by_post=comments_by_post, feed=feed)
+    # the feed itself is loaded by the page from /api/posts
+    return render_template("index.html", user=user, feed=feed)
 
 
 @app.route("/api/posts", methods=["GET"])
@@ -380,14 +512,31 @@ def api_get_posts():
     if feed == "following" and not user:
         return jsonify({"error": "Authentication required for following feed."}), 401
 
-    limit = _parse_int(request.args.get("limit"), default=20) or 20
-    if limit < 1:
-        limit = 1
-    if limit > 50:
-        limit = 50
-
+    limit = _page_limit()
     before_id = _parse_int(request.args.get("before_id"), default=None)
 
+    order = request.args.get("order") or "recent"
+    if order not in ("recent", "ranked") or (order == "ranked" and feed != "following"):
+        return jsonify({"error": "Invalid order. Use 'recent', or 'ranked' with feed=following."}), 400
+    if order == "ranked":
+        return api_ranked_posts(user, limit, before_id)
+
+    try:
+        fs = fieldsets.parse(request.args, fieldsets.FEED_INCLUDES, legacy_default=True)
+    except fieldsets.FieldsetError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fs is not None:
+        where_sql, where_params = feed_where(feed, viewer_id, before_id)
+        conn = get_db()
+        body = sparse_posts_payload(conn, fs, where_sql, where_params, user, limit, feed_shards(feed, viewer_id))
+        conn.close()
+        return jsonify({"feed": feed, "limit": limit, "before_id": before_id, **body})
+
+    # a sharded page is merged from several shards before its first post is known
+    if streaming.enabled() and sharded is None:
+        return stream_posts_api(feed, user, limit, before_id)
+
     posts = fetch_posts_api(feed=feed, viewer_id=viewer_id, limit=limit, before_id=before_id)
 
     post_ids = [p["id"] for p in posts]
@@ -405,11 +554,138 @@ def api_get_posts():
             "before_id": before_id,
             "next_cursor": next_cursor,
             "posts": posts,
-            "user": user,
+            "user": dict(user) if user else None,
+        }
+    )
+
+
+
+def api_ranked_posts(user, limit: int, before_id: int | None):
+    if sharded is not None:
+        return jsonify({"error": "Ranked feed is not available with SHARD_PATHS."}), 501
+    if not feedrank.available():
+        return jsonify({"error": "Ranked feed is not available (numpy is not installed)."}), 501
+    cursor = request.args.get("cursor") or None
+    try:
+        posts, next_cursor = fetch_ranked_posts(user["id"], limit, cursor, before_id)
+    except feedrank.InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+
+    comments_map = fetch_comments_for_posts([p["id"] for p in posts], limit_per_post=20)
+    for p in posts:
+        p["comments"] = comments_map.get(p["id"], [])
+
+    return jsonify(
+        {
+            "feed": "following",
+            "order": "ranked",
+            "limit": limit,
+            "before_id": before_id,
+            "cursor": cursor,
+            "next_cursor": next_cursor,
+            "posts": posts,
+            "user": dict(user),
         }
     )
 
 
+def stream_posts_api(feed: str, user, limit: int, before_id: int | None):
+    viewer_id = user["id"] if user else None
+    seen = {"count": 0, "last_id": None}
+
+    def posts():
+        conn = get_db()
+
+        def fetch(after, size):
+            # 每批各自查完再輸出，下一批從上一批最後一個 id 往後接
+            query = posts_api_query(
+                feed, viewer_id, min(size, limit - seen["count"]), before_id if after is None else after
+            )
+            if query is None:
+                return []
+            cur = conn.execute(*query)
+            cur.row_factory = jsonprovider.dict_row
+            return cur.fetchall()
+
+        try:
+            for batch in streaming.pages(fetch, lambda p: p["id"]):
+                comments_map = fetch_comments_for_posts([p["id"] for p in batch], limit_per_post=20, conn=conn)
+                for p in batch:
+                    p["created_at"] = format_time(p.get("created_at", ""))
+                    p["comments"] = comments_map.get(p["id"], [])
+                    seen["count"] += 1
+                    seen["last_id"] = p["id"]
+                    yield p
+        finally:
+            conn.close()
+
+    return streaming.json_list_response(
+        {
+            "feed": feed,
+            "limit": limit,
+            "before_id": before_id,
+            "user": dict(user) if user else None,
+        },
+        "posts",
+        posts(),
+        lambda: {"next_cursor": seen["last_id"] if seen["count"] == limit else None},
+    )
+
+
+@app.route("/api/users/<username>/posts", methods=["GET"])
+def api_user_posts(username):
+    try:
+        fs = fieldsets.parse(request.args, fieldsets.PROFILE_INCLUDES)
+    except fieldsets.FieldsetError as e:
+        return jsonify({"error": str(e)}), 400
+
+    limit = _page_limit()
+    before_id = _parse_int(request.args.get("before_id"), default=None)
+    viewer = current_user()
+
+    # 個人頁可能翻到很舊的貼文，讀 archive
+    conn = archive.fallthrough(get_db())
+    user_row = conn.execute(
+        "SELECT id, username FROM users WHERE username = ?",
+        (username,),
+    ).fetchone()
+    if not user_row:
+        conn.close()
+        return jsonify({"error": "User not found."}), 404
+    if sharded is not None:
+        # one author: everything is on their shard (with the main database attached)
+        conn.close()
+        conn = sharded.connect(sharded.shard_of(user_row["id"]))
+
+    profile = {"id": user_row["id"], "username": user_row["username"]}
+    if "counts" in fs:
+        profile["followers_count"] = conn.execute(
+            "SELECT COUNT(*) AS c FROM follows WHERE followee_id = ?",
+            (user_row["id"],),
+        ).fetchone()["c"]
+        profile["following_count"] = conn.execute(
+            "SELECT COUNT(*) AS c FROM follows WHERE follower_id = ?",
+            (user_row["id"],),
+        ).fetchone()["c"]
+    if "viewer_state" in fs:
+        is_following = False
+        if viewer and viewer["id"] != user_row["id"]:
+            is_following = conn.execute(
+                "SELECT 1 FROM follows WHERE follower_id = ? AND followee_id = ?",
+                (viewer["id"], user_row["id"]),
+            ).fetchone() is not None
+        profile["is_following"] = is_following
+
+    where_sql = "WHERE posts.user_id = ?"
+    where_params = [user_row["id"]]
+    if before_id is not None:
+        where_sql += " AND posts.id < ?"
+        where_params.append(before_id)
+
+    body = sparse_posts_payload(conn, fs, where_sql, where_params, viewer, limit)
+    conn.close()
+    return jsonify({"profile": profile, "limit": limit, "before_id": before_id, **body})
+
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -424,7 +700,7 @@ def register():
             flash("Password must be at least 8 characters.")
             return redirect(url_for("register"))
 
-        pw_hash = generate_password_hash(password)
+        pw_hash = passwords.hash_password(password)
         now = datetime.utcnow().isoformat()
 
         conn = get_db()
@@ -462,10 +738,20 @@ def login():
         ).fetchone()
         conn.close()
 
-        if not user_row or not check_password_hash(user_row["password_hash"], password):
+        password_ok, new_hash = False, None
+        if user_row:
+            password_ok, new_hash = passwords.verify_password(user_row["password_hash"], password)
+
+        if not password_ok:
             flash("Invalid username or password.")
             return redirect(url_for("login"))
 
+        if new_hash:
+            conn = get_db()
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user_row["id"]))
+            conn.commit()
+            conn.close()
+
         session["user_id"] = user_row["id"]
         flash("Logged in.")
         return redirect(url_for("index"))
@@ -494,14 +780,11 @@ def create_post():
         flash("Post is too long. Limit is 500 characters.")
         return redirect(url_for("index"))
 
-    now = datetime.utcnow().isoformat()
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO posts (user_id, content, created_at) VALUES (?, ?, ?)",
-        (user["id"], content, now),
-    )
-    conn.commit()
-    conn.close()
+    try:
+        writes.write("post", user_id=user["id"], content=content, created_at=datetime.utcnow().isoformat())
+    except writer.WriteError:
+        flash(WRITE_FAILED)
+        return redirect(url_for("index"))
 
     flash("Posted.")
     return redirect(url_for("index"))
@@ -528,18 +811,16 @@ def follow(username):
         flash("You cannot follow yourself.")
         return redirect(url_for("profile", username=username))
 
+    conn.close()
     now = datetime.utcnow().isoformat()
     try:
-        conn.execute(
-            "INSERT INTO follows (follower_id, followee_id, created_at) VALUES (?, ?, ?)",
-            (user["id"], target["id"], now),
-        )
-        conn.commit()
-        flash("Followed.")
-    except sqlite3.IntegrityError:
-        flash("You are already following this user.")
+        if writes.write("follow", follower_id=user["id"], followee_id=target["id"], created_at=now):
+            flash("Followed.")
+        else:
+            flash("You are already following this user.")
+    except writer.WriteError:
+        flash(WRITE_FAILED)
 
-    conn.close()
     return redirect(url_for("profile", username=username))
 
 
@@ -555,18 +836,16 @@ def unfollow(username):
         (username,),
     ).fetchone()
 
+    conn.close()
     if not target:
-        conn.close()
         abort(404)
 
-    conn.execute(
-        "DELETE FROM follows WHERE follower_id = ? AND followee_id = ?",
-        (user["id"], target["id"]),
-    )
-    conn.commit()
-    conn.close()
-
-    flash("Unfollowed.")
+    try:
+        writes.write("unfollow", follower_id=user["id"], followee_id=target["id"])
+    except writer.WriteError:
+        flash(WRITE_FAILED)
+    else:
+        flash("Unfollowed.")
     return redirect(url_for("profile", username=username))
 
 
@@ -576,17 +855,10 @@ def like(post_id: int):
     if not user:
         abort(401)
 
-    now = datetime.utcnow().isoformat()
-    conn = get_db()
     try:
-        conn.execute(
-            "INSERT INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)",
-            (user["id"], post_id, now),
-        )
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass
-    conn.close()
+        writes.write("like", user_id=user["id"], post_id=post_id, created_at=datetime.utcnow().isoformat())
+    except writer.WriteError:
+        flash(WRITE_FAILED)
 
     return redirect(request.referrer or url_for("index"))
 
@@ -597,13 +869,10 @@ def unlike(post_id: int):
     if not user:
         abort(401)
 
-    conn = get_db()
-    conn.execute(
-        "DELETE FROM likes WHERE user_id = ? AND post_id = ?",
-        (user["id"], post_id),
-    )
-    conn.commit()
-    conn.close()
+    try:
+        writes.write("unlike", user_id=user["id"], post_id=post_id)
+    except writer.WriteError:
+        flash(WRITE_FAILED)
 
     return redirect(request.referrer or url_for("index"))
 
@@ -619,20 +888,13 @@ def api_create_comment(post_id: int):
         return jsonify({"error": "Content is required."}), 400
 
     now = datetime.utcnow().isoformat()
-
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO comments (user_id, post_id, content, created_at) VALUES (?, ?, ?, ?)",
-        (user["id"], post_id, content, now),
-    )
-    conn.commit()
-
-    comment_count = conn.execute(
-        "SELECT COUNT(*) AS c FROM comments WHERE post_id = ?",
-        (post_id,),
-    ).fetchone()["c"]
-
-    conn.close()
+    try:
+        result = writes.write(
+            "comment", user_id=user["id"], post_id=post_id, content=content, created_at=now, with_count=True
+        )
+    except writer.WriteError:
+        return jsonify({"error": WRITE_FAILED}), 503
+    comment_count = result["comment_count"]
 
     return jsonify(
         {
@@ -660,22 +922,96 @@ def comment(post_id: int):
         flash("Comment is too long. Limit is 300 characters.")
         return redirect(request.referrer or url_for("index"))
 
-    now = datetime.utcnow().isoformat()
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO comments (post_id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
-        (post_id, user["id"], content, now),
-    )
-    conn.commit()
-    conn.close()
+    try:
+        writes.write("comment", user_id=user["id"], post_id=post_id, content=content, created_at=datetime.utcnow().isoformat())
+    except writer.WriteError:
+        flash(WRITE_FAILED)
 
     return redirect(request.referrer or url_for("index"))
 
 
+PROFILE_POSTS_SQL = """
+    SELECT
+        posts.id,
+        posts.content,
+        posts.created_at,
+        posts.version,
+        users.username,
+        COALESCE(lc.cnt, 0) AS like_count,
+        COALESCE(cc.cnt, 0) AS comment_count,
+        CASE
+            WHEN ? IS NULL THEN 0
+            WHEN EXISTS (
+                SELECT 1
+                FROM likes
+                WHERE likes.post_id = posts.id AND likes.user_id = ?
+            ) THEN 1
+            ELSE 0
+        END AS liked_by_me
+    FROM posts
+    JOIN users ON users.id = posts.user_id
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS cnt
+        FROM likes
+        GROUP BY post_id
+    ) AS lc ON lc.post_id = posts.id
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS cnt
+        FROM comments
+        GROUP BY post_id
+    ) AS cc ON cc.post_id = posts.id
+    WHERE posts.user_id = ?
+"""
+
+
+def profile_posts_query(viewer_id: int | None, user_id: int, before_id: int | None = None, limit: int | None = None):
+    """(sql, params) for a user's posts, newest first; one page of them when limit is given."""
+    sql = PROFILE_POSTS_SQL
+    params: list = [viewer_id, viewer_id, user_id]
+    if before_id is not None:
+        sql += "    AND posts.id < ?\n"
+        params.append(before_id)
+    sql += "    ORDER BY posts.id DESC\n"
+    if limit is not None:
+        sql += "    LIMIT ?\n"
+        params.append(limit)
+    return sql, params
+
+
+def fetch_profile_comments(conn, post_ids: list[int]) -> dict[int, list[dict]]:
+    """All comments of the given posts, grouped by post_id."""
+    comments_by_post: dict[int, list[dict]] = {}
+    if not post_ids:
+        return comments_by_post
+
+    placeholders = ",".join(["?"] * len(post_ids))
+    rows = conn.execute(
+        f"""
+        SELECT
+            comments.id,
+            comments.post_id,
+            comments.content,
+            comments.created_at,
+            users.username
+        FROM comments
+        JOIN users ON users.id = comments.user_id
+        WHERE comments.post_id IN ({placeholders})
+        ORDER BY comments.id ASC
+        """,
+        tuple(post_ids),
+    ).fetchall()
+
+    for r in rows:
+        r = dict(r)
+        r["created_at"] = format_time(r.get("created_at", ""))
+        comments_by_post.setdefault(r["post_id"], []).append(r)
+    return comments_by_post
+
+
 @app.route("/u/<username>")
 def profile(username):
     viewer = current_user()
-    conn = get_db()
+    conn = archive.fallthrough(get_db())
 
     user_row = conn.execute(
         "SELECT id, username FROM users WHERE username = ?",
@@ -684,6 +1020,9 @@ def profile(username):
     if not user_row:
         conn.close()
         abort(404)
+    if sharded is not None:
+        conn.close()
+        conn = sharded.connect(sharded.shard_of(user_row["id"]))
 
     # 追蹤數量
     followers_count = conn.execute(
@@ -707,86 +1046,48 @@ def profile(username):
 
     # 抓此使用者的貼文，並且帶 like_count, comment_count, liked_by_me
     viewer_id = viewer["id"] if viewer else None
-    posts = conn.execute(
-        """
-        SELECT
-            posts.id,
-            posts.content,
-            posts.created_at,
-            users.username,
-            COALESCE(lc.cnt, 0) AS like_count,
-            COALESCE(cc.cnt, 0) AS comment_count,
-            CASE
-                WHEN ? IS NULL THEN 0
-                WHEN EXISTS (
-                    SELECT 1
-                    FROM likes
-                    WHERE likes.post_id = posts.id AND likes.user_id = ?
-                ) THEN 1
-                ELSE 0
-            END AS liked_by_me
-        FROM posts
-        JOIN users ON users.id = posts.user_id
-        LEFT JOIN (
-            SELECT post_id, COUNT(*) AS cnt
-            FROM likes
-            GROUP BY post_id
-        ) AS lc ON lc.post_id = posts.id
-        LEFT JOIN (
-            SELECT post_id, COUNT(*) AS cnt
-            FROM comments
-            GROUP BY post_id
-        ) AS cc ON cc.post_id = posts.id
-        WHERE posts.user_id = ?
-        ORDER BY posts.id DESC
-        """,
-        (viewer_id, viewer_id, user_row["id"]),
-    ).fetchall()
-
-    posts = [dict(p) for p in posts]
-    for p in posts:
-        p["created_at"] = format_time(p.get("created_at", ""))
-
-    # 抓留言，依 post_id 分組
-    post_ids = [p["id"] for p in posts]
-    comments_by_post: dict[int, list[dict]] = {}
-
-    if post_ids:
-        placeholders = ",".join(["?"] * len(post_ids))
-        rows = conn.execute(
-            f"""
-            SELECT
-                comments.id,
-                comments.post_id,
-                comments.content,
-                comments.created_at,
-                users.username
-            FROM comments
-            JOIN users ON users.id = comments.user_id
-            WHERE comments.post_id IN ({placeholders})
-            ORDER BY comments.id ASC
-            """,
-            tuple(post_ids),
-        ).fetchall()
-
-        rows = [dict(r) for r in rows]
-        for r in rows:
-            r["created_at"] = format_time(r.get("created_at", ""))
-            comments_by_post.setdefault(r["post_id"], []).append(r)
-
-    conn.close()
 
-    return render_template(
-        "profile.html",
+    context = dict(
         user=viewer,
         profile_user=user_row,
-        posts=posts,
-        comments_by_post=comments_by_post,
         followers_count=followers_count,
         following_count=following_count,
         is_following=is_following,
     )
 
+    if streaming.enabled():
+        # 分批讀貼文與留言，邊讀邊輸出；comments_by_post 只保留目前這一批
+        comments_by_post: dict[int, list[dict]] = {}
+
+        def fetch(after, size):
+            return conn.execute(*profile_posts_query(viewer_id, user_row["id"], after, size)).fetchall()
+
+        def stream_posts():
+            try:
+                for rows in streaming.pages(fetch, lambda p: p["id"]):
+                    batch = [dict(p) for p in rows]
+                    comments_by_post.clear()
+                    comments_by_post.update(fetch_profile_comments(conn, [p["id"] for p in batch]))
+                    for p in batch:
+                        p["created_at"] = format_time(p.get("created_at", ""))
+                        yield p
+            finally:
+                conn.close()
+
+        return streaming.template_response(
+            "profile.html", posts=stream_posts(), comments_by_post=comments_by_post, **context
+        )
+
+    posts = [dict(p) for p in conn.execute(*profile_posts_query(viewer_id, user_row["id"])).fetchall()]
+    for p in posts:
+        p["created_at"] = format_time(p.get("created_at", ""))
+
+    # 抓留言，依 post_id 分組
+    comments_by_post = fetch_profile_comments(conn, [p["id"] for p in posts])
+
+    conn.close()
+
+    return render_template("profile.html", posts=posts, comments_by_post=comments_by_post, **context)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+"""
+Hot/cold tiering: old posts and their likes and comments move to an archive file.
+
+    ARCHIVE_PATH=archive.db python archive.py run [--days 90] [--batch 500] [--pause-ms 20]
+    ARCHIVE_PATH=archive.db python archive.py status
+
+    ARCHIVE_PATH          SQLite file holding archived posts / likes / comments
+                          (unset: no archive, nothing changes)
+    ARCHIVE_AFTER_DAYS    posts older than this are archived by `run` (default 90)
+
+Feeds only read recent posts, so they keep reading the hot tables alone and
+their indexes and pages stay small.  A post moves together with all of its
+likes and comments: counts of hot posts never need the archive.
+
+Reads that can reach old posts (profile pages, /api/users/<name>/posts,
+exports) use fallthrough(conn): it attaches the archive and creates TEMP
+views named posts, likes and comments over both files.  Temp objects shadow
+the main tables for unqualified names, so the existing SQL reads both tiers
+unchanged.  Those connections are for reading only.
+
+Likes, unlikes and comments on archived posts still work: the writer
+(writer.py) attaches the archive, writes new likes and comments to the hot
+tables, deletes an unliked like from both tiers, and bumps the post's
+version in both, so the cached card of an archived post is re-rendered.
+The next `run` moves such stragglers into the archive too.
+
+`run` works in batches of --batch posts, pausing --pause-ms between batches
+so web writers get the lock in between.  Each batch is two transactions,
+each writing a single file (SQLite does not commit across WAL files
+atomically):
+
+    copy     into the archive: posts still hot overwrite their archived
+             copy (version included), likes and comments they no longer
+             have are dropped from it, the rest is added with INSERT OR IGNORE
+    delete   from the hot tables: a post only while its archived copy has
+             the same version, then the likes and comments the archive holds
+             of posts that are no longer hot
+
+Between the two, web writes still go to the hot rows and, through the
+writer's two-tier unlike and version bump, to the copies: a new like or
+comment stays hot as a straggler of the archived post, an unlike leaves
+nothing behind in either tier.  A post whose versions still differ stays
+hot for the next batch.  Posts and comments keep their ids (AUTOINCREMENT
+never hands them out again).  A run that stops between the two leaves the
+batch in both tiers; fallthrough reads show it twice until the next run,
+which finishes it.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+PATH = os.environ.get("ARCHIVE_PATH") or None
+AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 90))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS likes (
+        user_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, post_id)
+    );
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY,
+        post_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS posts_user_id ON posts (user_id, id);
+    CREATE INDEX IF NOT EXISTS likes_post_id ON likes (post_id);
+    CREATE INDEX IF NOT EXISTS comments_post_id ON comments (post_id);
+"""
+
+COLUMNS = {
+    "posts": "id, user_id, content, created_at, version",
+    "likes": "user_id, post_id, created_at",
+    "comments": "id, post_id, user_id, content, created_at",
+}
+
+
+def init():
+    """Creates the archive tables (no-op without ARCHIVE_PATH)."""
+    if not PATH:
+        return
+    conn = sqlite3.connect(PATH)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    conn.close()
+
+
+def attach(conn) -> bool:
+    """Attaches the archive to conn as schema "archive"; must run outside a transaction."""
+    if not PATH:
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive", (PATH,))
+    return True
+
+
+def fallthrough(conn):
+    """Makes posts / likes / comments on conn read both tiers.  Returns conn."""
+    if attach(conn):
+        for table, columns in COLUMNS.items():
+            union = f"SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM archive.{table}"
+            if table == "posts":
+                # LIMIT -1 stops the planner from copying the whole outer query
+                # into both arms, which would run its like / comment aggregates twice
+                union = f"SELECT * FROM ({union}) LIMIT -1"
+            conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+    return conn
+
+
+def reading(connect):
+    """Wraps a connect() for read paths that should fall through to the archive."""
+    if not PATH:
+        return connect
+    return lambda: fallthrough(connect())
+
+
+# -- archival job --
+
+KEYS = {
+    "posts": "archive.posts.id = main.posts.id",
+    "likes": "archive.likes.user_id = main.likes.user_id AND archive.likes.post_id = main.likes.post_id",
+    "comments": "archive.comments.id = main.comments.id",
+}
+
+
+def _copy(conn, post_ids: list[int]):
+    """First half of a move: one transaction that writes only the archive."""
+    placeholders = ",".join("?" * len(post_ids))
+    hot = f"(SELECT id FROM main.posts WHERE id IN ({placeholders}))"
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # the hot copy is the current one; an earlier, interrupted copy may be stale
+        conn.execute(
+            f"INSERT OR REPLACE INTO archive.posts ({COLUMNS['posts']}) "
+            f"SELECT {COLUMNS['posts']} FROM main.posts WHERE id IN ({placeholders})",
+            post_ids,
+        )
+        for table in ("likes", "comments"):
+            conn.execute(
+                f"DELETE FROM archive.{table} WHERE post_id IN {hot} "
+                f"AND NOT EXISTS (SELECT 1 FROM main.{table} WHERE {KEYS[table]})",
+                post_ids,
+            )
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.{table} ({COLUMNS[table]}) "
+                f"SELECT {COLUMNS[table]} FROM main.{table} WHERE post_id IN ({placeholders})",
+                post_ids,
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _delete(conn, post_ids: list[int]) -> dict[str, int]:
+    """Second half: one transaction that writes only main; returns the rows that left it."""
+    placeholders = ",".join("?" * len(post_ids))
+    moved = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # a like or comment since the copy bumped the version: that post waits for the next batch
+        moved["posts"] = conn.execute(
+            f"DELETE FROM main.posts WHERE id IN ({placeholders}) AND EXISTS "
+            f"(SELECT 1 FROM archive.posts WHERE {KEYS['posts']} AND archive.posts.version = main.posts.version)",
+            post_ids,
+        ).rowcount
+        for table in ("likes", "comments"):
+            moved[table] = conn.execute(
+                f"DELETE FROM main.{table} WHERE post_id IN ({placeholders}) "
+                f"AND post_id NOT IN (SELECT id FROM main.posts) "
+                f"AND EXISTS (SELECT 1 FROM archive.{table} WHERE {KEYS[table]})",
+                post_ids,
+            ).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return moved
+
+
+def _move(conn, post_ids: list[int]) -> dict[str, int]:
+    # SQLite does not commit a transaction over two WAL files atomically
+    _copy(conn, post_ids)
+    return _delete(conn, post_ids)
+
+
+def _stragglers(conn, table: str, batch: int) -> list[int]:
+    """Ids of archived posts that got new likes or comments in the hot tables."""
+    rows = conn.execute(
+        f"SELECT DISTINCT post_id FROM main.{table} WHERE post_id IN (SELECT id FROM archive.posts) LIMIT ?",
+        (batch,),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def run(db_path: str, days: float = AFTER_DAYS, batch: int = 500, pause: float = 0.02, log=print) -> dict[str, int]:
+    if not PATH:
+        raise SystemExit("ARCHIVE_PATH is not set")
+    init()
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    totals = {"posts": 0, "likes": 0, "comments": 0}
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    attach(conn)
+    try:
+        while True:
+            # oldest first, so id order and created_at order agree on what is left
+            ids = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT id FROM main.posts WHERE created_at < ? ORDER BY id LIMIT ?", (cutoff, batch)
+                ).fetchall()
+            ]
+            if not ids:
+                break
+            moved = _move(conn, ids)
+            for table, n in moved.items():
+                totals[table] += n
+            if not any(moved.values()):
+                break  # every post in the batch changed meanwhile; the next run retries
+            time.sleep(pause)
+
+        for table in ("likes", "comments"):
+            while ids := _stragglers(conn, table, batch):
+                moved = _move(conn, ids)
+                for name, n in moved.items():
+                    totals[name] += n
+                if not any(moved.values()):
+                    break
+                time.sleep(pause)
+    finally:
+        conn.close()
+
+    log(
+        f"archived {totals['posts']:,} posts, {totals['likes']:,} likes, {totals['comments']:,} comments "
+        f"older than {cutoff[:10]} in {time.perf_counter() - started:.1f}s"
+    )
+    return totals
+
+
+def status(db_path: str, log=print):
+    conn = sqlite3.connect(db_path)
+    tiers = [("hot", "main", db_path)]
+    if attach(conn):
+        tiers.append(("archive", "archive", PATH))
+    for label, schema, path in tiers:
+        counts = ", ".join(
+            f"{conn.execute(f'SELECT COUNT(*) FROM {schema}.{t}').fetchone()[0]:,} {t}" for t in COLUMNS
+        )
+        page_size = conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0]
+        pages = conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+        free = conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+        oldest = conn.execute(f"SELECT MIN(created_at) FROM {schema}.posts").fetchone()[0]
+        log(
+            f"{label:<8} {path}: {counts}; {pages * page_size / 1e6:.1f} MB "
+            f"({free * page_size / 1e6:.1f} MB free pages), oldest post {(oldest or '-')[:10]}"
+        )
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old posts into the archive database.")
+    parser.add_argument("what", choices=["run", "status"])
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH", "database.db"), help="hot SQLite file")
+    parser.add_argument("--days", type=float, default=AFTER_DAYS, help="archive posts older than this")
+    parser.add_argument("--batch", type=int, default=500, help="posts per transaction")
+    parser.add_argument("--pause-ms", type=float, default=20, help="pause between batches")
+    args = parser.parse_args()
+
+    if args.what == "run":
+        run(args.db, args.days, args.batch, args.pause_ms / 1000)
+    status(args.db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
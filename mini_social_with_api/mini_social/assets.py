@@ -0,0 +1,197 @@
+"""
+Static asset pipeline: content-hashed file names, precompression and
+immutable caching.
+
+    python assets.py build     # static/* -> static/dist/, writes manifest.json
+
+build copies every file under static/ (except dist/ itself) to
+static/dist/<dir>/<name>.<hash>.<ext>, next to a .gz copy and, when the
+optional brotli package is installed, a .br copy.  The mapping from logical
+name to hashed name goes to static/dist/manifest.json.
+
+Templates use {{ asset_url("styles.css") }}.  With a manifest it points at
+/assets/<hashed name>, served with "Cache-Control: public, max-age=31536000,
+immutable" and the best precompressed variant the client accepts, so repeat
+page views never revalidate CSS/JS; a changed file gets a new name.  Without
+a manifest (development) it falls back to the plain /static URL.
+
+At startup every manifest entry is checked against its source: a file
+edited (or deleted) since the last build is served from /static instead of
+the stale build, with a warning naming it, until assets.py build is re-run.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import sys
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always built
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+
+HASH_LENGTH = 12
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+logger = logging.getLogger(__name__)
+
+# only text assets are worth compressing; images/fonts are already compressed
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+MIN_COMPRESS_BYTES = 256
+
+# (Content-Encoding, file suffix) in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def hashed_name(logical: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(logical)
+    return f"{root}.{digest}{ext}"
+
+
+def _sources(static_dir: str):
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        if os.path.abspath(dirpath) == os.path.abspath(static_dir):
+            dirnames[:] = [d for d in dirnames if d != "dist"]
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            yield os.path.relpath(path, static_dir).replace(os.sep, "/"), path
+
+
+def build(static_dir: str = STATIC_DIR, dist_dir: str = DIST_DIR) -> dict:
+    """Rebuild dist_dir from scratch and return the manifest."""
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for logical, path in _sources(static_dir):
+        with open(path, "rb") as f:
+            data = f.read()
+        target = hashed_name(logical, data)
+        manifest[logical] = target
+
+        out = os.path.join(dist_dir, target)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        with open(out, "wb") as f:
+            f.write(data)
+
+        sizes = [f"{len(data):,}"]
+        if os.path.splitext(logical)[1] in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+            # mtime=0 keeps the .gz byte-identical across builds
+            variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", brotli.compress(data, quality=11)))
+            for suffix, blob in variants:
+                if len(blob) < len(data):
+                    with open(out + suffix, "wb") as f:
+                        f.write(blob)
+                    sizes.append(f"{suffix[1:]} {len(blob):,}")
+        print(f"  {logical} -> {target} ({', '.join(sizes)} bytes)")
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    if brotli is None:
+        print("  brotli not installed; only gzip variants were written")
+    return manifest
+
+
+def load_manifest(dist_dir: str = DIST_DIR) -> dict:
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def stale_entries(manifest: dict, static_dir: str = STATIC_DIR) -> list[str]:
+    """Logical names whose source no longer matches the hashed build."""
+    stale = []
+    for logical, hashed in manifest.items():
+        try:
+            with open(os.path.join(static_dir, logical), "rb") as f:
+                current = hashed_name(logical, f.read())
+        except FileNotFoundError:
+            current = None
+        if current != hashed:
+            stale.append(logical)
+    return stale
+
+
+def _accepted_encodings() -> set[str]:
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def serve_asset(filename: str):
+    if os.path.splitext(filename)[1] in (".gz", ".br") or filename == MANIFEST_NAME:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    accepted = _accepted_encodings()
+
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(os.path.join(DIST_DIR, filename + suffix)):
+            response = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype, max_age=31536000)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=31536000)
+
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def install(app):
+    manifest = load_manifest()
+    stale = stale_entries(manifest)
+    if stale:
+        logger.warning(
+            "static/dist is older than %s; serving %s from /static until `python assets.py build` is re-run",
+            ", ".join(stale),
+            "it" if len(stale) == 1 else "them",
+        )
+        manifest = {k: v for k, v in manifest.items() if k not in stale}
+
+    def asset_url(filename: str) -> str:
+        hashed = manifest.get(filename)
+        if hashed is None:
+            return url_for("static", filename=filename)
+        return url_for("assets", filename=hashed)
+
+    app.add_url_rule("/assets/<path:filename>", "assets", serve_asset)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.extensions["assets_manifest"] = manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets.")
+    parser.add_argument("command", choices=["build"])
+    parser.parse_args()
+
+    print(f"Building {os.path.relpath(DIST_DIR)}")
+    manifest = build()
+    print(f"{len(manifest)} assets, manifest at {os.path.join(os.path.relpath(DIST_DIR), MANIFEST_NAME)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
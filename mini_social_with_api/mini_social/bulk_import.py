@@ -0,0 +1,432 @@
+"""
+Bulk import of users, follows, posts, likes and comments.
+
+    python bulk_import.py dump.ndjson                       # e.g. from export.py dump
+    python bulk_import.py users.csv posts.csv --db big.db
+    python bulk_import.py - --format csv --table follows < follows.csv
+    DATABASE_URL=postgresql://... python bulk_import.py dump.ndjson
+
+Input is NDJSON (one object per line with a "type": user, follow, post,
+like, comment; other types such as export.py's resume lines are skipped)
+or CSV with a header row (the table comes from --table or the file name,
+e.g. posts.csv).  Columns per type:
+
+    user     id?, username, password_hash | password, created_at?
+    follow   follower_id | follower, followee_id | followee, created_at?
+    post     id?, user_id | username, content, created_at?
+    like     user_id | username, post_id, created_at?
+    comment  id?, user_id | username, post_id, content, created_at?
+
+Users can be referenced by id or by username.  Rows without an id get the
+next free one, so imported ids never collide with existing rows (run it
+while the site is not taking writes).  Plain passwords are hashed in a
+process pool (--hash-workers); rows with password_hash are taken as is.
+
+SQLite: executemany() in batches inside large transactions with
+synchronous=OFF; secondary indexes on the imported tables are dropped
+first and rebuilt once at the end.  Postgres (DATABASE_URL, via
+db_sa.engine): COPY ... FROM STDIN per batch, then the identity sequences
+are moved past the imported ids.  Duplicate follows / likes are skipped;
+a duplicate username or id aborts the import (earlier transactions stay
+committed).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from werkzeug.security import generate_password_hash
+
+import passwords
+
+try:
+    import orjson
+except ImportError:  # optional; json is the fallback
+    orjson = None
+
+BATCH = 50_000
+COMMIT_ROWS = 1_000_000
+
+
+class Table:
+    def __init__(self, name: str, columns: tuple, required: tuple, refs: dict | None = None, ignore_conflicts=False):
+        self.name = name
+        self.columns = columns
+        self.required = required
+        # column -> alternative username field
+        self.refs = refs or {}
+        self.ignore_conflicts = ignore_conflicts
+        self.id_index = 0 if columns[0] == "id" else None
+        self.ref_indexes = [(columns.index(col), alias) for col, alias in self.refs.items()]
+        self.required_indexes = [columns.index(col) for col in required]
+        self.created_index = columns.index("created_at")
+
+
+# in foreign-key order; a batch is only written after the batches of the types before it
+TABLES = {
+    "user": Table("users", ("id", "username", "password_hash", "created_at"), ("username",)),
+    "follow": Table(
+        "follows",
+        ("follower_id", "followee_id", "created_at"),
+        ("follower_id", "followee_id"),
+        refs={"follower_id": "follower", "followee_id": "followee"},
+        ignore_conflicts=True,
+    ),
+    "post": Table("posts", ("id", "user_id", "content", "created_at"), ("user_id", "content"), refs={"user_id": "username"}),
+    "like": Table(
+        "likes",
+        ("user_id", "post_id", "created_at"),
+        ("user_id", "post_id"),
+        refs={"user_id": "username"},
+        ignore_conflicts=True,
+    ),
+    "comment": Table(
+        "comments",
+        ("id", "user_id", "post_id", "content", "created_at"),
+        ("user_id", "post_id", "content"),
+        refs={"user_id": "username"},
+    ),
+}
+ORDER = list(TABLES)
+
+# CSV file stems / --table values
+TABLE_ALIASES = {**{k: k for k in TABLES}, **{t.name: k for k, t in TABLES.items()}}
+
+
+class BadInput(ValueError):
+    """Bad input row; the message says where."""
+
+
+# -- writers --
+
+class SQLiteWriter:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA cache_size = -262144")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.pending = 0
+        self.dropped_indexes: list[tuple[str, str]] = []
+
+    def begin(self):
+        names = tuple(t.name for t in TABLES.values())
+        placeholders = ",".join(["?"] * len(names))
+        self.dropped_indexes = self.conn.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            f" AND tbl_name IN ({placeholders})",
+            names,
+        ).fetchall()
+        for name, _ in self.dropped_indexes:
+            self.conn.execute(f'DROP INDEX "{name}"')
+        self.conn.execute("BEGIN")
+
+    def max_id(self, table: str) -> int:
+        top = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        seq = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        return max(top, seq[0] if seq else 0)
+
+    def user_ids(self):
+        return self.conn.execute("SELECT id, username FROM users").fetchall()
+
+    def write(self, table: Table, rows: list):
+        verb = "INSERT OR IGNORE" if table.ignore_conflicts else "INSERT"
+        placeholders = ",".join(["?"] * len(table.columns))
+        self.conn.executemany(
+            f"{verb} INTO {table.name} ({', '.join(table.columns)}) VALUES ({placeholders})",
+            rows,
+        )
+        self.pending += len(rows)
+        if self.pending >= COMMIT_ROWS:
+            self.conn.execute("COMMIT")
+            self.conn.execute("BEGIN")
+            self.pending = 0
+
+    def finish(self, ok: bool):
+        self.conn.execute("COMMIT" if ok else "ROLLBACK")
+        for name, sql in self.dropped_indexes:
+            started = time.perf_counter()
+            self.conn.execute(sql)
+            print(f"  rebuilt index {name} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+
+
+class PostgresWriter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.raw = engine.raw_connection()
+        self.cur = self.raw.cursor()
+        self.pending = 0
+        self.staging: set[str] = set()
+
+    def begin(self):
+        pass
+
+    def max_id(self, table: str) -> int:
+        self.cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return self.cur.fetchone()[0]
+
+    def user_ids(self):
+        self.cur.execute("SELECT id, username FROM users")
+        return self.cur.fetchall()
+
+    def _copy(self, table_name: str, columns: tuple, rows: list):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)  # None -> empty unquoted field -> NULL
+        buf.seek(0)
+        self.cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+    def write(self, table: Table, rows: list):
+        if not table.ignore_conflicts:
+            self._copy(table.name, table.columns, rows)
+        else:
+            # COPY cannot skip duplicates: stage, then INSERT ... ON CONFLICT DO NOTHING
+            staging = f"_import_{table.name}"
+            if staging not in self.staging:
+                self.cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {table.name} INCLUDING DEFAULTS)")
+                self.staging.add(staging)
+            self._copy(staging, table.columns, rows)
+            cols = ", ".join(table.columns)
+            self.cur.execute(f"INSERT INTO {table.name} ({cols}) SELECT {cols} FROM {staging} ON CONFLICT DO NOTHING")
+            self.cur.execute(f"TRUNCATE {staging}")
+        self.pending += len(rows)
+        if self.pending >= COMMIT_ROWS:
+            self.raw.commit()
+            self.pending = 0
+
+    def finish(self, ok: bool):
+        if ok:
+            for table in ("users", "posts", "comments"):
+                self.cur.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"
+                )
+            self.raw.commit()
+        else:
+            self.raw.rollback()
+        self.raw.close()
+
+
+# -- readers --
+
+def _read_ndjson(f, name: str):
+    loads = orjson.loads if orjson is not None else json.loads
+    for lineno, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = loads(line)
+        except ValueError as e:
+            raise BadInput(f"{name}:{lineno}: invalid JSON ({e})") from None
+        kind = record.get("type")
+        if kind in TABLES:
+            yield kind, record, lineno
+
+
+def _read_csv(f, kind: str):
+    reader = csv.reader(f)
+    header = next(reader, None) or []
+    for lineno, row in enumerate(reader, 2):
+        yield kind, dict(zip(header, row)), lineno
+
+
+def read(path: str, fmt: str | None, table: str | None):
+    """Yields (kind, record, line number); empty strings count as missing."""
+    name = "<stdin>" if path == "-" else path
+    stem, ext = os.path.splitext(os.path.basename(path))
+    fmt = fmt or ("csv" if ext.lower() == ".csv" else "ndjson")
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        if fmt == "ndjson":
+            yield from _read_ndjson(f, name)
+        else:
+            kind = TABLE_ALIASES.get(table or stem)
+            if kind is None:
+                raise BadInput(f"{name}: cannot tell the table; pass --table ({', '.join(TABLE_ALIASES)})")
+            yield from _read_csv(f, kind)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# -- import --
+
+def _hash_one(method: str, password: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+class Importer:
+    def __init__(self, writer, hash_workers: int, hash_method: str, batch_size: int = BATCH):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.hash_method = hash_method
+        self.hash_workers = hash_workers
+        self.pool = None
+        # rows are complete value lists, except users still waiting for a hash
+        self.batches: dict[str, list[list]] = {kind: [] for kind in ORDER}
+        self.plain_passwords: list[tuple[list, str]] = []
+        self.counts = {kind: 0 for kind in ORDER}
+        self.next_ids: dict[str, int] = {}
+        self.usernames: dict[str, int] | None = None
+        self.now = datetime.utcnow().isoformat()
+        self.started = time.perf_counter()
+        self.last_report = 0.0
+
+    def add(self, kind: str, record: dict, where: str):
+        """Validates and converts one input record; where (e.g. "file:12") is only used in errors."""
+        table = TABLES[kind]
+        values = [record.get(c) or None for c in table.columns]
+
+        if table.id_index is not None:
+            values[0] = self._assign_id(table.name, values[0], where)
+        for index, alias in table.ref_indexes:
+            if values[index] is None and record.get(alias):
+                values[index] = self._user_id(record[alias], where)
+        for index in table.required_indexes:
+            if values[index] is None:
+                col = table.columns[index]
+                alias = dict(table.ref_indexes).get(index)
+                raise BadInput(f"{where}: {kind} needs {col}" + (f" or {alias}" if alias else ""))
+        if values[table.created_index] is None:
+            values[table.created_index] = self.now
+
+        if kind == "user":
+            if values[2] is None:
+                if not record.get("password"):
+                    raise BadInput(f"{where}: user needs password_hash or password")
+                self.plain_passwords.append((values, record["password"]))
+            if self.usernames is not None:
+                self.usernames[values[1]] = values[0]
+
+        batch = self.batches[kind]
+        batch.append(values)
+        if len(batch) >= self.batch_size:
+            self.flush(upto=kind)
+
+    def flush(self, upto: str | None = None):
+        for kind in ORDER:
+            self._flush(kind)
+            if kind == upto:
+                break
+
+    def _assign_id(self, table: str, value, where: str) -> int:
+        if table not in self.next_ids:
+            self.next_ids[table] = self.writer.max_id(table) + 1
+        if value is None:
+            value = self.next_ids[table]
+        else:
+            try:
+                value = int(value)
+            except ValueError:
+                raise BadInput(f"{where}: id {value!r} is not an integer") from None
+        if value >= self.next_ids[table]:
+            self.next_ids[table] = value + 1
+        return value
+
+    def _user_id(self, username: str, where: str) -> int:
+        if self.usernames is None:
+            # everything added so far must be in the database before it is read back
+            self._flush("user")
+            self.usernames = {name: uid for uid, name in self.writer.user_ids()}
+        try:
+            return self.usernames[username]
+        except KeyError:
+            raise BadInput(f"{where}: unknown username {username!r}") from None
+
+    def _flush(self, kind: str):
+        rows = self.batches[kind]
+        if not rows:
+            return
+        if kind == "user":
+            self._hash_passwords()
+        self.writer.write(TABLES[kind], rows)
+        self.counts[kind] += len(rows)
+        self.batches[kind] = []
+        self.report()
+
+    def _hash_passwords(self):
+        if not self.plain_passwords:
+            return
+        hash_fn = partial(_hash_one, self.hash_method)
+        plain = [pw for _, pw in self.plain_passwords]
+        if self.hash_workers <= 0:
+            hashes = map(hash_fn, plain)
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.hash_workers)
+            hashes = self.pool.map(hash_fn, plain, chunksize=max(1, len(plain) // (self.hash_workers * 4)))
+        for (values, _), pw_hash in zip(self.plain_passwords, hashes):
+            values[2] = pw_hash
+        self.plain_passwords = []
+
+    def report(self, final: bool = False):
+        now = time.perf_counter()
+        if not final and now - self.last_report < 2.0:
+            return
+        self.last_report = now
+        total = sum(self.counts.values())
+        elapsed = max(now - self.started, 1e-9)
+        parts = ", ".join(f"{TABLES[k].name} {n:,}" for k, n in self.counts.items() if n)
+        end = "\n" if final else "\r"
+        print(f"  {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s) [{parts}]", end=end, file=sys.stderr, flush=True)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def _writer(db_path: str | None):
+    if os.environ.get("DATABASE_URL") and not db_path:
+        import app as web
+        from db_sa import engine
+
+        web.init_db()
+        return PostgresWriter(engine)
+
+    import app_api
+
+    app_api.DB_PATH = db_path or os.environ.get("SQLITE_PATH", "database.db")
+    app_api.init_db()
+    return SQLiteWriter(app_api.DB_PATH)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import NDJSON / CSV into the database.")
+    parser.add_argument("files", nargs="+", help="input files, - for stdin")
+    parser.add_argument("--db", help="SQLite file (default: $SQLITE_PATH or database.db; DATABASE_URL for Postgres)")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="default: from the file extension")
+    parser.add_argument("--table", help="table for CSV input (default: from the file name)")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1,
+                        help="processes hashing plain passwords (0: inline)")
+    parser.add_argument("--hash-method", default=passwords.hash_method(), help="werkzeug hash method for plain passwords")
+    parser.add_argument("--batch", type=int, default=BATCH, help="rows per executemany / COPY")
+    args = parser.parse_args()
+
+    writer = _writer(args.db)
+    importer = Importer(writer, args.hash_workers, args.hash_method, args.batch)
+    ok = False
+    writer.begin()
+    try:
+        for path in args.files:
+            name = "<stdin>" if path == "-" else path
+            for kind, record, lineno in read(path, args.format, args.table):
+                importer.add(kind, record, f"{name}:{lineno}")
+        importer.flush()
+        ok = True
+    except BadInput as e:
+        print(f"\nImport failed: {e}", file=sys.stderr)
+    finally:
+        writer.finish(ok)
+        importer.close()
+    importer.report(final=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Negotiated gzip / brotli compression of dynamic responses.
+
+Runs as an after_request hook.  The encoding is picked from Accept-Encoding
+(q-values respected; br preferred when the optional brotli package is
+installed).  Responses are left alone when they are small, not a text type,
+already encoded (e.g. the precompressed /assets files), file downloads, or
+marked Cache-Control: no-transform.  Streamed responses are compressed chunk
+by chunk with a sync flush, so they still arrive incrementally.
+
+A compressed body is a different representation, so a strong ETag gets the
+encoding appended ("abc" -> "abc-gzip") and If-None-Match is re-checked
+against the new tag; Vary: Accept-Encoding is added to every candidate
+response so caches keep the variants apart.
+
+Environment:
+    COMPRESS_ENABLED      "0" turns compression off (e.g. behind a proxy that
+                          already compresses)
+    COMPRESS_MIN_BYTES    smallest body worth compressing (default 500)
+    COMPRESS_LEVEL        gzip level 1-9 (default 6)
+    COMPRESS_BR_QUALITY   brotli quality 0-11 (default 4)
+"""
+import os
+import zlib
+
+from flask import request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "application/xml",
+    "image/svg+xml",
+}
+
+COMPRESS_BYTES = metrics.Counter(
+    "mini_social_compress_bytes_total",
+    "Response body bytes before (in) and after (out) compression.",
+    ("encoding", "direction"),
+)
+
+
+class Compressor:
+    def __init__(self, min_bytes: int = 500, level: int = 6, br_quality: int = 4):
+        self.min_bytes = min_bytes
+        self.level = level
+        self.br_quality = br_quality
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            min_bytes=int(os.environ.get("COMPRESS_MIN_BYTES", 500)),
+            level=int(os.environ.get("COMPRESS_LEVEL", 6)),
+            br_quality=int(os.environ.get("COMPRESS_BR_QUALITY", 4)),
+        )
+
+    # -- encoders --
+
+    def _encoder(self, encoding: str):
+        """(compress_chunk, sync_flush, finish) for a new stream."""
+        if encoding == "br":
+            c = brotli.Compressor(quality=self.br_quality)
+            return c.process, c.flush, c.finish
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31: gzip container
+        return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(data, quality=self.br_quality)
+        return zlib.compress(data, self.level, wbits=31)
+
+    def compress_stream(self, chunks, encoding: str):
+        compress, sync_flush, finish = self._encoder(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if not chunk:
+                    continue
+                # flush each chunk so the client still receives it right away
+                out = compress(chunk) + sync_flush()
+                COMPRESS_BYTES.inc(encoding, "in", amount=len(chunk))
+                COMPRESS_BYTES.inc(encoding, "out", amount=len(out))
+                yield out
+            tail = finish()
+            COMPRESS_BYTES.inc(encoding, "out", amount=len(tail))
+            yield tail
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    # -- hook --
+
+    def _wanted(self, response) -> bool:
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if response.direct_passthrough or "Content-Encoding" in response.headers:
+            return False
+        mimetype = response.mimetype or ""
+        if not (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES):
+            return False
+        if "no-transform" in response.headers.get("Cache-Control", ""):
+            return False
+        return True
+
+    def after_request(self, response):
+        if request.method == "HEAD" or not self._wanted(response):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                return response
+            body = self.compress(data, encoding)
+            if len(body) >= len(data):
+                return response
+            COMPRESS_BYTES.inc(encoding, "in", amount=len(data))
+            COMPRESS_BYTES.inc(encoding, "out", amount=len(body))
+            response.set_data(body)
+
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(etag if weak else f"{etag}-{encoding}", weak=weak)
+            response.make_conditional(request)
+        return response
+
+
+def install(app, compressor: Compressor | None = None):
+    """Call right after metrics.install so this hook runs after the views' own hooks."""
+    if os.environ.get("COMPRESS_ENABLED", "1") == "0":
+        return None
+    compressor = compressor or Compressor.from_env()
+    app.after_request(compressor.after_request)
+    app.extensions["compress"] = compressor
+    return compressor
@@ -1,6 +1,37 @@
+"""
+Database engines: one primary for writes, optional replicas for reads.
+
+    DATABASE_URL              primary (Postgres); SQLite at SQLITE_PATH without it
+    DATABASE_READ_URLS        comma-separated read replicas (Postgres)
+    SQLITE_REPLICA_PATHS      comma-separated SQLite copies of SQLITE_PATH, kept
+                              in sync with the backup API (local / tests)
+    REPLICA_SYNC_SECONDS      how often the SQLite copies are refreshed (default 1)
+    REPLICA_CHECK_SECONDS     how often a replica's health is re-checked (default 5)
+    REPLICA_MAX_LAG_SECONDS   replicas further behind are skipped (default 5)
+    READ_PIN_SECONDS          after a write, that user reads from the primary
+                              for this long (default: REPLICA_MAX_LAG_SECONDS)
+
+read_router.pick() hands out healthy replicas round-robin and returns None
+(= use the primary) when none is configured or healthy.  Health is checked
+lazily: at most once per REPLICA_CHECK_SECONDS per replica, a SELECT 1 plus
+a replication lag query.  Because lagging replicas are skipped and a writer
+stays pinned for at least the maximum lag, users always see their own writes.
+
+engine, SessionLocal, read_router and read_engines are created on first
+access, so importing this module opens nothing.  In a forked child
+(gunicorn workers, with or without --preload) after_fork() drops the
+inherited pools without closing the parent's sockets; each worker then opens
+its own connections.  Functions in engine_hooks are called with every engine
+created (metrics.instrument_engine, for one).
+
+SQLAlchemy itself (and through it psycopg2) is only imported when an engine
+is first needed; the SQLite code paths of app.py never load it.
+"""
+import fcntl
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import sqlite3
+import threading
+import time
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
@@ -13,12 +44,261 @@ def _normalize_database_url(url: str) -> str:
 
 if DATABASE_URL:
     DATABASE_URL = _normalize_database_url(DATABASE_URL)
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-else:
+
+engine_hooks: list = []
+
+
+def text(sql: str):
+    """sqlalchemy.text(), imported on first use."""
+    from sqlalchemy import text as sa_text
+
+    return sa_text(sql)
+
+
+def _sessionmaker(eng):
+    from sqlalchemy.orm import sessionmaker
+
+    return sessionmaker(bind=eng, autoflush=False, autocommit=False)
+
+
+def _create_engine(url: str, **kwargs):
+    from sqlalchemy import create_engine
+
+    eng = create_engine(url, **kwargs)
+    for hook in engine_hooks:
+        hook(eng)
+    return eng
+
+
+def _primary_engine():
+    if DATABASE_URL:
+        return _create_engine(DATABASE_URL, pool_pre_ping=True)
     # 本機 fallback 用 SQLite
-    engine = create_engine(
-        "sqlite:///database.db",
+    return _create_engine(
+        "sqlite:///" + os.environ.get("SQLITE_PATH", "database.db"),
         connect_args={"check_same_thread": False},
     )
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+PG_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def _env_list(name: str) -> list[str]:
+    return [v.strip() for v in os.environ.get(name, "").split(",") if v.strip()]
+
+
+# -- replicas --
+
+class EngineReplica:
+    """A Postgres streaming replica."""
+
+    def __init__(self, url: str):
+        self.name = url.rsplit("@", 1)[-1]  # host/db, no credentials
+        self.engine = _create_engine(_normalize_database_url(url), pool_pre_ping=True)
+        self.sessions = _sessionmaker(self.engine)
+
+    def lag(self) -> float:
+        with self.engine.connect() as conn:
+            return float(conn.execute(text(PG_LAG_SQL)).scalar() or 0)
+
+
+class SQLiteReplica:
+    """
+    A local copy of the SQLite database, refreshed by SQLiteReplicaSync.  The
+    file's mtime is set to the start of the last copy, so every worker can
+    tell how old it is.
+    """
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        self.path = path
+
+    def connect(self, **kwargs) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, **kwargs)
+
+    def lag(self) -> float:
+        synced_at = os.path.getmtime(self.path)
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            conn.execute("SELECT 1 FROM users LIMIT 1").fetchall()
+        finally:
+            conn.close()
+        return time.time() - synced_at
+
+
+class ReadRouter:
+    def __init__(self, replicas: list, check_seconds: float = 5.0, max_lag: float = 5.0):
+        self.replicas = replicas
+        self.check_seconds = check_seconds
+        self.max_lag = max_lag
+        self.healthy = {r.name: False for r in replicas}
+        self.checked_at = {r.name: 0.0 for r in replicas}
+        self.errors: dict[str, str] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def check(self, replica) -> bool:
+        try:
+            lag = replica.lag()
+            ok = lag <= self.max_lag
+            error = None if ok else f"lag {lag:.1f}s"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        self.healthy[replica.name] = ok
+        self.checked_at[replica.name] = time.monotonic()
+        if error:
+            self.errors[replica.name] = error
+        else:
+            self.errors.pop(replica.name, None)
+        return ok
+
+    def mark_down(self, replica):
+        """For callers whose query on a replica failed; it is re-checked after check_seconds."""
+        self.healthy[replica.name] = False
+        self.checked_at[replica.name] = time.monotonic()
+
+    def pick(self):
+        """Next healthy replica, or None for the primary."""
+        if not self.replicas:
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        now = time.monotonic()
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if now - self.checked_at[replica.name] >= self.check_seconds:
+                self.check(replica)
+            if self.healthy[replica.name]:
+                return replica
+        return None
+
+    def status(self) -> list[dict]:
+        return [
+            {"name": r.name, "healthy": self.healthy[r.name], "error": self.errors.get(r.name)}
+            for r in self.replicas
+        ]
+
+
+class SQLiteReplicaSync(threading.Thread):
+    """
+    Copies the primary SQLite file onto each replica every `interval` seconds.
+    Every worker runs one; a lock file next to the primary makes sure only
+    one of them copies at a time.
+    """
+
+    def __init__(self, primary_path: str, replicas: list[SQLiteReplica], interval: float = 1.0):
+        super().__init__(name="sqlite-replica-sync", daemon=True)
+        self.primary_path = primary_path
+        self.replicas = replicas
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def sync_once(self) -> bool:
+        with open(self.primary_path + ".sync-lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # another worker is copying right now
+            src = sqlite3.connect(self.primary_path)
+            try:
+                for replica in self.replicas:
+                    started = time.time()
+                    dst = replica.connect()
+                    try:
+                        # all pages in one step: the copy is a consistent snapshot
+                        src.backup(dst)
+                    finally:
+                        dst.close()
+                    os.utime(replica.path, (started, started))
+            finally:
+                src.close()
+        return True
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync_once()
+            except sqlite3.Error:
+                pass  # primary busy; the replicas just age and the next round retries
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
+READ_PIN_SECONDS = float(os.environ.get("READ_PIN_SECONDS", MAX_LAG_SECONDS))
+
+_state: dict = {}
+_state_lock = threading.RLock()
+_sync = None
+
+
+def _build(name: str):
+    if name == "engine":
+        return _primary_engine()
+    if name == "SessionLocal":
+        return _sessionmaker(_get("engine"))
+    if name == "read_router":
+        if DATABASE_URL:
+            replicas = [EngineReplica(url) for url in _env_list("DATABASE_READ_URLS")]
+        else:
+            replicas = [SQLiteReplica(path) for path in _env_list("SQLITE_REPLICA_PATHS")]
+        return ReadRouter(
+            replicas,
+            check_seconds=float(os.environ.get("REPLICA_CHECK_SECONDS", 5)),
+            max_lag=MAX_LAG_SECONDS,
+        )
+    if name == "read_engines":
+        return [r.engine for r in _get("read_router").replicas if isinstance(r, EngineReplica)]
+    raise AttributeError(f"module 'db_sa' has no attribute '{name}'")
+
+
+def _get(name: str):
+    value = _state.get(name)
+    if value is None:
+        with _state_lock:
+            value = _state.get(name)
+            if value is None:
+                value = _state[name] = _build(name)
+    return value
+
+
+def __getattr__(name: str):
+    # engine, SessionLocal, read_router, read_engines
+    return _get(name)
+
+
+def after_fork():
+    """In a forked child: forget the parent's pooled connections (they stay open for the parent)."""
+    global _state_lock, _sync
+    # another thread may have held these at the fork
+    _state_lock = threading.RLock()
+    if "read_router" in _state:
+        _state["read_router"]._lock = threading.Lock()
+    engines = ([_state["engine"]] if "engine" in _state else []) + [
+        r.engine for r in getattr(_state.get("read_router"), "replicas", []) if isinstance(r, EngineReplica)
+    ]
+    for eng in engines:
+        eng.dispose(close=False)
+    _sync = None  # threads do not survive fork
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+def start_replica_sync(primary_path: str):
+    """Starts the SQLite copy thread (no-op without SQLITE_REPLICA_PATHS)."""
+    global _sync
+    sqlite_replicas = [r for r in _get("read_router").replicas if isinstance(r, SQLiteReplica)]
+    if not sqlite_replicas or _sync is not None:
+        return _sync
+    _sync = SQLiteReplicaSync(primary_path, sqlite_replicas, float(os.environ.get("REPLICA_SYNC_SECONDS", 1)))
+    _sync.sync_once()
+    _sync.start()
+    return _sync
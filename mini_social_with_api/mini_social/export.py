@@ -0,0 +1,241 @@
+"""
+NDJSON export of one user's data, and a full-database dump.
+
+    GET /api/users/<username>/export[?resume=TOKEN]    (the user or ADMIN_USERS)
+    python export.py user <username> [--db PATH] [--resume TOKEN] [--out FILE]
+    python export.py dump [--db PATH] [--resume TOKEN] [--out FILE]
+
+Every line is one JSON object with a "type" (user, post, comment, like,
+follow, follower).  After each chunk a {"type": "resume", "token": ...}
+line is written; passing the last token seen restarts the export right
+after that chunk.
+
+Tables are read in keyset order, CHUNK_ROWS rows per query, and each chunk
+is fetched completely with fetchmany() before any of it is written.  So
+memory stays bounded by one chunk, and no statement is left open while a
+slow client reads.  On SQLite the shared lock is released between chunks,
+so writers are never blocked for longer than one chunk read.  With
+DATABASE_URL set, the dump reads Postgres through db_sa.engine using
+server-side cursors.  With ARCHIVE_PATH set, SQLite exports include
+archived posts, likes and comments (archive.py).
+
+The dump includes password hashes, so it can restore accounts as they were
+(python bulk_import.py dump.ndjson).
+"""
+import argparse
+import base64
+import json
+import os
+import sqlite3
+import sys
+
+import archive
+
+CHUNK_ROWS = 1000
+
+
+class Section:
+    """One table, read in keyset order over `keys`, optionally scoped by `where`."""
+
+    def __init__(self, name: str, table: str, columns: str, keys: tuple, where: str = ""):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.keys = keys
+        self.where = where
+
+    def sql(self, after) -> str:
+        conditions = [self.where] if self.where else []
+        if after is not None:
+            if len(self.keys) == 1:
+                conditions.append(f"{self.keys[0]} > ?")
+            else:
+                placeholders = ", ".join(["?"] * len(self.keys))
+                conditions.append(f"({', '.join(self.keys)}) > ({placeholders})")
+        where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+        return f"SELECT {self.columns} FROM {self.table} {where_sql} ORDER BY {', '.join(self.keys)} LIMIT ?"
+
+
+def user_sections() -> list[Section]:
+    # every query takes the user id as its first parameter
+    return [
+        Section("user", "users", "id, username, created_at", ("id",), "id = ?"),
+        Section("post", "posts", "id, content, created_at", ("id",), "user_id = ?"),
+        Section("comment", "comments", "id, post_id, content, created_at", ("id",), "user_id = ?"),
+        Section("like", "likes", "post_id, created_at", ("post_id",), "user_id = ?"),
+        Section("follow", "follows", "followee_id, created_at", ("followee_id",), "follower_id = ?"),
+        Section("follower", "follows", "follower_id, created_at", ("follower_id",), "followee_id = ?"),
+    ]
+
+
+def dump_sections() -> list[Section]:
+    # in foreign-key order, so the dump can be imported as is
+    return [
+        Section("user", "users", "id, username, password_hash, created_at", ("id",)),
+        Section("follow", "follows", "follower_id, followee_id, created_at", ("follower_id", "followee_id")),
+        Section("post", "posts", "id, user_id, content, created_at", ("id",)),
+        Section("like", "likes", "user_id, post_id, created_at", ("user_id", "post_id")),
+        Section("comment", "comments", "id, user_id, post_id, content, created_at", ("id",)),
+    ]
+
+
+class InvalidResumeToken(ValueError):
+    pass
+
+
+def encode_token(section: int, key) -> str:
+    raw = json.dumps([section, key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str, n_sections: int) -> tuple[int, list | None]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        section, key = json.loads(raw)
+    except Exception:
+        raise InvalidResumeToken("Malformed resume token.") from None
+    if not isinstance(section, int) or not 0 <= section < n_sections:
+        raise InvalidResumeToken("Resume token does not match this export.")
+    if key is not None and not isinstance(key, list):
+        raise InvalidResumeToken("Malformed resume token.")
+    return section, key
+
+
+# -- row sources --
+
+class SQLiteSource:
+    def __init__(self, connect):
+        self.connect = connect
+
+    def chunk(self, sql: str, params) -> list[dict]:
+        # a connection per chunk: the read transaction ends with it
+        conn = self.connect()
+        try:
+            cur = conn.execute(sql, params)
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchmany(CHUNK_ROWS)]
+        finally:
+            conn.close()
+
+
+class SQLAlchemySource:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def chunk(self, sql: str, params) -> list[dict]:
+        with self.engine.connect().execution_options(stream_results=True) as conn:
+            result = conn.exec_driver_sql(sql.replace("?", "%s"), tuple(params))
+            names = list(result.keys())
+            return [dict(zip(names, row)) for row in result.fetchmany(CHUNK_ROWS)]
+
+
+def records(source, sections: list[Section], scope: tuple = (), resume: str | None = None):
+    """Yields export records (dicts) followed by a resume record after every chunk."""
+    start, after = (0, None) if not resume else decode_token(resume, len(sections))
+    for index in range(start, len(sections)):
+        section = sections[index]
+        if index != start:
+            after = None
+        while True:
+            params = (*scope, *(after or ()), CHUNK_ROWS)
+            rows = source.chunk(section.sql(after), params)
+            for row in rows:
+                yield {"type": section.name, **row}
+            if len(rows) < CHUNK_ROWS:
+                break
+            after = [rows[-1][k] for k in section.keys]
+            yield {"type": "resume", "token": encode_token(index, after)}
+        if index + 1 < len(sections):
+            yield {"type": "resume", "token": encode_token(index + 1, None)}
+
+
+def ndjson(records_iter, dumps=None):
+    dumps = dumps or (lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")))
+    for record in records_iter:
+        yield dumps(record) + "\n"
+
+
+# -- HTTP --
+
+def install(app, get_db, current_user):
+    """Adds GET /api/users/<username>/export to an sqlite-backed app."""
+    from flask import Response, jsonify, request
+
+    import profiler
+    import streaming
+
+    def export_user(username):
+        viewer = current_user()
+        if not viewer:
+            return jsonify({"error": "Authentication required."}), 401
+        if viewer["username"] != username and viewer["username"] not in profiler.admin_usernames():
+            return jsonify({"error": "You can only export your own data."}), 403
+
+        conn = get_db()
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        conn.close()
+        if not row:
+            return jsonify({"error": "User not found."}), 404
+
+        sections = user_sections()
+        resume = request.args.get("resume") or None
+        try:
+            if resume:
+                decode_token(resume, len(sections))
+        except InvalidResumeToken as e:
+            return jsonify({"error": str(e)}), 400
+
+        lines = ndjson(records(SQLiteSource(get_db), sections, (row["id"],), resume), app.json.dumps)
+        return Response(
+            streaming.buffered(lines),
+            mimetype="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{username}.ndjson"'},
+        )
+
+    app.add_url_rule("/api/users/<username>/export", "api_export_user", export_user)
+
+
+# -- CLI --
+
+def _source(db_path: str | None):
+    if os.environ.get("DATABASE_URL") and not db_path:
+        from db_sa import engine
+
+        return SQLAlchemySource(engine)
+    path = db_path or os.environ.get("SQLITE_PATH", "database.db")
+    return SQLiteSource(archive.reading(lambda: sqlite3.connect(path)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export data as NDJSON.")
+    parser.add_argument("what", choices=["user", "dump"])
+    parser.add_argument("username", nargs="?")
+    parser.add_argument("--db", help="SQLite file (default: $SQLITE_PATH or database.db; DATABASE_URL for Postgres)")
+    parser.add_argument("--resume", help="resume token from an earlier, interrupted export")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    source = _source(args.db)
+    if args.what == "user":
+        if not args.username:
+            parser.error("user export needs a username")
+        row = source.chunk("SELECT id FROM users WHERE username = ? LIMIT ?", (args.username, 1))
+        if not row:
+            print(f"No such user: {args.username}", file=sys.stderr)
+            return 1
+        sections, scope = user_sections(), (row[0]["id"],)
+    else:
+        sections, scope = dump_sections(), ()
+
+    out = open(args.out, "a" if args.resume else "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for line in ndjson(records(source, sections, scope, args.resume)):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
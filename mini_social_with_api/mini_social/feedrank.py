@@ -0,0 +1,361 @@
+"""
+Ranked following feed: candidates from followees, features as arrays, one NumPy scoring pass.
+
+    GET /api/posts?feed=following&order=ranked[&limit=20][&cursor=TOKEN | &before_id=ID]
+    python feedrank.py bench [--candidates 5000] [--runs 20]
+
+    FEED_RANK_CANDIDATES   newest followee posts considered per request (default 5000)
+    FEED_RANK_WEIGHTS      weight per feature (default age_hours=-0.05,likes=1.0,
+                           comments=1.5,affinity=2.0)
+    FEED_RANK_SNAPSHOTS    ranked snapshots kept per process for later pages (default 128)
+
+Candidates are the newest FEED_RANK_CANDIDATES posts of the viewer and the
+people they follow, with their like and comment counts, read in one query
+over the posts_user_id / likes_post_id / comments_post_id indexes; affinity
+is the viewer's likes per author, read from the likes primary key.  The features
+
+    age_hours   hours between the post and the request
+    likes       log1p(like count)
+    comments    log1p(comment count)
+    affinity    log1p(the viewer's likes on that author's posts)
+
+form an n x 4 matrix that is scored with one matrix-vector product, and the
+page is cut with a partition: no Python loop per candidate.
+
+The cursor pins a snapshot: it records the request time (as_of), the newest
+candidate id and the last (score, id) served.  Later pages count only likes
+and comments made before as_of, measure age from as_of and never look past
+that id, so every page ranks the same snapshot and continues strictly after
+the previous one: no post twice, none skipped (unless likes are removed or
+follows change in between).  Ties are broken by id.  before_id on the first
+page pins the snapshot to older posts, like the chronological feed; the
+cursor carries that along.  Because a snapshot never
+changes, each process keeps the last FEED_RANK_SNAPSHOTS of them and serves
+later pages without querying; another worker rebuilds the same one.
+
+Timestamps with a UTC offset are converted to naive UTC before the age is
+taken; one that does not parse counts as brand new rather than failing the
+request.
+
+NumPy is optional and imported on first use; without it order=ranked answers
+501 and the chronological feed is unaffected.
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+FEATURES = ("age_hours", "likes", "comments", "affinity")
+DEFAULT_WEIGHTS = "age_hours=-0.05,likes=1.0,comments=1.5,affinity=2.0"
+MAX_CANDIDATES = int(os.environ.get("FEED_RANK_CANDIDATES", 5000))
+SNAPSHOTS = int(os.environ.get("FEED_RANK_SNAPSHOTS", 128))
+
+CANDIDATES_SQL = """
+    SELECT
+        posts.id,
+        posts.user_id,
+        posts.created_at,
+        (SELECT COUNT(*) FROM likes
+         WHERE likes.post_id = posts.id AND likes.created_at <= ?) AS like_count,
+        (SELECT COUNT(*) FROM comments
+         WHERE comments.post_id = posts.id AND comments.created_at <= ?) AS comment_count
+    FROM posts
+    WHERE posts.user_id IN ({placeholders}) AND posts.id <= ?
+    ORDER BY posts.id DESC
+    LIMIT ?
+"""
+
+AFFINITY_SQL = """
+    SELECT posts.user_id, COUNT(*)
+    FROM likes
+    JOIN posts ON posts.id = likes.post_id
+    WHERE likes.user_id = ? AND likes.created_at <= ?
+    GROUP BY posts.user_id
+"""
+
+
+# (viewer_id, as_of, max_id) -> (ids, scores) of ranked snapshots, least recently used first
+_snapshots: OrderedDict = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def naive_utc(stamp: str) -> str | None:
+    """stamp as a naive UTC ISO timestamp (what the app stores), or None if it is not one."""
+    try:
+        dt = datetime.fromisoformat(stamp)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def parse_weights(value: str | None = None):
+    import numpy as np
+
+    weights = dict.fromkeys(FEATURES, 0.0)
+    for item in (value or os.environ.get("FEED_RANK_WEIGHTS") or DEFAULT_WEIGHTS).split(","):
+        name, _, number = item.partition("=")
+        if name.strip() not in weights:
+            raise ValueError(f"unknown feed rank feature {name.strip()!r}; use {', '.join(FEATURES)}")
+        weights[name.strip()] = float(number)
+    return np.array([weights[f] for f in FEATURES])
+
+
+def encode_cursor(as_of: str, max_id: int, score: float, post_id: int) -> str:
+    raw = json.dumps([as_of, max_id, score, post_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[str, int, float, int]:
+    try:
+        as_of, max_id, score, post_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        as_of = naive_utc(as_of)
+        if as_of is None:
+            raise ValueError("as_of")
+        return as_of, int(max_id), float(score), int(post_id)
+    except Exception:
+        raise InvalidCursor("Malformed cursor.") from None
+
+
+# -- candidates and scoring --
+
+def candidates(conn, viewer_id: int, author_ids: list[int], as_of: str, max_id: int, limit: int = MAX_CANDIDATES):
+    """(ids, features n x 4) of the newest posts by author_ids up to max_id, as of as_of."""
+    import numpy as np
+
+    rows = conn.execute(
+        CANDIDATES_SQL.format(placeholders=",".join("?" * len(author_ids))),
+        (as_of, as_of, *author_ids, max_id, limit),
+    ).fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(FEATURES)))
+    post_ids, post_authors, created_at, like_counts, comment_counts = zip(*rows)
+    ids = np.array(post_ids, dtype=np.int64)
+    authors = np.array(post_authors, dtype=np.int64)
+    try:
+        # NumPy only warns about offsets (or drops them in other versions): treat that as a miss
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            stamps = np.array(created_at, dtype="datetime64[us]")
+    except (ValueError, UserWarning, DeprecationWarning):
+        stamps = np.array([naive_utc(c) for c in created_at], dtype="datetime64[us]")
+    age = np.nan_to_num((np.datetime64(as_of, "us") - stamps) / np.timedelta64(1, "h"), nan=0.0)
+
+    liked = conn.execute(AFFINITY_SQL, (viewer_id, as_of)).fetchall()
+    affinity = np.zeros(len(ids))
+    if liked:
+        liked_authors, liked_counts = np.array(liked, dtype=np.int64).T
+        order = np.argsort(liked_authors)
+        liked_authors, liked_counts = liked_authors[order], liked_counts[order]
+        pos = np.minimum(np.searchsorted(liked_authors, authors), len(liked_authors) - 1)
+        affinity = np.where(liked_authors[pos] == authors, liked_counts[pos], 0)
+
+    features = np.column_stack(
+        (
+            np.maximum(age, 0.0),
+            np.log1p(np.array(like_counts, dtype=np.float64)),
+            np.log1p(np.array(comment_counts, dtype=np.float64)),
+            np.log1p(affinity),
+        )
+    )
+    return ids, features
+
+
+def top_page(ids, scores, limit: int, after: tuple[float, int] | None = None):
+    """Indexes of the best `limit` candidates by (score, id) descending, strictly after `after`."""
+    import numpy as np
+
+    idx = np.arange(len(ids))
+    if after is not None:
+        score, post_id = after
+        idx = idx[(scores < score) | ((scores == score) & (ids < post_id))]
+    if len(idx) > limit:
+        # O(n) cut at the limit-th best score; only what is left gets sorted
+        kth = np.partition(scores[idx], len(idx) - limit)[len(idx) - limit]
+        idx = idx[scores[idx] >= kth]
+    return idx[np.lexsort((-ids[idx], -scores[idx]))][:limit]
+
+
+def scored(conn, viewer_id: int, author_ids: list[int], as_of: str, max_id: int | None = None, weights=None):
+    """(ids, scores, max_id) of one snapshot; max_id None pins it to the newest candidate.
+
+    Snapshots are cached per process, so later pages served by the same worker
+    skip the queries; other workers rebuild the same snapshot from the cursor.
+    """
+    with _snapshots_lock:
+        hit = _snapshots.get((viewer_id, as_of, max_id))
+        if hit is not None:
+            _snapshots.move_to_end((viewer_id, as_of, max_id))
+            return (*hit, max_id)
+    ids, features = candidates(conn, viewer_id, author_ids, as_of, sys.maxsize if max_id is None else max_id)
+    if max_id is None:
+        max_id = int(ids.max()) if len(ids) else 0
+    hit = ids, features @ (parse_weights() if weights is None else weights)
+    with _snapshots_lock:
+        _snapshots[(viewer_id, as_of, max_id)] = hit
+        while len(_snapshots) > SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return (*hit, max_id)
+
+
+def rank(
+    conn,
+    viewer_id: int,
+    author_ids: list[int],
+    limit: int,
+    cursor: str | None = None,
+    weights=None,
+    before_id: int | None = None,
+):
+    """(post ids of one ranked page, next cursor or None).  Raises InvalidCursor.
+
+    before_id limits a first page to older posts; the cursor of a later page
+    already carries it, so the two cannot be combined.
+    """
+    if cursor:
+        if before_id is not None:
+            raise InvalidCursor("Use either cursor or before_id, not both.")
+        as_of, max_id, score, post_id = decode_cursor(cursor)
+        after = (score, post_id)
+    else:
+        as_of, after = datetime.utcnow().isoformat(), None
+        max_id = None if before_id is None else before_id - 1
+
+    ids, scores, max_id = scored(conn, viewer_id, author_ids, as_of, max_id, weights)
+    page = top_page(ids, scores, limit, after)
+
+    next_cursor = None
+    if len(page) == limit:
+        last = page[-1]
+        next_cursor = encode_cursor(as_of, max_id, float(scores[last]), int(ids[last]))
+    return [int(i) for i in ids[page]], next_cursor
+
+
+# -- benchmark --
+
+def bench(candidate_count: int = 5000, runs: int = 20, limit: int = 20, log=print):
+    """Times candidate generation and scoring for one viewer over candidate_count posts."""
+    import sqlite3
+    from datetime import timedelta
+
+    import numpy as np
+
+    rng = np.random.default_rng(49)
+    authors, viewer = 200, 1
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE posts (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, content TEXT NOT NULL,
+                            created_at TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE follows (follower_id INTEGER NOT NULL, followee_id INTEGER NOT NULL,
+                              created_at TEXT NOT NULL, PRIMARY KEY (follower_id, followee_id));
+        CREATE TABLE likes (user_id INTEGER NOT NULL, post_id INTEGER NOT NULL, created_at TEXT NOT NULL,
+                            PRIMARY KEY (user_id, post_id));
+        CREATE TABLE comments (id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+                               content TEXT NOT NULL, created_at TEXT NOT NULL);
+        CREATE INDEX posts_user_id ON posts (user_id, id, created_at);
+        CREATE INDEX likes_post_id ON likes (post_id, created_at);
+        CREATE INDEX comments_post_id ON comments (post_id, created_at);
+        """
+    )
+    now = datetime.utcnow()
+    # half of the posts are by people the viewer does not follow
+    total = candidate_count * 2 + candidate_count // 5
+    stamp = [(now - timedelta(minutes=int(m))).isoformat() for m in np.sort(rng.integers(0, 30 * 1440, total))[::-1]]
+    post_authors = rng.integers(2, 2 + 2 * authors, total)
+    conn.executemany(
+        "INSERT INTO posts (id, user_id, content, created_at) VALUES (?, ?, 'x', ?)",
+        ((i + 1, int(a), stamp[i]) for i, a in enumerate(post_authors)),
+    )
+    followees = list(range(2, 2 + authors))
+    conn.executemany("INSERT INTO follows VALUES (?, ?, '')", ((viewer, f) for f in followees))
+    like_counts = rng.poisson(3, total)
+    conn.executemany(
+        "INSERT OR IGNORE INTO likes VALUES (?, ?, ?)",
+        ((int(u), i + 1, stamp[i]) for i, n in enumerate(like_counts) for u in rng.integers(1, 5000, n)),
+    )
+    conn.executemany(
+        "INSERT INTO comments (post_id, user_id, content, created_at) VALUES (?, ?, 'x', ?)",
+        ((i + 1, 2, stamp[i]) for i, n in enumerate(rng.poisson(1, total)) for _ in range(n)),
+    )
+    conn.commit()
+
+    author_ids = [*followees, viewer]
+    weights = parse_weights()
+    timings = {"queries": [], "scoring": [], "first": [], "next": [], "rebuilt": []}
+    for _ in range(runs):
+        started = time.perf_counter()
+        ids, features = candidates(conn, viewer, author_ids, datetime.utcnow().isoformat(), sys.maxsize)
+        middle = time.perf_counter()
+        top_page(ids, features @ weights, limit)
+        timings["queries"].append(middle - started)
+        timings["scoring"].append(time.perf_counter() - middle)
+
+        started = time.perf_counter()
+        _, cursor = rank(conn, viewer, author_ids, limit, None, weights)
+        timings["first"].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        rank(conn, viewer, author_ids, limit, cursor, weights)
+        timings["next"].append(time.perf_counter() - started)
+        _snapshots.clear()
+        started = time.perf_counter()
+        rank(conn, viewer, author_ids, limit, cursor, weights)
+        timings["rebuilt"].append(time.perf_counter() - started)
+
+    # walk the whole ranking page by page, rebuilding the snapshot every time:
+    # every candidate exactly once
+    seen, cursor = [], None
+    while True:
+        _snapshots.clear()
+        page, cursor = rank(conn, viewer, author_ids, 50, cursor, weights)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == len(ids), (len(seen), len(set(seen)), len(ids))
+
+    labels = {
+        "queries": "candidates + features (SQL)",
+        "scoring": f"scoring + top {limit} (NumPy)",
+        "first": "first page",
+        "next": "next page, cached snapshot",
+        "rebuilt": "next page, other worker",
+    }
+    log(f"{len(ids):,} candidates from {authors} followees, {runs} runs, median / max:")
+    for name, label in labels.items():
+        ms = [t * 1000 for t in timings[name]]
+        log(f"  {label:<30} {statistics.median(ms):7.2f} ms  {max(ms):7.2f} ms")
+    log(f"  paged through all {len(seen):,} in pages of 50: no repeats, none missed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranked following feed tools.")
+    parser.add_argument("what", choices=["bench"])
+    parser.add_argument("--candidates", type=int, default=MAX_CANDIDATES, help="candidate posts per request")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    if not available():
+        raise SystemExit("feedrank needs numpy: pip install numpy")
+    bench(args.candidates, args.runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
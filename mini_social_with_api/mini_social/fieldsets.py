@@ -0,0 +1,130 @@
+"""
+Sparse fieldsets and optional includes for the JSON post lists.
+
+    ?fields=id,like_count,comment_count    post attributes to return
+    ?include=comments,viewer_state         extras, only sent when asked for
+
+Whatever is left out is left out of the SQL too: no likes / comments
+aggregates without the counts, no comment query without include=comments,
+no per-viewer EXISTS without include=viewer_state and no users lookup when
+nothing references an author.  Authors of posts and comments are sent once,
+in a "users" side table keyed by id, and referenced as author_id.
+"""
+from dataclasses import dataclass
+
+POST_FIELDS = ("id", "content", "created_at", "author", "like_count", "comment_count")
+FEED_INCLUDES = ("comments", "viewer_state")
+PROFILE_INCLUDES = ("comments", "viewer_state", "counts")
+
+LIKE_COUNTS_JOIN = """
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS cnt
+        FROM likes
+        GROUP BY post_id
+    ) AS lc ON lc.post_id = posts.id"""
+
+COMMENT_COUNTS_JOIN = """
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS cnt
+        FROM comments
+        GROUP BY post_id
+    ) AS cc ON cc.post_id = posts.id"""
+
+
+class FieldsetError(ValueError):
+    """Unknown name in fields= or include=; the message is safe to show to clients."""
+
+
+@dataclass(frozen=True)
+class Fieldset:
+    fields: frozenset
+    include: frozenset
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.fields or name in self.include
+
+
+def _names(value: str | None) -> set[str]:
+    return {v.strip() for v in (value or "").split(",") if v.strip()}
+
+
+def parse(args, includes=FEED_INCLUDES, legacy_default: bool = False) -> Fieldset | None:
+    """
+    Fieldset from the request args.  Without fields= every post attribute is
+    returned; without include= no extras are.  With legacy_default, a request
+    that has neither parameter gets None (the endpoint's original shape).
+    """
+    if legacy_default and "fields" not in args and "include" not in args:
+        return None
+
+    fields = _names(args.get("fields")) or set(POST_FIELDS)
+    unknown = fields - set(POST_FIELDS)
+    if unknown:
+        raise FieldsetError(f"Unknown field '{sorted(unknown)[0]}'. Use any of: {', '.join(POST_FIELDS)}.")
+
+    include = _names(args.get("include"))
+    unknown = include - set(includes)
+    if unknown:
+        raise FieldsetError(f"Unknown include '{sorted(unknown)[0]}'. Use any of: {', '.join(includes)}.")
+
+    # cursors and comment grouping need the id
+    fields.add("id")
+    return Fieldset(frozenset(fields), frozenset(include))
+
+
+def posts_sql(fs: Fieldset, where_sql: str, viewer_id: int | None) -> tuple[str, list]:
+    """
+    SELECT for one page of posts with only the requested columns and joins.
+    Returns (sql, select_params); the caller appends the WHERE params and the
+    LIMIT value.
+    """
+    columns = ["posts.id"]
+    joins = []
+    params: list = []
+
+    if "content" in fs:
+        columns.append("posts.content")
+    if "created_at" in fs:
+        columns.append("posts.created_at")
+    if "author" in fs:
+        columns.append("posts.user_id AS author_id")
+    if "like_count" in fs:
+        columns.append("COALESCE(lc.cnt, 0) AS like_count")
+        joins.append(LIKE_COUNTS_JOIN)
+    if "comment_count" in fs:
+        columns.append("COALESCE(cc.cnt, 0) AS comment_count")
+        joins.append(COMMENT_COUNTS_JOIN)
+    if "viewer_state" in fs:
+        if viewer_id is None:
+            columns.append("0 AS liked_by_me")
+        else:
+            columns.append(
+                "EXISTS (SELECT 1 FROM likes WHERE likes.post_id = posts.id AND likes.user_id = ?) AS liked_by_me"
+            )
+            params.append(viewer_id)
+
+    sql = f"""
+        SELECT {", ".join(columns)}
+        FROM posts{"".join(joins)}
+        {where_sql}
+        ORDER BY posts.id DESC
+        LIMIT ?
+        """
+    return sql, params
+
+
+def comments_sql(post_ids: list[int]) -> tuple[str, tuple]:
+    placeholders = ",".join(["?"] * len(post_ids))
+    sql = f"""
+        SELECT id, post_id, content, created_at, user_id AS author_id
+        FROM comments
+        WHERE post_id IN ({placeholders})
+        ORDER BY created_at ASC
+        """
+    return sql, tuple(post_ids)
+
+
+def users_sql(user_ids) -> tuple[str, tuple]:
+    ids = tuple(sorted(user_ids))
+    placeholders = ",".join(["?"] * len(ids))
+    return f"SELECT id, username FROM users WHERE id IN ({placeholders})", ids
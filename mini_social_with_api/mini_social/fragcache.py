@@ -0,0 +1,108 @@
+"""
+Rendered post-card fragment cache.
+
+A post card's HTML (author, body, counts, comment list, comment form) only
+changes when the post changes, so it is rendered once per
+(post id, posts.version, signed in or not) and kept in a per-worker LRU
+bounded by FRAGMENT_CACHE_BYTES (default 16 MB).  Every like, unlike and
+comment bumps posts.version in the same transaction, which retires the old
+entry on every worker without any cross-process messaging.
+
+The only viewer-specific part, the like button, is not cached; it is
+spliced into the cached HTML at VIEWER_ACTIONS_MARKER on every render.
+
+Templates call it as {{ post_card(p, comments, user) }}.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup, escape
+
+import metrics
+
+VIEWER_ACTIONS_MARKER = "<!--viewer-actions-->"
+CARD_TEMPLATE = "_post_card.html"
+
+FRAGMENT_LOOKUPS = metrics.Counter(
+    "mini_social_fragment_cache_lookups_total",
+    "Post card fragment cache lookups.",
+    ("result",),
+)
+FRAGMENT_BYTES = metrics.Gauge(
+    "mini_social_fragment_cache_bytes",
+    "Bytes held by the post card fragment cache.",
+)
+
+
+class FragmentCache:
+    """LRU keyed by any hashable, evicting by total UTF-8 size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, html: str):
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (html, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+        FRAGMENT_BYTES.set(value=self.bytes)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+
+cache = FragmentCache(int(os.environ.get("FRAGMENT_CACHE_BYTES", 16 * 1024 * 1024)))
+
+
+def viewer_actions(post, viewer) -> str:
+    if not viewer:
+        return '<span class="muted">Log in to like</span>'
+    liked = 1 if post["liked_by_me"] == 1 else 0
+    return (
+        f'<button type="button" class="likebtn" data-id="{escape(post["id"])}" data-liked="{liked}">'
+        f'{"Unlike" if liked else "Like"}</button>'
+    )
+
+
+def post_card(post, comments, viewer) -> Markup:
+    version = post.get("version")
+    key = None if version is None else (post["id"], version, bool(viewer))
+
+    html = cache.get(key) if key is not None else None
+    if html is None:
+        FRAGMENT_LOOKUPS.inc("miss")
+        template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+        html = template.render(p=post, clist=comments, logged_in=bool(viewer))
+        if key is not None:
+            cache.set(key, html)
+    else:
+        FRAGMENT_LOOKUPS.inc("hit")
+
+    return Markup(html.replace(VIEWER_ACTIONS_MARKER, viewer_actions(post, viewer), 1))
+
+
+def install(app):
+    app.jinja_env.globals["post_card"] = post_card
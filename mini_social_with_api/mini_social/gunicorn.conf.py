@@ -0,0 +1,99 @@
+"""
+gunicorn settings; picked up automatically when gunicorn runs in this directory.
+
+    gunicorn "app:create_app()"                         # preset "preload" (default)
+    GUNICORN_PRESET=threads gunicorn "app:create_app()"
+    GUNICORN_PRESET=dev gunicorn "app_api:create_app()"
+
+Presets:
+    preload   sync workers, app imported once in the master (--preload) and
+              forked: workers share its memory pages and boot in a few ms.
+              Code changes need a full restart, not a HUP.
+    threads   the same with gthread workers (GUNICORN_THREADS, default 4):
+              fewer processes, for I/O-bound load such as Postgres over the
+              network.
+    lazy      no preload: every worker imports the app itself.  Slower boot
+              and more memory, but HUP reloads code.
+    dev       one worker (WEB_CONCURRENCY is ignored), no preload, --reload on
+              file changes.
+
+WEB_CONCURRENCY (workers, default 2 x CPUs + 1) and PORT (default 8000) are
+respected, as on Render.  With WRITER_SOCKET set, the single SQLite writer
+(writer.py serve) is started next to the workers and stopped with them;
+WRITER_AUTOSTART=0 leaves it to be run separately.  MAINTENANCE=1 runs the
+SQLite backup / ANALYZE / checkpoint / vacuum schedule in the workers
+(maintenance.py).
+
+Neither app opens a database connection at import.  create_app() creates
+the schema once (in the master with --preload); everything per process
+(connection pools, the SQLite replica copier) starts in the worker before
+its first request.  db_sa registers an os.register_at_fork() hook that drops
+pooled connections inherited from the master, so a worker never shares a
+socket with it.
+
+Boot timing is logged: how long the master took to load the app, and per
+worker the time from fork until it is ready to accept requests.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+PRESETS = {
+    "preload": {"preload_app": True, "worker_class": "sync"},
+    "threads": {"preload_app": True, "worker_class": "gthread", "threads": int(os.environ.get("GUNICORN_THREADS", 4))},
+    "lazy": {"preload_app": False, "worker_class": "sync"},
+    "dev": {"preload_app": False, "worker_class": "sync", "workers": 1, "reload": True},
+}
+
+preset = os.environ.get("GUNICORN_PRESET", "preload")
+if preset not in PRESETS:
+    raise SystemExit(f"Unknown GUNICORN_PRESET {preset!r}; use one of: {', '.join(PRESETS)}")
+
+settings = PRESETS[preset]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = settings.get("workers") or int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+preload_app = settings["preload_app"]
+worker_class = settings["worker_class"]
+threads = settings.get("threads", 1)
+reload = settings.get("reload", False)
+timeout = 30
+graceful_timeout = 30
+max_requests = 2000
+max_requests_jitter = 200
+
+_started = time.perf_counter()
+
+
+def on_starting(server):
+    socket_path = os.environ.get("WRITER_SOCKET")
+    if socket_path and os.environ.get("WRITER_AUTOSTART", "1") != "0":
+        here = os.path.dirname(os.path.abspath(__file__))
+        server.writer_proc = subprocess.Popen([sys.executable, "writer.py", "serve", "--socket", socket_path], cwd=here)
+
+
+def on_exit(server):
+    proc = getattr(server, "writer_proc", None)
+    if proc is not None:
+        proc.terminate()
+        proc.wait(10)
+
+
+def when_ready(server):
+    server.log.info(
+        "preset %s: app %s in %.0f ms",
+        preset,
+        "loaded" if preload_app else "not loaded (workers import it)",
+        (time.perf_counter() - _started) * 1000,
+    )
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    # without preload this includes importing the app
+    worker.log.info("worker %s booted in %.1f ms", worker.pid, (time.perf_counter() - worker.forked_at) * 1000)
@@ -0,0 +1,147 @@
+"""
+Cold-start guard: import time and worker readiness in SQLite mode.
+
+    python import_budget.py                  # both apps, median of 5 cold processes
+    python import_budget.py --runs 9 --top 15
+    python import_budget.py --budget-ms 250
+
+Every run is a fresh interpreter that imports the app, calls create_app()
+and serves GET / through the test client against an empty SQLite file in a
+temp directory: what a gunicorn worker without --preload does before it can
+answer its first request.  One extra run under `python -X importtime` lists
+the app's slowest direct imports.
+
+The check fails (exit code 1) when
+  - the median readiness time is over --budget-ms (default 200), or
+  - it is more than --overhead-ms (default 80) above a bare `import flask`
+    on the same machine, the part this code base controls, or
+  - a module SQLite mode must not load (SQLAlchemy, psycopg2) was imported.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BUDGET_MS = 200
+OVERHEAD_MS = 80
+MODULES = ("app", "app_api")
+FORBIDDEN = ("sqlalchemy", "psycopg2")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module} as m
+imported = time.perf_counter()
+app = m.create_app()
+created = time.perf_counter()
+resp = app.test_client().get("/")
+resp.get_data()
+done = time.perf_counter()
+print(json.dumps({{
+    "import": imported - started,
+    "create_app": created - imported,
+    "first_request": done - created,
+    "status": resp.status_code,
+    "loaded": [n for n in {forbidden!r} if n in sys.modules],
+}}))
+"""
+
+
+def _env(tmp: str) -> dict:
+    env = dict(os.environ)
+    for name in ("DATABASE_URL", "DATABASE_READ_URLS", "SQLITE_REPLICA_PATHS"):
+        env.pop(name, None)
+    env["SQLITE_PATH"] = os.path.join(tmp, "cold.db")
+    env["RATELIMIT_ENABLED"] = "0"
+    return env
+
+
+def probe(module: str, importtime: bool = False) -> tuple[dict, str]:
+    """One cold process; returns (timings, -X importtime output)."""
+    code = PROBE.format(module=module, forbidden=FORBIDDEN)
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    with tempfile.TemporaryDirectory(prefix="mini_social_cold_") as tmp:
+        proc = subprocess.run(args, cwd=HERE, env=_env(tmp), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{module}: probe failed\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def slowest_imports(importtime_output: str, module: str, top: int) -> list[tuple[str, int]]:
+    """(name, cumulative us) of the modules `module` imports directly, slowest first."""
+    children: list[tuple[str, int]] = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # a module is listed after everything it imported
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda c: c[1], reverse=True)[:top]
+            children = []
+    return []
+
+
+def flask_baseline(runs: int) -> float:
+    """Median ms for a bare `import flask`, the floor under any readiness number."""
+    code = "import time; t = time.perf_counter(); import flask; print(time.perf_counter() - t)"
+    times = [
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout)
+        for _ in range(runs)
+    ]
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check cold-start time in SQLite mode.")
+    parser.add_argument("--runs", type=int, default=5, help="cold processes per app (median is checked)")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="readiness budget per app")
+    parser.add_argument("--overhead-ms", type=float, default=OVERHEAD_MS, help="budget above a bare import flask")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    failures = []
+    floor = flask_baseline(args.runs)
+    print(f"import flask alone: {floor:.0f} ms")
+    for module in MODULES:
+        runs = [probe(module)[0] for _ in range(args.runs)]
+        ready = [(r["import"] + r["create_app"] + r["first_request"]) * 1000 for r in runs]
+        median = statistics.median(ready)
+        parts = {k: statistics.median(r[k] for r in runs) * 1000 for k in ("import", "create_app", "first_request")}
+        print(
+            f"{module}: ready in {median:.0f} ms (budget {args.budget_ms:.0f}) = "
+            f"import {parts['import']:.0f} + create_app {parts['create_app']:.0f} "
+            f"+ first request {parts['first_request']:.0f}; {median - floor:.0f} ms above flask "
+            f"(budget {args.overhead_ms:.0f}); min {min(ready):.0f}, max {max(ready):.0f}"
+        )
+        _, importtime = probe(module, importtime=True)
+        for name, us in slowest_imports(importtime, module, args.top):
+            print(f"    {us / 1000:>7.1f} ms  {name}")
+
+        if median > args.budget_ms:
+            failures.append(f"{module}: ready in {median:.0f} ms > budget {args.budget_ms:.0f} ms")
+        if median - floor > args.overhead_ms:
+            failures.append(f"{module}: {median - floor:.0f} ms above import flask > budget {args.overhead_ms:.0f} ms")
+        loaded = sorted({n for r in runs for n in r["loaded"]})
+        if loaded:
+            failures.append(f"{module}: SQLite mode imported {', '.join(loaded)}")
+        if any(r["status"] >= 500 for r in runs):
+            failures.append(f"{module}: GET / failed")
+
+    for line in failures:
+        print("FAIL", line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Fast JSON provider for jsonify() and streamed JSON.
+
+Uses orjson when it is installed and falls back to the stdlib json module
+otherwise; either way output is compact and keys keep their query order
+(no sort_keys, no pretty-printing, also in debug mode).  sqlite3.Row and
+SQLAlchemy Row objects serialize directly, and dict_row() lets hot queries
+build plain dicts straight from the cursor instead of Row -> dict copies.
+
+    python jsonprovider.py     # microbenchmark on a synthetic feed payload
+"""
+import json
+import sqlite3
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is the fallback
+    orjson = None
+
+
+def dict_row(cursor, row):
+    """sqlite3 row_factory producing plain dicts; set it on a cursor before fetching."""
+    return dict(zip(_fields(cursor.description), row))
+
+
+_last_fields = (None, None)
+
+
+def _fields(description):
+    # description is the same tuple for every row of a statement
+    global _last_fields
+    desc, fields = _last_fields
+    if desc is not description:
+        fields = tuple(d[0] for d in description)
+        _last_fields = (description, fields)
+    return fields
+
+
+def _default(o):
+    if isinstance(o, sqlite3.Row):
+        return dict(zip(o.keys(), o))
+    if hasattr(o, "_mapping"):  # SQLAlchemy Row
+        return dict(o._mapping)
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    compact = True
+    ensure_ascii = False
+
+    def __init__(self, app, use_orjson: bool | None = None):
+        super().__init__(app)
+        self.use_orjson = orjson is not None if use_orjson is None else use_orjson
+
+    def dumps(self, obj, **kwargs) -> str:
+        if self.use_orjson and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        kwargs.setdefault("default", _default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("separators", (",", ":"))
+        return json.dumps(obj, **kwargs)
+
+    def dumps_bytes(self, obj) -> bytes:
+        if self.use_orjson:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return self.dumps(obj).encode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def install(app):
+    app.json = FastJSONProvider(app)
+    return app.json
+
+
+# -- microbenchmark --
+
+def _feed_rows(n_posts: int = 50, n_comments: int = 20):
+    """The /api/posts shape, as sqlite3.Row objects from an in-memory DB."""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE p (id INTEGER, content TEXT, created_at TEXT, username TEXT,"
+        " like_count INTEGER, comment_count INTEGER, liked_by_me INTEGER)"
+    )
+    conn.execute("CREATE TABLE c (post_id INTEGER, content TEXT, created_at TEXT, username TEXT)")
+    conn.executemany(
+        "INSERT INTO p VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i, f"Post {i}: " + "lorem ipsum dolor sit amet " * 4, "Mar 03 04:05 PM", f"user{i % 97}", i * 3, n_comments, i % 2)
+            for i in range(n_posts, 0, -1)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO c VALUES (?, ?, ?, ?)",
+        [(i, f"comment {j} on {i}", "Mar 03 04:06 PM", f"user{j}") for i in range(1, n_posts + 1) for j in range(n_comments)],
+    )
+    return conn
+
+
+def _payload(conn, factory):
+    posts_cur = conn.cursor()
+    posts_cur.row_factory = factory
+    posts = posts_cur.execute("SELECT * FROM p ORDER BY id DESC").fetchall()
+    comments_cur = conn.cursor()
+    comments_cur.row_factory = factory
+    comments = {}
+    for c in comments_cur.execute("SELECT * FROM c").fetchall():
+        comments.setdefault(c["post_id"], []).append(c)
+    return posts, comments
+
+
+def _rate(fn, seconds: float) -> float:
+    fn()
+    n = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fn()
+        n += 1
+    return n / (time.perf_counter() - started)
+
+
+def benchmark(seconds: float = 1.0):
+    from flask import Flask
+
+    app = Flask(__name__)
+    conn = _feed_rows()
+    default = DefaultJSONProvider(app)
+
+    def build_copies():
+        # what the views did before: Row -> dict copies
+        posts, comments = _payload(conn, sqlite3.Row)
+        posts = [dict(p) for p in posts]
+        for p in posts:
+            p["comments"] = [dict(c) for c in comments.get(p["id"], [])]
+        return {"posts": posts}
+
+    def build_direct():
+        posts, comments = _payload(conn, dict_row)
+        for p in posts:
+            p["comments"] = comments.get(p["id"], [])
+        return {"posts": posts}
+
+    cases = [("Flask default (sort_keys, dict copies)", build_copies, lambda o: default.dumps(o).encode("utf-8"))]
+    cases.append(("stdlib json, dict_row", build_direct, FastJSONProvider(app, use_orjson=False).dumps_bytes))
+    if orjson is not None:
+        cases.append(("orjson, dict_row", build_direct, FastJSONProvider(app, use_orjson=True).dumps_bytes))
+    else:
+        print("orjson not installed; only the stdlib fallback is measured")
+
+    payload = build_copies()
+    print(f"Feed payload: 50 posts x 20 comments, {len(cases[-1][2](payload)):,} bytes compact")
+    print(f"  {'':<40}{'serialize only':>24}{'fetch + build + serialize':>30}")
+    base = None
+    for name, build, dumps in cases:
+        obj = build()
+        ser = _rate(lambda: dumps(obj), seconds)
+        full = _rate(lambda: dumps(build()), seconds)
+        base = base or (ser, full)
+        print(f"  {name:<40}{ser:>9,.0f}/s ({ser / base[0]:>5.2f}x){'':>6}{full:>9,.0f}/s ({full / base[1]:>5.2f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()
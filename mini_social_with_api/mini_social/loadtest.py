@@ -0,0 +1,221 @@
+"""
+Mixed-workload load driver for app.py and app_api.py.
+
+    SQLITE_PATH=bench.db RATELIMIT_ENABLED=0 gunicorn -w 4 app_api:app
+    python loadtest.py --base-url http://127.0.0.1:8000 --target app_api --users 1000 --duration 30
+
+Each client thread logs in as a random seeded user (see seed.py) and then
+replays a weighted mix of feed reads, profile views, likes, comments and
+follows over a keep-alive connection.  At the end it prints throughput and
+p50/p95/p99 latency per operation; --json also writes the numbers to a file
+so runs can be compared.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_MIX = "feed=45,following=10,profile=20,like=12,comment=8,follow=5"
+
+# operation -> (method, path template, body kind) per target app
+ROUTES = {
+    "app_api": {
+        "feed": ("GET", "/api/posts?feed=public", None),
+        "following": ("GET", "/api/posts?feed=following", None),
+        "profile": ("GET", "/u/{username}", None),
+        "like": ("POST", "/like/{post_id}", "form"),
+        "comment": ("POST", "/api/posts/{post_id}/comments", "json"),
+        "follow": ("POST", "/follow/{username}", "form"),
+    },
+    "app": {
+        "feed": ("GET", "/api/posts", None),
+        "following": ("GET", "/api/posts?feed=following", None),
+        "profile": ("GET", "/u/{username}", None),
+        "like": ("POST", "/api/posts/{post_id}/like", None),
+        "comment": ("POST", "/api/posts/{post_id}/comments", "json"),
+        "follow": ("POST", "/follow/{username}", "form"),
+    },
+}
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[k]
+
+
+def parse_mix(mix: str) -> list[tuple[str, int]]:
+    out = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        out.append((name.strip(), int(weight or 1)))
+    return out
+
+
+class Client:
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.timeout = timeout
+        self.cookie = ""
+        self.conn = None
+        self.last_body = b""
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body=None, body_kind=None) -> int:
+        headers = {"Accept-Encoding": "identity"}
+        data = None
+        if body_kind == "json":
+            data = json.dumps(body or {})
+            headers["Content-Type"] = "application/json"
+        elif body_kind == "form":
+            data = urlencode(body or {})
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+
+        for attempt in (1, 2):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request(method, path, body=data, headers=headers)
+                resp = self.conn.getresponse()
+                self.last_body = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+        cookie = resp.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return resp.status
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, op: str, seconds: float, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(seconds)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+
+def worker(args, routes, mix, stats: Stats, deadline: float, seed: int):
+    rng = random.Random(seed)
+    client = Client(args.base_url)
+    me = rng.randint(1, args.users)
+    client.request("POST", "/login", {"username": f"user{me}", "password": args.password}, "form")
+
+    names = [name for name, _ in mix]
+    weights = [w for _, w in mix]
+    while time.monotonic() < deadline:
+        op = rng.choices(names, weights)[0]
+        method, template, body_kind = routes[op]
+        # skew targets toward popular users and recent posts, like seed.py
+        username = f"user{min(int(args.users * rng.random() ** 3), args.users - 1) + 1}"
+        post_id = max(args.max_post_id - int(args.max_post_id * rng.random() ** 3), 1)
+        path = template.format(username=username, post_id=post_id)
+        body = {"content": "load test comment"} if op == "comment" else {}
+
+        started = time.perf_counter()
+        try:
+            status = client.request(method, path, body, body_kind)
+            ok = status < 400
+        except Exception:
+            ok = False
+        stats.record(op, time.perf_counter() - started, ok)
+
+
+def discover_max_post_id(base_url: str, target: str) -> int:
+    client = Client(base_url)
+    client.request("GET", ROUTES[target]["feed"][1])
+    data = json.loads(client.last_body or b"{}")
+    posts = data.get("posts") or []
+    return max((p["id"] for p in posts), default=1)
+
+
+def report(stats: Stats, elapsed: float) -> dict:
+    out = {"elapsed_s": round(elapsed, 2), "routes": {}}
+    total = 0
+    print(f"{'operation':<12}{'count':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op in sorted(stats.latencies):
+        values = sorted(stats.latencies[op])
+        total += len(values)
+        row = {
+            "count": len(values),
+            "errors": stats.errors.get(op, 0),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+        out["routes"][op] = row
+        print(
+            f"{op:<12}{row['count']:>9}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+        )
+    out["total_rps"] = total / elapsed
+    print(f"total: {total} requests, {out['total_rps']:.1f} req/s")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a mixed workload against mini_social.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--target", choices=sorted(ROUTES), default="app_api")
+    parser.add_argument("--users", type=int, default=1000, help="number of seeded users (user1..userN)")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--max-post-id", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.max_post_id is None:
+        args.max_post_id = discover_max_post_id(args.base_url, args.target)
+
+    routes = ROUTES[args.target]
+    mix = parse_mix(args.mix)
+    unknown = [name for name, _ in mix if name not in routes]
+    if unknown:
+        parser.error(f"unknown operations in --mix: {', '.join(unknown)}")
+
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(args, routes, mix, stats, deadline, args.seed + i), daemon=True)
+        for i in range(args.concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    result = report(stats, time.monotonic() - started)
+    result.update({"target": args.target, "concurrency": args.concurrency, "mix": args.mix})
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+SQLite maintenance: online backups, planner statistics, WAL checkpoints, incremental vacuum.
+
+    python maintenance.py backup [--db PATH] [--dest DIR]   # run one task now
+    python maintenance.py optimize | analyze | checkpoint | vacuum | recommend
+    python maintenance.py vacuum --enable     # once: full VACUUM into auto_vacuum=INCREMENTAL
+    python maintenance.py schedule            # run tasks as they come due, forever
+    python maintenance.py status              # last run of every task
+    MAINTENANCE=1 gunicorn "app_api:create_app()"   # or let the workers run the schedule
+
+    MAINTENANCE            1: every worker runs the scheduler thread; a lock
+                           file next to the database lets one of them work at
+                           a time, so the schedule holds across workers
+    MAINTENANCE_SCHEDULE   seconds between runs per task, 0 turns a task off
+                           (default backup=3600,optimize=3600,analyze=86400,
+                           checkpoint=300,vacuum=3600,recommend=3600)
+    BACKUP_DIR             where backups go; without it the backup task is skipped
+    BACKUP_KEEP            backups kept, oldest deleted first (default 24)
+    BACKUP_MAX_RESTARTS    restarts a backup may take from foreign writes
+                           before it gives up (default 3; WAL never restarts)
+    MAINTENANCE_STEP_PAGES pages per backup / vacuum step (default 256)
+    MAINTENANCE_PAUSE_MS   pause between steps and tables (default 10)
+
+Tasks:
+  backup      sqlite3 backup API, MAINTENANCE_STEP_PAGES pages per step with
+              MAINTENANCE_PAUSE_MS in between.  init_db puts the database in
+              WAL mode, and the source connection first opens a read
+              transaction, so every step copies the same snapshot: writers
+              carry on, and the copy never restarts because of them.  On a
+              file still in rollback-journal mode every write restarts the
+              copy; after BACKUP_MAX_RESTARTS restarts the run fails and says
+              so instead of locking writers out.  The copy is written to a
+              .part file, checked with PRAGMA quick_check and renamed.
+  optimize    PRAGMA optimize: re-analyzes only what the planner needs.
+  analyze     ANALYZE one table at a time with analysis_limit, pausing
+              between tables.
+  checkpoint  a PASSIVE checkpoint (never waits), then, if that caught up,
+              TRUNCATE with a 10 ms busy timeout; if readers still hold old
+              frames it gives up and the next run tries again.
+  vacuum      PRAGMA incremental_vacuum in steps until no free page is left.
+              Databases created by init_db use auto_vacuum=INCREMENTAL;
+              older files need `vacuum --enable` once (a full VACUUM, which
+              blocks writers while it runs).
+  recommend   recomputes who-to-follow recommendations (recommend.py): sparse
+              matrix products over follows and likes, written back a batch
+              of users per transaction.  Skipped without scipy, and with
+              SHARD_PATHS (it reads likes from the main database).
+
+With SHARD_PATHS (shards.py) backup, optimize, analyze, checkpoint and vacuum
+run on the main database and then on every shard file, one after the other.
+
+Tasks work in small steps with pauses in between where they can, so
+foreground requests get in between; the steps are not free, though, and
+requests slow down somewhat while a task runs.  Runs are
+recorded in the maintenance_runs table (what `status` shows) and observed
+in mini_social_maintenance_seconds{task} and
+mini_social_maintenance_runs_total{task,result} in the worker that ran them.
+"""
+import argparse
+import fcntl
+import glob
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+import recommend
+import shards
+
+DEFAULT_SCHEDULE = "backup=3600,optimize=3600,analyze=86400,checkpoint=300,vacuum=3600,recommend=3600"
+STEP_PAGES = int(os.environ.get("MAINTENANCE_STEP_PAGES", 256))
+PAUSE_SECONDS = float(os.environ.get("MAINTENANCE_PAUSE_MS", 10)) / 1000
+ANALYSIS_LIMIT = 1000
+MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", 3))
+
+MAINTENANCE_SECONDS = metrics.Histogram(
+    "mini_social_maintenance_seconds",
+    "Duration of SQLite maintenance tasks.",
+    ("task",),
+    buckets=(0.01, 0.05, 0.25, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0),
+)
+MAINTENANCE_RUNS = metrics.Counter(
+    "mini_social_maintenance_runs_total",
+    "SQLite maintenance runs by task and result (ok, skipped, error).",
+    ("task", "result"),
+)
+
+
+class Skipped(Exception):
+    """The task had nothing to do or could not run here; the message says why."""
+
+
+def _connect(db_path: str, timeout: float = 5.0) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+
+
+# -- tasks --
+
+def backup(db_path: str, dest_dir: str | None = None, keep: int | None = None,
+           step: int = STEP_PAGES, pause: float = PAUSE_SECONDS) -> str:
+    dest_dir = dest_dir or os.environ.get("BACKUP_DIR")
+    if not dest_dir:
+        raise Skipped("BACKUP_DIR is not set")
+    keep = keep if keep is not None else int(os.environ.get("BACKUP_KEEP", 24))
+    os.makedirs(dest_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    path = os.path.join(dest_dir, f"{stem}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.db")
+    part = path + ".part"
+
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        # a write from another connection starts the copy over: remaining goes back up
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise RuntimeError(
+                    f"backup restarted {restarts} times by writes; "
+                    f"{db_path} is not in WAL mode (init_db switches it)"
+                )
+        last_remaining = remaining
+        time.sleep(pause)
+
+    src = _connect(db_path)
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # pin one snapshot for the whole copy
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        dst = sqlite3.connect(part)
+        try:
+            src.backup(dst, pages=step, progress=progress)
+        except BaseException:
+            dst.close()
+            os.remove(part)
+            raise
+        dst.close()
+    finally:
+        src.close()
+
+    check = sqlite3.connect(part)
+    try:
+        result = check.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        check.close()
+    if result != "ok":
+        os.remove(part)
+        raise RuntimeError(f"backup failed quick_check: {result}")
+    os.replace(part, path)
+
+    backups = sorted(glob.glob(os.path.join(dest_dir, f"{stem}-*Z.db")))
+    for old in backups[: max(len(backups) - keep, 0)]:
+        os.remove(old)
+    return f"{os.path.getsize(path) / 1e6:.1f} MB to {path}"
+
+
+def optimize(db_path: str) -> str:
+    conn = _connect(db_path)
+    try:
+        conn.execute("PRAGMA optimize").fetchall()
+    finally:
+        conn.close()
+    return ""
+
+
+def analyze(db_path: str, pause: float = PAUSE_SECONDS) -> str:
+    conn = _connect(db_path)
+    try:
+        # statistics from a sample of each index, not a full scan
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}").fetchall()
+        tables = [
+            r[0]
+            for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+        ]
+        for table in tables:
+            conn.execute(f'ANALYZE "{table}"')
+            time.sleep(pause)
+    finally:
+        conn.close()
+    return f"{len(tables)} tables"
+
+
+def checkpoint(db_path: str) -> str:
+    # TRUNCATE holds off writers while it waits for readers: wait 10 ms at most
+    conn = _connect(db_path, timeout=0.01)
+    try:
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            raise Skipped("not in WAL mode")
+        busy, frames, done = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        if done == frames:
+            busy, frames, done = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    finally:
+        conn.close()
+    if busy or done != frames:
+        return f"readers busy, {done}/{frames} frames checkpointed, WAL not truncated"
+    return "WAL truncated"
+
+
+def vacuum(db_path: str, enable: bool = False, step: int = STEP_PAGES, pause: float = PAUSE_SECONDS) -> str:
+    conn = _connect(db_path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not enable:
+                raise Skipped("auto_vacuum is not INCREMENTAL; run `python maintenance.py vacuum --enable` once")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return "switched to auto_vacuum=INCREMENTAL (full VACUUM)"
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        freed = 0
+        while free := conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # the pragma only does its work as its rows are stepped through
+            conn.execute(f"PRAGMA incremental_vacuum({min(free, step)})").fetchall()
+            freed += min(free, step)
+            time.sleep(pause)
+    finally:
+        conn.close()
+    return f"{freed * page_size / 1e6:.1f} MB returned to the file system"
+
+
+def recommend_users(db_path: str) -> str:
+    if not recommend.available():
+        raise Skipped("scipy is not installed")
+    if shards.paths():
+        raise Skipped("likes live in SHARD_PATHS; recommendations read the main database only")
+    return recommend.run(db_path)
+
+
+def _each_file(task):
+    """The task for the main database and, with SHARD_PATHS, every shard file."""
+    def run(db_path: str, **kwargs) -> str:
+        files = [db_path, *shards.paths()]
+        if len(files) == 1:
+            return task(db_path, **kwargs)
+        details, skipped = [], 0
+        for path in files:
+            try:
+                details.append(f"{os.path.basename(path)}: {task(path, **kwargs)}")
+            except Skipped as e:
+                skipped += 1
+                details.append(f"{os.path.basename(path)}: skipped, {e}")
+        if skipped == len(files):
+            raise Skipped("; ".join(details))
+        return "; ".join(details)
+
+    return run
+
+
+TASKS = {
+    "backup": _each_file(backup),
+    "optimize": _each_file(optimize),
+    "analyze": _each_file(analyze),
+    "checkpoint": _each_file(checkpoint),
+    "vacuum": _each_file(vacuum),
+    "recommend": recommend_users,
+}
+
+
+# -- bookkeeping --
+
+def _record(db_path: str, task: str, started: float, seconds: float, ok: bool, detail: str):
+    conn = _connect(db_path, timeout=30)
+    try:
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS maintenance_runs (
+                task TEXT PRIMARY KEY,
+                started REAL NOT NULL,
+                seconds REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                detail TEXT NOT NULL
+            )"""
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO maintenance_runs (task, started, seconds, ok, detail) VALUES (?, ?, ?, ?, ?)",
+            (task, started, seconds, int(ok), detail),
+        )
+    finally:
+        conn.close()
+
+
+def last_runs(db_path: str) -> dict[str, sqlite3.Row]:
+    conn = _connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("SELECT * FROM maintenance_runs").fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # no run recorded yet
+    finally:
+        conn.close()
+    return {r["task"]: r for r in rows}
+
+
+def run_task(db_path: str, task: str, **kwargs) -> tuple[str, str]:
+    """Runs one task; returns (result, detail) with result ok / skipped / error."""
+    started = time.time()
+    t0 = time.perf_counter()
+    try:
+        detail = TASKS[task](db_path, **kwargs)
+        result = "ok"
+    except Skipped as e:
+        detail, result = str(e), "skipped"
+    except Exception as e:
+        detail, result = f"{type(e).__name__}: {e}", "error"
+    seconds = time.perf_counter() - t0
+    MAINTENANCE_SECONDS.observe(seconds, task)
+    MAINTENANCE_RUNS.inc(task, result)
+    # a skipped task counts as run, so it is not retried on every tick
+    _record(db_path, task, started, seconds, result != "error", detail)
+    return result, detail
+
+
+def parse_schedule(value: str) -> dict[str, float]:
+    schedule = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        task, _, seconds = item.partition("=")
+        task = task.strip()
+        if task not in TASKS:
+            raise ValueError(f"unknown maintenance task {task!r} in MAINTENANCE_SCHEDULE")
+        schedule[task] = float(seconds)
+    return schedule
+
+
+class Scheduler(threading.Thread):
+    """Runs due tasks every `tick` seconds; with several processes, one works at a time."""
+
+    def __init__(self, db_path: str, schedule: dict[str, float], tick: float = 30.0, log=None):
+        super().__init__(name="sqlite-maintenance", daemon=True)
+        self.db_path = db_path
+        self.schedule = schedule
+        self.tick = tick
+        self.log = log or (lambda line: print(line, file=sys.stderr, flush=True))
+        self.stopped = threading.Event()
+
+    def run_due(self) -> int:
+        with open(self.db_path + ".maintenance-lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # another process is doing maintenance
+            ran = 0
+            last = last_runs(self.db_path)
+            for task, every in self.schedule.items():
+                if self.stopped.is_set():
+                    break
+                if every <= 0 or (task in last and time.time() - last[task]["started"] < every):
+                    continue
+                result, detail = run_task(self.db_path, task)
+                self.log(f"maintenance: {task} {result} {detail}".rstrip())
+                ran += 1
+        return ran
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.run_due()
+            except sqlite3.Error as e:
+                self.log(f"maintenance: {type(e).__name__}: {e}")
+            self.stopped.wait(self.tick)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_scheduler = None
+_scheduler_pid = None
+_start_lock = threading.Lock()
+
+
+def start(db_path: str):
+    """Starts this process's scheduler thread when MAINTENANCE=1 (once per process)."""
+    global _scheduler, _scheduler_pid
+    if os.environ.get("MAINTENANCE") != "1" or _scheduler_pid == os.getpid():
+        return _scheduler
+    with _start_lock:
+        if _scheduler_pid != os.getpid():
+            # threads do not survive fork: a forked worker starts its own
+            _scheduler = Scheduler(db_path, parse_schedule(os.environ.get("MAINTENANCE_SCHEDULE", DEFAULT_SCHEDULE)))
+            _scheduler.start()
+            _scheduler_pid = os.getpid()
+    return _scheduler
+
+
+def install(app, db_path: str):
+    """Starts the scheduler in each worker before its first request (MAINTENANCE=1 only)."""
+    if os.environ.get("MAINTENANCE") != "1":
+        return
+
+    @app.before_request
+    def _start_maintenance():
+        if _scheduler_pid != os.getpid():
+            start(db_path)
+
+
+# -- CLI --
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite backups and maintenance.")
+    parser.add_argument("what", choices=[*TASKS, "schedule", "status"])
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH", "database.db"))
+    parser.add_argument("--dest", help="backup directory (default: $BACKUP_DIR)")
+    parser.add_argument("--keep", type=int, help="backups to keep (default: $BACKUP_KEEP or 24)")
+    parser.add_argument("--enable", action="store_true", help="vacuum: switch the file to auto_vacuum=INCREMENTAL")
+    parser.add_argument("--tick", type=float, default=30.0, help="schedule: seconds between checks")
+    args = parser.parse_args()
+
+    if args.what == "status":
+        runs = last_runs(args.db)
+        for task in TASKS:
+            r = runs.get(task)
+            if r is None:
+                print(f"  {task:<11} never")
+                continue
+            when = datetime.fromtimestamp(r["started"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"  {task:<11} {when}  {r['seconds']:>8.2f}s  {'ok' if r['ok'] else 'FAILED'}  {r['detail']}")
+        return 0
+
+    if args.what == "schedule":
+        schedule = parse_schedule(os.environ.get("MAINTENANCE_SCHEDULE", DEFAULT_SCHEDULE))
+        scheduler = Scheduler(args.db, schedule, args.tick, log=print)
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    kwargs = {}
+    if args.what == "backup":
+        kwargs = {"dest_dir": args.dest, "keep": args.keep}
+    elif args.what == "vacuum":
+        kwargs = {"enable": args.enable}
+    started = time.perf_counter()
+    result, detail = run_task(args.db, args.what, **kwargs)
+    print(f"{args.what}: {result} in {time.perf_counter() - started:.2f}s {detail}".rstrip())
+    return 0 if result != "error" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
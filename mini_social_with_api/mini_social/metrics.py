@@ -0,0 +1,490 @@
+"""
+In-process request / SQL metrics, exposed at /metrics in Prometheus text format.
+
+Every worker keeps its own registry (no shared state between gunicorn
+workers), so scrape each worker or aggregate at the collector.  Recording is
+a few perf_counter() calls and a dict update per event, cheap enough to
+leave on in production.
+"""
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from flask import Response, request
+from flask.signals import before_render_template, template_rendered
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+_REGISTRY: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra="") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(labels, list(row)) for labels, row in self._values.items()]
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            cumulative += row[len(self.buckets)]
+            le = _labels(self.labelnames, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class SlowestStatement:
+    """Per-route maximum single-statement time, with the statement text as a label."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def update(self, route: str, seconds: float, sql: str):
+        current = self._values.get(route)
+        if current is not None and current[0] >= seconds:
+            return
+        with self._lock:
+            current = self._values.get(route)
+            if current is None or current[0] < seconds:
+                self._values[route] = (seconds, " ".join(sql.split())[:200])
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        for route, (seconds, sql) in items:
+            yield f"{self.name}{_labels(('route', 'statement'), (route, sql))} {seconds}"
+
+
+REQUEST_SECONDS = Histogram(
+    "mini_social_http_request_duration_seconds",
+    "Request latency by route.",
+    ("method", "route"),
+)
+REQUESTS_TOTAL = Counter(
+    "mini_social_http_requests_total",
+    "Requests by route and status code.",
+    ("method", "route", "status"),
+)
+REQUEST_SQL_QUERIES = Histogram(
+    "mini_social_request_sql_queries",
+    "SQL statements executed per request.",
+    ("route",),
+    buckets=COUNT_BUCKETS,
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "mini_social_request_sql_seconds",
+    "Total SQL time (execute + fetch) per request.",
+    ("route",),
+)
+REQUEST_SQL_ROWS = Histogram(
+    "mini_social_request_sql_rows",
+    "Rows fetched per request through sqlite3 connections (SQLAlchemy engine statements are not counted).",
+    ("route",),
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+REQUEST_SLOWEST_SQL_SECONDS = Histogram(
+    "mini_social_request_slowest_sql_seconds",
+    "Slowest single statement per request.",
+    ("route",),
+)
+SLOWEST_SQL = SlowestStatement(
+    "mini_social_route_slowest_sql_seconds",
+    "Slowest single statement seen per route since worker start.",
+)
+TEMPLATE_SECONDS = Histogram(
+    "mini_social_template_render_seconds",
+    "Jinja render time by template.",
+    ("template",),
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "mini_social_password_hash_seconds",
+    "Password hash / verify time.",
+    ("op",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+class RequestStats:
+    __slots__ = (
+        "route",
+        "started",
+        "sql_count",
+        "sql_seconds",
+        "sql_rows",
+        "slowest_seconds",
+        "slowest_sql",
+        "template_started",
+        "finished",
+        "streaming",
+        "statements",
+    )
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.sql_rows = 0
+        self.slowest_seconds = 0.0
+        self.slowest_sql = ""
+        self.template_started = None
+        self.streaming = False
+        self.finished = False
+        # statement texts in execution order; only kept when capture is on
+        self.statements = [] if _capture_statements else None
+
+
+_current: ContextVar = ContextVar("mini_social_request_stats", default=None)
+_capture_statements = False
+
+
+def capture_statements(enabled: bool = True):
+    """Keep every statement text per request (used by query_budget.py, off in production)."""
+    global _capture_statements
+    _capture_statements = enabled
+
+
+def current_stats() -> RequestStats | None:
+    return _current.get()
+
+
+# Slow statement hook, see set_slow_statement_hook()
+_slow_threshold = float("inf")
+_slow_hook = None
+
+
+def set_slow_statement_hook(threshold_seconds: float | None, hook):
+    """
+    hook(sql, params, seconds, explain) is called once per statement whose
+    execute + fetch time reaches threshold_seconds.  explain is None or a
+    zero-argument callable returning the plan rows for that statement.
+    """
+    global _slow_threshold, _slow_hook
+    if threshold_seconds is None or hook is None:
+        _slow_threshold, _slow_hook = float("inf"), None
+    else:
+        _slow_threshold, _slow_hook = threshold_seconds, hook
+
+
+def _record_sql(sql: str, delta: float, elapsed: float, rows: int, executed: bool):
+    """
+    delta: time spent in this call (execute or one fetch)
+    elapsed: total time of the statement so far (execute + fetches)
+    """
+    st = _current.get()
+    if st is None:
+        return
+    if executed:
+        st.sql_count += 1
+        if st.statements is not None:
+            st.statements.append(sql)
+    st.sql_seconds += delta
+    st.sql_rows += rows
+    if elapsed > st.slowest_seconds:
+        st.slowest_seconds = elapsed
+        st.slowest_sql = sql
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that times execute() and fetch*() and counts rows."""
+
+    _sql = ""
+    _params = ()
+    _elapsed = 0.0
+    _slow_reported = False
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            delta = time.perf_counter() - start
+            self._begin(sql, parameters, delta)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            delta = time.perf_counter() - start
+            self._begin(sql, None, delta)
+
+    def _begin(self, sql, parameters, delta: float):
+        self._sql = sql
+        self._params = parameters
+        self._elapsed = delta
+        self._slow_reported = False
+        _record_sql(sql, delta, delta, 0, True)
+        if delta >= _slow_threshold:
+            self._report_slow()
+
+    def _fetched(self, start: float, rows: int):
+        delta = time.perf_counter() - start
+        self._elapsed += delta
+        _record_sql(self._sql, delta, self._elapsed, rows, False)
+        if self._elapsed >= _slow_threshold and not self._slow_reported:
+            self._report_slow()
+
+    def _report_slow(self):
+        self._slow_reported = True
+        explain = None
+        if self._params is not None:
+            conn, sql, params = self.connection, self._sql, self._params
+
+            def _explain():
+                # plain Cursor so the EXPLAIN itself is not instrumented
+                cur = sqlite3.Cursor(conn)
+                return [tuple(r) for r in cur.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+            explain = _explain
+
+        _slow_hook(self._sql, self._params, self._elapsed, explain)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Use as sqlite3.connect(path, factory=InstrumentedConnection)."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def instrument_engine(engine):
+    """
+    Hook SQLAlchemy engine events into the same per-request SQL stats.
+
+    Statements and time are recorded, rows are not: the cursor events never
+    see the result's fetches, and cursor.rowcount is -1 for SQLite SELECTs
+    but counted at execute time by psycopg2, so it could not be compared.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("mini_social_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        delta = time.perf_counter() - conn.info["mini_social_query_start"].pop()
+        _record_sql(statement, delta, delta, 0, True)
+        if delta >= _slow_threshold:
+            explain = None
+            if not executemany:
+                prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+                dbapi_conn = cursor.connection
+
+                def _explain():
+                    cur = dbapi_conn.cursor()
+                    try:
+                        cur.execute(prefix + statement, parameters)
+                        return [tuple(r) for r in cur.fetchall()]
+                    finally:
+                        cur.close()
+
+                explain = _explain
+
+            _slow_hook(statement, parameters, delta, explain)
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+def _route_label() -> str:
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def _before_request():
+    _current.set(RequestStats(_route_label()))
+
+
+def _observe_request(st, method: str, status: str):
+    elapsed = time.perf_counter() - st.started
+    REQUEST_SECONDS.observe(elapsed, method, st.route)
+    REQUESTS_TOTAL.inc(method, st.route, status)
+    REQUEST_SQL_QUERIES.observe(st.sql_count, st.route)
+    REQUEST_SQL_SECONDS.observe(st.sql_seconds, st.route)
+    REQUEST_SQL_ROWS.observe(st.sql_rows, st.route)
+    if st.sql_count:
+        REQUEST_SLOWEST_SQL_SECONDS.observe(st.slowest_seconds, st.route)
+        SLOWEST_SQL.update(st.route, st.slowest_seconds, st.slowest_sql)
+    return elapsed
+
+
+def _after_request(response):
+    st = _current.get()
+    if st is None:
+        return response
+    st.finished = True
+
+    if response.is_streamed:
+        # the body (and its queries) runs after this hook; record once it is closed
+        st.streaming = True
+        response.call_on_close(partial(_observe_request, st, request.method, str(response.status_code)))
+        return response
+
+    elapsed = _observe_request(st, request.method, str(response.status_code))
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={st.sql_seconds * 1000:.2f};desc="{st.sql_count} queries", app;dur={elapsed * 1000:.2f}',
+    )
+    return response
+
+
+def _teardown_request(exc):
+    st = _current.get()
+    if st is not None and st.streaming:
+        # stream_with_context tears down once when the view returns and again
+        # after the body; keep counting the body's queries until the second
+        st.streaming = False
+        return
+    if st is not None and not st.finished:
+        # after_request did not run (e.g. the error handler itself failed)
+        elapsed = time.perf_counter() - st.started
+        REQUEST_SECONDS.observe(elapsed, request.method, st.route)
+        REQUESTS_TOTAL.inc(request.method, st.route, "500")
+    _current.set(None)
+
+
+def _on_before_render(sender, template, context, **extra):
+    st = _current.get()
+    if st is not None:
+        st.template_started = time.perf_counter()
+
+
+def _on_rendered(sender, template, context, **extra):
+    st = _current.get()
+    if st is not None and st.template_started is not None:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - st.template_started, template.name or "<string>")
+        st.template_started = None
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    lines.append("")
+    return "\n".join(lines)
+
+
+def metrics_view():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+def install(app):
+    """
+    Register request hooks, template signals and the /metrics endpoint.
+    Call right after creating the app so its before_request runs first.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,141 @@
+"""
+Password hashing in a small, bounded process pool.
+
+Hashes are deliberately CPU heavy, so doing them on the request thread lets
+a burst of logins pin every web worker.  Here each web worker hands hashing
+to its own pool of PASSWORD_HASH_WORKERS processes and admits at most
+PASSWORD_HASH_QUEUE jobs (running + waiting) at once; beyond that the
+request fails fast with 503 and a Retry-After header instead of queueing.
+
+Environment:
+    PASSWORD_HASH_METHOD   werkzeug method string, e.g. "scrypt:32768:8:1"
+                           (default) or "pbkdf2:sha256:600000"
+    PASSWORD_HASH_WORKERS  pool processes per web worker (default 1;
+                           0 hashes inline, useful for tests)
+    PASSWORD_HASH_QUEUE    admitted jobs per web worker (default 4 x workers)
+    PASSWORD_HASH_TIMEOUT  seconds to wait for a result (default 10)
+
+verify_password() also reports when a stored hash uses different cost
+parameters than the configured method, returning a fresh hash so the
+caller can store it (transparent rehash on login).
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import metrics
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+RETRY_AFTER_SECONDS = 2
+
+HASH_REJECTED = metrics.Counter(
+    "mini_social_password_hash_rejected_total",
+    "Hash jobs shed because the pool queue was full or timed out.",
+    ("op",),
+)
+
+
+class HashPoolBusy(ServiceUnavailable):
+    description = "The server is busy. Please try again in a moment."
+
+    def __init__(self):
+        super().__init__(retry_after=RETRY_AFTER_SECONDS)
+
+
+def hash_method() -> str:
+    return os.environ.get("PASSWORD_HASH_METHOD") or DEFAULT_METHOD
+
+
+def _stored_method(pw_hash: str) -> str:
+    return pw_hash.split("$", 1)[0]
+
+
+# -- functions run inside the pool processes --
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pw_hash: str, password: str, method: str) -> tuple[bool, str | None]:
+    if not check_password_hash(pw_hash, password):
+        return False, None
+    if _stored_method(pw_hash) != _canonical(method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+_canonical_cache: dict[str, str] = {}
+
+
+def _canonical(method: str) -> str:
+    """Full parameter string werkzeug writes for `method` (e.g. "scrypt" -> "scrypt:32768:8:1")."""
+    if method not in _canonical_cache:
+        # one probe hash per pool process; werkzeug fills in default parameters
+        _canonical_cache[method] = _stored_method(generate_password_hash("probe", method=method))
+    return _canonical_cache[method]
+
+
+# -- pool management, per web worker process --
+
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # created lazily so gunicorn workers never share a pool inherited across fork
+            workers = int(os.environ.get("PASSWORD_HASH_WORKERS", 1))
+            queue = int(os.environ.get("PASSWORD_HASH_QUEUE", max(workers, 1) * 4))
+            if workers > 0:
+                # imported here: it pulls in multiprocessing, which worker boot does not need
+                from concurrent.futures import ProcessPoolExecutor
+
+                _pool = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _pool = None
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(queue)
+        return _pool, _slots
+
+
+def _run(op: str, fn, *args):
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        HASH_REJECTED.inc(op)
+        raise HashPoolBusy()
+    with metrics.timed(metrics.PASSWORD_HASH_SECONDS, op):
+        if pool is None:
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is freed when the job really ends: a running job cannot be
+        # cancelled, so a timed-out request must not hand its slot to the next one
+        future.add_done_callback(lambda f: slots.release())
+        try:
+            return future.result(timeout=float(os.environ.get("PASSWORD_HASH_TIMEOUT", 10)))
+        except FutureTimeout:
+            future.cancel()
+            HASH_REJECTED.inc(op)
+            raise HashPoolBusy()
+
+
+def hash_password(password: str) -> str:
+    return _run("generate", _hash, password, hash_method())
+
+
+def verify_password(pw_hash: str, password: str) -> tuple[bool, str | None]:
+    """Returns (ok, new_hash); new_hash is set when the stored hash should be replaced."""
+    return _run("check", _verify, pw_hash, password, hash_method())
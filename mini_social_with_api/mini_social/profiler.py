@@ -0,0 +1,111 @@
+"""
+On-demand sampling profiler: GET /debug/profile?seconds=N[&route=...][&interval_ms=M]
+
+Samples the stacks of the other threads in this worker with
+sys._current_frames() and returns them in collapsed ("folded") format, one
+"frame;frame;frame count" line per distinct stack, ready for flamegraph.pl
+or speedscope.  route= keeps only threads currently serving that URL rule,
+e.g. route=/u/<username>.
+
+Only users listed in ADMIN_USERS (comma-separated usernames) may call it.
+The request blocks for the sampling period, so the worker needs spare
+threads to serve real traffic meanwhile (gunicorn --threads N); under plain
+sync workers there is nothing else to sample.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, request
+
+MAX_SECONDS = 60
+DEFAULT_INTERVAL_MS = 10
+
+# thread ident -> URL rule of the request it is serving
+_active_routes: dict[int, str] = {}
+_profile_lock = threading.Lock()
+
+
+def admin_usernames() -> set[str]:
+    raw = os.environ.get("ADMIN_USERS", "")
+    return {u.strip() for u in raw.split(",") if u.strip()}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def sample(seconds: float, interval: float, route: str | None = None) -> Counter:
+    """Sample every thread except the caller for `seconds`."""
+    me = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            active = _active_routes.get(ident)
+            if route is not None and active != route:
+                continue
+            stack = _collapse(frame)
+            if active is not None:
+                stack = f"{active};{stack}"
+            stacks[stack] += 1
+        time.sleep(interval)
+
+    return stacks
+
+
+def _track_start():
+    rule = request.url_rule
+    if rule is not None:
+        _active_routes[threading.get_ident()] = rule.rule
+
+
+def _track_end(exc):
+    _active_routes.pop(threading.get_ident(), None)
+
+
+def install(app, current_user):
+    app.before_request(_track_start)
+    app.teardown_request(_track_end)
+
+    def debug_profile():
+        user = current_user()
+        if not user or user["username"] not in admin_usernames():
+            abort(403)
+
+        try:
+            seconds = float(request.args.get("seconds") or 5)
+            interval_ms = float(request.args.get("interval_ms") or DEFAULT_INTERVAL_MS)
+        except ValueError:
+            abort(400)
+        seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        interval = max(interval_ms, 1) / 1000.0
+        route = request.args.get("route") or None
+
+        if not _profile_lock.acquire(blocking=False):
+            return Response("A profile is already running in this worker.\n", status=409, mimetype="text/plain")
+        try:
+            stacks = sample(seconds, interval, route)
+        finally:
+            _profile_lock.release()
+
+        body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return Response(body, mimetype="text/plain", headers={"X-Profile-Worker-Pid": str(os.getpid())})
+
+    app.add_url_rule("/debug/profile", "debug_profile", debug_profile)
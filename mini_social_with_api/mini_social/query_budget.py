@@ -0,0 +1,202 @@
+"""
+Query-count regression guard.
+
+    python query_budget.py            # check every route against query_budgets.json
+    python query_budget.py --update   # re-record the budgets after an intended change
+
+Builds a fixed fixture dataset (seed.py, "tiny" scale, fixed seed) in a temp
+directory, drives a scripted list of requests through the Flask test client
+of both app.py and app_api.py, and records per request the number of SQL
+statements, rows fetched and the highest number of times a single statement
+text ran.  The check fails (exit code 1) when a request exceeds its stored
+budget, and lists repeated statements so N+1 patterns are easy to spot.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_budgets.json")
+
+# a statement that runs this many times in one request is reported as N+1
+REPEAT_THRESHOLD = 3
+
+LOGIN = ("POST", "/login", {"username": "user1", "password": "password123"})
+
+# (name, as_user, method, path, form, json); requests run in this order
+SCENARIOS = {
+    "app_api": [
+        ("index anon", False, "GET", "/", None, None),
+        ("index following", True, "GET", "/?feed=following", None, None),
+        ("api posts anon", False, "GET", "/api/posts", None, None),
+        ("api posts", True, "GET", "/api/posts", None, None),
+        ("api posts following", True, "GET", "/api/posts?feed=following", None, None),
+        ("api posts ranked", True, "GET", "/api/posts?feed=following&order=ranked", None, None),
+        ("api posts ids+counts", True, "GET", "/api/posts?fields=id,like_count,comment_count", None, None),
+        ("api posts include", True, "GET", "/api/posts?include=comments,viewer_state", None, None),
+        ("api user posts", True, "GET", "/api/users/user2/posts?include=comments,viewer_state,counts", None, None),
+        ("api export", True, "GET", "/api/users/user1/export", None, None),
+        ("profile anon", False, "GET", "/u/user2", None, None),
+        ("profile", True, "GET", "/u/user2", None, None),
+        ("profile stream", True, "GET", "/u/user2?stream=1", None, None),
+        ("api posts stream", True, "GET", "/api/posts?stream=1", None, None),
+        ("api trending", False, "GET", "/api/trending?window=24h", None, None),
+        ("api users recommended", True, "GET", "/api/users/recommended", None, None),
+        ("follow", True, "POST", "/follow/user3", {}, None),
+        ("unfollow", True, "POST", "/unfollow/user3", {}, None),
+        ("like", True, "POST", "/like/5", {}, None),
+        ("unlike", True, "POST", "/unlike/5", {}, None),
+        ("api comment", True, "POST", "/api/posts/5/comments", None, {"content": "budget"}),
+        ("comment", True, "POST", "/comment/5", {"content": "budget"}, None),
+        ("post", True, "POST", "/post", {"content": "budget"}, None),
+        ("login", False, "POST", "/login", {"username": "user1", "password": "password123"}, None),
+    ],
+    "app": [
+        ("index anon", False, "GET", "/", None, None),
+        ("following", True, "GET", "/following", None, None),
+        ("api posts anon", False, "GET", "/api/posts", None, None),
+        ("api posts", True, "GET", "/api/posts", None, None),
+        ("api create post", True, "POST", "/api/posts", None, {"content": "budget"}),
+        ("api like", True, "POST", "/api/posts/5/like", None, None),
+        ("api unlike", True, "DELETE", "/api/posts/5/like", None, None),
+        ("api comment", True, "POST", "/api/posts/5/comments", None, {"content": "budget"}),
+        ("profile anon", False, "GET", "/u/user2", None, None),
+        ("profile", True, "GET", "/u/user2", None, None),
+        ("profile stream", True, "GET", "/u/user2?stream=1", None, None),
+        ("api posts stream", True, "GET", "/api/posts?stream=1", None, None),
+        ("follow", True, "POST", "/follow/user3", {}, None),
+        ("unfollow", True, "POST", "/unfollow/user3", {}, None),
+        ("like", True, "POST", "/like/5", {}, None),
+        ("unlike", True, "POST", "/unlike/5", {}, None),
+        ("comment", True, "POST", "/comment/5", {"content": "budget"}, None),
+        ("login", False, "POST", "/login", {"username": "user1", "password": "password123"}, None),
+    ],
+}
+
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def measure() -> dict:
+    """Run every scenario once against a fresh fixture and return the measurements."""
+    tmp = tempfile.mkdtemp(prefix="mini_social_budget_")
+    db_path = os.path.join(tmp, "fixture.db")
+    os.environ["SQLITE_PATH"] = db_path
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["RATELIMIT_ENABLED"] = "0"
+
+    import seed
+
+    seed.generate(db_path, users=50, posts=300, follows_per_user=8, likes=1_500, comments=600, seed=7)
+
+    import metrics
+    from flask import request_finished
+
+    metrics.capture_statements(True)
+    captured = []
+
+    def on_finished(sender, response, **extra):
+        captured.append(metrics.current_stats())
+
+    results = {}
+    for module_name, scenarios in SCENARIOS.items():
+        module = __import__(module_name)
+        module.DB_PATH = db_path
+        app = module.app
+        request_finished.connect(on_finished, app)
+
+        anon = app.test_client()
+        user = app.test_client()
+        user.post(LOGIN[1], data=LOGIN[2])
+
+        out = {}
+        for name, as_user, method, path, form, body in scenarios:
+            client = user if as_user else anon
+            captured.clear()
+            resp = client.open(path, method=method, data=form, json=body)
+            if not captured or captured[-1] is None:
+                raise RuntimeError(f"{module_name} {name}: no stats captured")
+            st = captured[-1]
+            # streamed bodies run their queries while being read
+            resp.get_data()
+            resp.close()
+            repeats = Counter(_normalize(s) for s in st.statements)
+            out[name] = {
+                "status": resp.status_code,
+                "queries": st.sql_count,
+                "rows": st.sql_rows,
+                "max_repeat": max(repeats.values(), default=0),
+                "repeated": {sql: n for sql, n in repeats.items() if n >= REPEAT_THRESHOLD},
+            }
+        results[module_name] = out
+        request_finished.disconnect(on_finished, app)
+    return results
+
+
+def check(results: dict, budgets: dict) -> list[str]:
+    failures = []
+    for module_name, routes in results.items():
+        for name, m in routes.items():
+            budget = budgets.get(module_name, {}).get(name)
+            label = f"{module_name}: {name}"
+            if budget is None:
+                failures.append(f"{label}: no budget recorded (run with --update)")
+                continue
+            for key in ("queries", "rows", "max_repeat"):
+                if m[key] > budget[key]:
+                    failures.append(f"{label}: {key} {m[key]} > budget {budget[key]}")
+            if m["status"] >= 500:
+                failures.append(f"{label}: status {m['status']}")
+    return failures
+
+
+def print_report(results: dict, budgets: dict):
+    print(f"{'route':<36}{'status':>7}{'queries':>14}{'rows':>16}{'repeat':>10}")
+    for module_name, routes in results.items():
+        for name, m in routes.items():
+            b = budgets.get(module_name, {}).get(name, {})
+            print(
+                f"{module_name + ': ' + name:<36}{m['status']:>7}"
+                f"{m['queries']:>7}/{b.get('queries', '-'):<6}"
+                f"{m['rows']:>8}/{b.get('rows', '-'):<7}"
+                f"{m['max_repeat']:>5}/{b.get('max_repeat', '-'):<4}"
+            )
+            for sql, n in m["repeated"].items():
+                print(f"    N+1? x{n}: {sql[:100]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check per-route SQL query budgets.")
+    parser.add_argument("--update", action="store_true", help="record current numbers as the new budgets")
+    args = parser.parse_args()
+
+    results = measure()
+
+    if args.update:
+        budgets = {
+            module_name: {
+                name: {k: m[k] for k in ("queries", "rows", "max_repeat")} for name, m in routes.items()
+            }
+            for module_name, routes in results.items()
+        }
+        with open(BUDGETS_PATH, "w", encoding="utf-8") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print_report(results, budgets)
+        print(f"Budgets written to {BUDGETS_PATH}")
+        return 0
+
+    with open(BUDGETS_PATH, encoding="utf-8") as f:
+        budgets = json.load(f)
+    print_report(results, budgets)
+    failures = check(results, budgets)
+    for line in failures:
+        print("FAIL", line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Token-bucket rate limiting for auth and write endpoints.
+
+Checked in before_request, ahead of any DB work or password hashing, and
+keyed by client IP and/or the session's user id (read from the signed
+cookie, no query).  Over-limit requests get 429 with Retry-After.
+
+Environment:
+    RATELIMIT_ENABLED      "0" turns the limiter off (default on)
+    RATELIMIT_STORAGE_URL  memory:// (default, per worker process) or
+                           redis://host:port/db to share buckets across
+                           workers and hosts (needs the redis package)
+    RATELIMIT_TRUST_PROXY  number of reverse proxies in front of the app (default 0).
+                           With N, the key is the address N hops from the right
+                           of X-Forwarded-For: the one the outermost trusted
+                           proxy saw.  Entries further left are client-supplied
+                           and never used.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from flask import request, session
+from werkzeug.exceptions import TooManyRequests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Policy:
+    name: str
+    rate: float  # tokens per second
+    burst: int
+    key: str  # "ip" or "user"
+    methods: frozenset = frozenset({"POST", "DELETE"})
+
+
+def per_minute(n: float) -> float:
+    return n / 60.0
+
+
+AUTH_IP = Policy("login_ip", per_minute(10), 5, "ip")
+REGISTER_IP = Policy("register_ip", per_minute(5), 3, "ip")
+POST_USER = Policy("post_user", per_minute(20), 5, "user")
+WRITE_IP = Policy("write_ip", per_minute(300), 60, "ip")
+LIKE_USER = Policy("like_user", per_minute(120), 30, "user")
+COMMENT_USER = Policy("comment_user", per_minute(30), 10, "user")
+FOLLOW_USER = Policy("follow_user", per_minute(60), 20, "user")
+
+# endpoint (view function name) -> policies; shared by app.py and app_api.py
+DEFAULT_POLICIES = {
+    "login": (AUTH_IP,),
+    "register": (REGISTER_IP,),
+    "api_create_post": (POST_USER, WRITE_IP),
+    "create_post": (POST_USER, WRITE_IP),
+    "api_like_post": (LIKE_USER, WRITE_IP),
+    "api_unlike_post": (LIKE_USER, WRITE_IP),
+    "like": (LIKE_USER, WRITE_IP),
+    "unlike": (LIKE_USER, WRITE_IP),
+    "api_create_comment": (COMMENT_USER, WRITE_IP),
+    "comment": (COMMENT_USER, WRITE_IP),
+    "follow": (FOLLOW_USER, WRITE_IP),
+    "unfollow": (FOLLOW_USER, WRITE_IP),
+}
+
+RATELIMIT_REJECTED = metrics.Counter(
+    "mini_social_ratelimit_rejected_total",
+    "Requests rejected by the rate limiter.",
+    ("endpoint", "policy"),
+)
+
+
+class MemoryBackend:
+    """Buckets in a bounded LRU dict; limits are per worker process."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, wait = True, 0.0
+            else:
+                allowed, wait = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+
+# KEYS[1] bucket key; ARGV rate, burst, cost.  Uses the server clock so all
+# workers agree on time.  Returns {allowed, wait_seconds_as_string}.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+  tokens = burst
+  ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisBackend:
+    """Buckets shared through Redis; the check-and-take is one Lua script call."""
+
+    def __init__(self, client, prefix: str = "mini_social:rl:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET_LUA)
+
+    @classmethod
+    def from_url(cls, url: str):
+        import redis
+
+        return cls(redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05))
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> tuple[bool, float]:
+        allowed, wait = self._script(keys=[self.prefix + key], args=[rate, burst, cost])
+        return bool(int(allowed)), float(wait)
+
+
+def backend_from_url(url: str | None):
+    if not url or url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported RATELIMIT_STORAGE_URL: {url}")
+
+
+def client_ip() -> str:
+    hops = int(os.environ.get("RATELIMIT_TRUST_PROXY") or 0)
+    if hops > 0:
+        forwarded = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        # each trusted proxy appends the address it saw; anything left of those is forgeable
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr or "-"
+
+
+class RateLimiter:
+    def __init__(self, backend, policies: dict):
+        self.backend = backend
+        self.policies = policies
+
+    def check(self):
+        policies = self.policies.get(request.endpoint)
+        if not policies:
+            return None
+
+        retry_after = 0.0
+        for policy in policies:
+            if request.method not in policy.methods:
+                continue
+            if policy.key == "user":
+                uid = session.get("user_id")
+                if not uid:
+                    # anonymous writes are refused by the view without touching the DB
+                    continue
+                key = f"{policy.name}:u:{uid}"
+            else:
+                key = f"{policy.name}:ip:{client_ip()}"
+
+            try:
+                allowed, wait = self.backend.take(key, policy.rate, policy.burst)
+            except Exception:
+                # a broken shared backend must not take the site down; fail open
+                logger.warning("rate limit backend error", exc_info=True)
+                return None
+            if not allowed:
+                RATELIMIT_REJECTED.inc(request.endpoint, policy.name)
+                retry_after = max(retry_after, wait)
+
+        if retry_after > 0:
+            raise TooManyRequests(retry_after=max(1, math.ceil(retry_after)))
+        return None
+
+
+def install(app, policies: dict | None = None, backend=None):
+    """Call before any before_request hook that touches the DB."""
+    if os.environ.get("RATELIMIT_ENABLED", "1") == "0":
+        return None
+    if backend is None:
+        backend = backend_from_url(os.environ.get("RATELIMIT_STORAGE_URL"))
+    limiter = RateLimiter(backend, DEFAULT_POLICIES if policies is None else policies)
+    app.before_request(limiter.check)
+    app.extensions["ratelimit"] = limiter
+    return limiter
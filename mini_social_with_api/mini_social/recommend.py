@@ -0,0 +1,356 @@
+"""
+Who to follow: friends-of-friends and co-like signals, computed in batch with sparse matrices.
+
+    GET /api/users/recommended[?limit=10]
+    python recommend.py run [--db PATH]                  # recompute everyone now
+    python recommend.py bench [--users 1000000]          # synthetic graph, runtime and memory
+    python maintenance.py recommend                      # the same run, as a maintenance task
+
+    RECOMMEND_K          recommendations stored per user (default 20, also the max limit)
+    RECOMMEND_WEIGHTS    weight per signal (default mutuals=1.0,co_likes=0.5)
+    RECOMMEND_BATCH      users per matrix product and per write transaction (default 2000)
+    RECOMMEND_MAX_LIKERS posts liked by more people are ignored for co-likes (default 100)
+
+With F the users x users follow matrix and L the users x posts like matrix,
+both 0/1 in scipy CSR form, for a batch of users B:
+
+    mutuals   F[B] @ F     people followed by the people B follows, counted
+                           by how many of them do
+    co_likes  L[B] @ L.T   people who liked the same posts, counted by posts
+
+score = weights . (mutuals, co_likes); people a user already follows and the
+user themself are dropped, and the K best per user are picked for the whole
+batch at once (one sort over the batch's non-zeros, no loop per user).
+Posts liked by more than RECOMMEND_MAX_LIKERS people are left out of L.T:
+they say little about taste, and a post with m likers adds m^2 pairs.  Only
+the hot tier is read (archive.py), so co-likes follow recent taste.
+
+The job is the "recommend" maintenance task (maintenance.py, hourly by
+default), so it runs in the background of one worker at a time, never in a
+request.  Each batch replaces its users' rows in user_recommendations in one
+short transaction, stamped with computed_at.  The endpoint is one keyed read
+of those rows (primary key user_id, rank), which also drops anyone the user
+followed since the last run.  A run reports its runtime and the memory it
+added at its peak (peak RSS during the run minus RSS at its start) in the
+maintenance_runs detail and in mini_social_recommend_peak_bytes.  From the
+command line (run, bench) the kernel's RSS high-water mark is reset when the
+run starts on Linux; elsewhere only the lifetime peak is known, so the figure
+is an upper bound.  The maintenance task runs inside a server worker and
+must not reset that worker's peak, so there RSS is sampled after loading and
+after every batch instead, which gives a lower bound.
+
+SciPy is optional and imported only by the job; without it the task is
+skipped and the endpoint returns whatever was stored (or nothing).
+"""
+import argparse
+import importlib.util
+import itertools
+import os
+import resource
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import metrics
+
+SIGNALS = ("mutuals", "co_likes")
+DEFAULT_WEIGHTS = "mutuals=1.0,co_likes=0.5"
+TOP_K = int(os.environ.get("RECOMMEND_K", 20))
+BATCH = int(os.environ.get("RECOMMEND_BATCH", 2000))
+MAX_LIKERS = int(os.environ.get("RECOMMEND_MAX_LIKERS", 100))
+EXCLUDED = 1e9
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS user_recommendations (
+        user_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        candidate_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        mutuals INTEGER NOT NULL,
+        co_likes INTEGER NOT NULL,
+        computed_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, rank)
+    ) WITHOUT ROWID
+"""
+
+RECOMMENDED_SQL = """
+    SELECT users.id, users.username, r.score, r.mutuals, r.co_likes, r.computed_at
+    FROM user_recommendations AS r
+    JOIN users ON users.id = r.candidate_id
+    WHERE r.user_id = ?
+      AND NOT EXISTS (
+          SELECT 1 FROM follows WHERE follows.follower_id = r.user_id AND follows.followee_id = r.candidate_id
+      )
+    ORDER BY r.rank
+    LIMIT ?
+"""
+
+RECOMMEND_PEAK_BYTES = metrics.Gauge(
+    "mini_social_recommend_peak_bytes",
+    "Peak resident memory the last recommendation run added to the process (peak RSS minus RSS at its start).",
+)
+
+
+def init(conn):
+    conn.execute(SCHEMA)
+
+
+def available() -> bool:
+    return importlib.util.find_spec("scipy") is not None
+
+
+def parse_weights(value: str | None = None) -> dict[str, float]:
+    weights = dict.fromkeys(SIGNALS, 0.0)
+    for item in (value or os.environ.get("RECOMMEND_WEIGHTS") or DEFAULT_WEIGHTS).split(","):
+        name, _, number = item.partition("=")
+        if name.strip() not in weights:
+            raise ValueError(f"unknown recommendation signal {name.strip()!r}; use {', '.join(SIGNALS)}")
+        weights[name.strip()] = float(number)
+    return weights
+
+
+def _rss() -> tuple[int, int]:
+    """(current, peak) resident bytes of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return 0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+
+def _start_peak() -> int:
+    """Resets the RSS high-water mark where the kernel allows it; returns the current RSS.
+
+    The mark is per process: only call this from the command line, never in a server worker.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass  # not Linux: the peak read later may predate this run
+    return _rss()[0]
+
+
+def _peak_since(base: int) -> int:
+    return max(_rss()[1] - base, 0)
+
+
+# -- batch job --
+
+def matrices(follows, likes, users: int, max_likers: int = MAX_LIKERS):
+    """(F, L, LT) from (follower, followee) and (user, post) int32 pair arrays."""
+    import numpy as np
+    from scipy import sparse
+
+    follow = sparse.csr_matrix(
+        (np.ones(len(follows), dtype=np.float32), (follows[:, 0], follows[:, 1])), shape=(users, users)
+    )
+    posts = int(likes[:, 1].max()) + 1 if len(likes) else 1
+    likers = np.bincount(likes[:, 1], minlength=posts)
+    likes = likes[(likers[likes[:, 1]] >= 2) & (likers[likes[:, 1]] <= max_likers)]
+    like = sparse.csr_matrix(
+        (np.ones(len(likes), dtype=np.float32), (likes[:, 0], likes[:, 1])), shape=(users, posts)
+    )
+    return follow, like, like.T.tocsr()
+
+
+def recommend_batch(follow, like, like_t, start: int, stop: int, k: int = TOP_K, weights=None):
+    """(user, rank, candidate, score, mutuals, co_likes) arrays for users start..stop-1."""
+    import numpy as np
+    from scipy import sparse
+
+    weights = parse_weights() if weights is None else weights
+    mutuals = follow[start:stop] @ follow
+    co_likes = like[start:stop] @ like_t
+    # people already followed, and the users themselves, sink below zero and are cut after the top k
+    rows = stop - start
+    seen = follow[start:stop] + sparse.csr_matrix(
+        (np.ones(rows, dtype=np.float32), (np.arange(rows), np.arange(start, stop))), shape=mutuals.shape
+    )
+    score = (weights["mutuals"] * mutuals + weights["co_likes"] * co_likes - EXCLUDED * seen).tocsr()
+
+    # top k per row for the whole batch: one float key (row, then -score) and a stable sort,
+    # ~10x faster than lexsort; ties keep the products' order
+    row = np.repeat(np.arange(rows, dtype=np.int32), np.diff(score.indptr))
+    value = np.maximum(score.data, -1.0)  # excluded ones at -1 keep the key inside their row's range
+    span = float(value.max()) + 2 if score.nnz else 1.0
+    order = np.argsort(row * span - value, kind="stable")
+    rank = np.arange(len(order)) - score.indptr[row[order]]
+    keep = (rank < k) & (value[order] > 0)
+    rank, keep = rank[keep], order[keep]
+    row, candidate = row[keep], score.indices[keep]
+    return (
+        row + start,
+        rank,
+        candidate,
+        score.data[keep],
+        np.asarray(mutuals[row, candidate]).ravel(),
+        np.asarray(co_likes[row, candidate]).ravel(),
+    )
+
+
+def _pairs(conn, sql: str):
+    import numpy as np
+
+    flat = np.fromiter(itertools.chain.from_iterable(conn.execute(sql)), dtype=np.int32)
+    return flat.reshape(-1, 2)
+
+
+def run(db_path: str, k: int = TOP_K, batch: int = BATCH, log=None, reset_peak: bool = False) -> str:
+    """Recomputes every user's recommendations; returns a one-line report.
+
+    reset_peak measures memory with the kernel's high-water mark (see _start_peak);
+    without it RSS is sampled between the stages of the run.
+    """
+    started = time.perf_counter()
+    base = _start_peak() if reset_peak else _rss()[0]
+    sampled = base
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        init(conn)
+        users = (conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+        follows = _pairs(conn, "SELECT follower_id, followee_id FROM follows")
+        likes = _pairs(conn, "SELECT user_id, post_id FROM likes")
+        follow, like, like_t = matrices(follows, likes, users)
+        sampled = max(sampled, _rss()[0])
+        del follows, likes
+        loaded = time.perf_counter()
+
+        computed_at = datetime.utcnow().isoformat()
+        weights = parse_weights()
+        stored = 0
+        for start in range(0, users, batch):
+            stop = min(start + batch, users)
+            columns = recommend_batch(follow, like, like_t, start, stop, k, weights)
+            sampled = max(sampled, _rss()[0])
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM user_recommendations WHERE user_id >= ? AND user_id < ?", (start, stop))
+                conn.executemany(
+                    "INSERT INTO user_recommendations "
+                    "(user_id, rank, candidate_id, score, mutuals, co_likes, computed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    zip(*(c.tolist() for c in columns), itertools.repeat(computed_at)),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            stored += len(columns[0])
+    finally:
+        conn.close()
+
+    peak = _peak_since(base) if reset_peak else sampled - base
+    RECOMMEND_PEAK_BYTES.set(value=peak)
+    report = (
+        f"{stored:,} recommendations for {users - 1:,} users from {follow.nnz:,} follows and {like.nnz:,} likes "
+        f"in {time.perf_counter() - started:.1f}s (load {loaded - started:.1f}s), peak memory +{peak / 1e6:,.0f} MB"
+    )
+    if log:
+        log(report)
+    return report
+
+
+def install(app, get_db, current_user):
+    """Adds GET /api/users/recommended to an sqlite-backed app."""
+    from flask import jsonify, request
+
+    def api_recommended():
+        user = current_user()
+        if not user:
+            return jsonify({"error": "Authentication required."}), 401
+        try:
+            limit = min(max(int(request.args.get("limit") or 10), 1), TOP_K)
+        except ValueError:
+            return jsonify({"error": "Invalid limit."}), 400
+
+        conn = get_db()
+        rows = conn.execute(RECOMMENDED_SQL, (user["id"], limit)).fetchall()
+        conn.close()
+        return jsonify(
+            {
+                "limit": limit,
+                "computed_at": rows[0]["computed_at"] if rows else None,
+                "users": [
+                    {
+                        "id": r["id"],
+                        "username": r["username"],
+                        "score": r["score"],
+                        "mutuals": r["mutuals"],
+                        "co_likes": r["co_likes"],
+                    }
+                    for r in rows
+                ],
+            }
+        )
+
+    app.add_url_rule("/api/users/recommended", "api_recommended", api_recommended)
+
+
+# -- benchmark --
+
+def bench(users: int = 1_000_000, follows_per_user: int = 20, likes_per_user: int = 10,
+          k: int = TOP_K, batch: int = BATCH, log=print):
+    """Runs the matrix part of the job on a synthetic power-law graph."""
+    import numpy as np
+
+    rng = np.random.default_rng(50)
+    base = _start_peak()
+
+    def popular(size, n):
+        # Zipf-like popularity: a few people / posts get most follows and likes
+        return np.minimum((rng.pareto(1.2, size) * n / 50).astype(np.int64), n - 1).astype(np.int32) + 1
+
+    started = time.perf_counter()
+    out_degree = np.minimum(rng.pareto(1.5, users) * follows_per_user / 3, 5000).astype(np.int64)
+    follows = np.column_stack((np.repeat(np.arange(1, users + 1, dtype=np.int32), out_degree),
+                               popular(int(out_degree.sum()), users)))
+    follows = np.unique(follows[follows[:, 0] != follows[:, 1]], axis=0)
+    posts = users * 10
+    like_degree = np.minimum(rng.pareto(1.5, users) * likes_per_user / 3, 5000).astype(np.int64)
+    likes = np.column_stack((np.repeat(np.arange(1, users + 1, dtype=np.int32), like_degree),
+                             popular(int(like_degree.sum()), posts)))
+    likes = np.unique(likes, axis=0)
+    generated = time.perf_counter()
+    log(f"synthetic graph: {users:,} users, {len(follows):,} follows, {len(likes):,} likes "
+        f"({generated - started:.1f}s)")
+
+    follow, like, like_t = matrices(follows, likes, users + 1)
+    del follows, likes
+    built = time.perf_counter()
+    sizes = sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in (follow, like, like_t))
+    log(f"  matrices        {built - generated:7.1f}s  {sizes / 1e6:8,.0f} MB  "
+        f"({like.nnz:,} likes kept for co-likes)")
+
+    weights = parse_weights()
+    stored = 0
+    for start in range(0, users + 1, batch):
+        stored += len(recommend_batch(follow, like, like_t, start, min(start + batch, users + 1), k, weights)[0])
+    done = time.perf_counter()
+    log(f"  recommendations {done - built:7.1f}s  {stored:,} stored rows "
+        f"({(done - built) / (users / 1e6):.1f}s per million users)")
+    log(f"  total           {done - started:7.1f}s  peak memory +{_peak_since(base) / 1e6:,.0f} MB "
+        f"(on top of {base / 1e6:,.0f} MB for the interpreter and imports)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Who-to-follow recommendations.")
+    parser.add_argument("what", choices=["run", "bench"])
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH", "database.db"))
+    parser.add_argument("--users", type=int, default=1_000_000, help="bench: synthetic users")
+    parser.add_argument("--batch", type=int, default=BATCH)
+    args = parser.parse_args()
+
+    if not available():
+        raise SystemExit("recommend needs scipy: pip install scipy")
+    if args.what == "bench":
+        bench(args.users, batch=args.batch)
+    else:
+        run(args.db, batch=args.batch, log=print, reset_peak=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
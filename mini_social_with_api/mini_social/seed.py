@@ -0,0 +1,200 @@
+"""
+Synthetic dataset generator.
+
+    python seed.py --db bench.db --scale medium
+    python seed.py --db big.db --users 1000000 --posts 5000000 --likes 20000000 --comments 5000000
+
+Shapes the data roughly like a real community:
+  * follows: out-degree is Pareto distributed, followees are picked with a
+    strong popularity skew (power-law in-degree)
+  * posts: a small share of authors writes most posts; created_at increases
+    with id over --days so id order and time order agree
+  * likes / comments: skewed toward popular and recent posts
+
+Every user is "user<N>" with password --password, so the load driver can
+log in as any of them.  Rows are written with executemany in large
+transactions with journaling relaxed for the duration of the load.
+"""
+import argparse
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+SCALES = {
+    "tiny": dict(users=50, posts=300, follows_per_user=8, likes=1_500, comments=600),
+    "small": dict(users=1_000, posts=10_000, follows_per_user=20, likes=50_000, comments=20_000),
+    "medium": dict(users=20_000, posts=200_000, follows_per_user=40, likes=1_000_000, comments=400_000),
+    "large": dict(users=200_000, posts=2_000_000, follows_per_user=60, likes=15_000_000, comments=4_000_000),
+}
+
+BATCH = 50_000
+
+WORDS = (
+    "coffee morning code deploy weekend music run city rain coffee book friends "
+    "train lunch idea bug fix ship launch photo walk night sunny cloudy dinner "
+    "game team meeting travel snow park dog cat garden movie pizza"
+).split()
+
+
+def skewed_index(rng: random.Random, n: int, skew: float) -> int:
+    """0..n-1, with low indexes far more likely as skew grows (skew=1 is uniform)."""
+    return min(int(n * (rng.random() ** skew)), n - 1)
+
+
+def random_text(rng: random.Random, lo: int, hi: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(lo, hi)))
+
+
+def insert_batches(conn, sql: str, rows, label: str, total: int):
+    started = time.perf_counter()
+    batch = []
+    done = 0
+    inserted = 0  # INSERT OR IGNORE drops duplicates, so this can be less than done
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            inserted += conn.executemany(sql, batch).rowcount
+            conn.commit()
+            done += len(batch)
+            batch.clear()
+            elapsed = time.perf_counter() - started
+            print(f"  {label}: {done:,}/{total:,} ({done / elapsed:,.0f} rows/s)", end="\r", flush=True)
+    if batch:
+        inserted += conn.executemany(sql, batch).rowcount
+        conn.commit()
+        done += len(batch)
+    elapsed = time.perf_counter() - started
+    skipped = f", {done - inserted:,} duplicates skipped" if inserted < done else ""
+    print(f"  {label}: {inserted:,} rows in {elapsed:.1f}s ({done / max(elapsed, 1e-9):,.0f} rows/s{skipped})")
+    return inserted
+
+
+def generate(db_path: str, users: int, posts: int, follows_per_user: int, likes: int, comments: int,
+             days: int = 365, password: str = "password123", seed: int = 42):
+    import app_api
+
+    rng = random.Random(seed)
+    app_api.DB_PATH = db_path
+    app_api.init_db()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -200000")
+
+    existing = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    if existing:
+        raise SystemExit(f"{db_path} already has {existing} users; seed into a fresh file.")
+
+    start = datetime.utcnow() - timedelta(days=days)
+    span = days * 86400.0
+
+    def ts(fraction: float) -> str:
+        return (start + timedelta(seconds=span * fraction)).isoformat()
+
+    # one hash for everybody: hashing millions of passwords would dominate the run
+    pw_hash = generate_password_hash(password)
+
+    print(f"Seeding {db_path}")
+    insert_batches(
+        conn,
+        "INSERT INTO users (id, username, password_hash, created_at) VALUES (?, ?, ?, ?)",
+        ((i, f"user{i}", pw_hash, ts(0.0)) for i in range(1, users + 1)),
+        "users",
+        users,
+    )
+
+    def follow_rows():
+        for follower in range(1, users + 1):
+            degree = min(int(rng.paretovariate(1.5) * follows_per_user / 3), users - 1)
+            seen = set()
+            for _ in range(degree):
+                followee = skewed_index(rng, users, 3.0) + 1
+                if followee == follower or followee in seen:
+                    continue
+                seen.add(followee)
+                yield follower, followee, ts(rng.random())
+
+    total_follows = insert_batches(
+        conn,
+        "INSERT OR IGNORE INTO follows (follower_id, followee_id, created_at) VALUES (?, ?, ?)",
+        follow_rows(),
+        "follows",
+        users * follows_per_user,
+    )
+
+    insert_batches(
+        conn,
+        "INSERT INTO posts (id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
+        (
+            (i, skewed_index(rng, users, 2.0) + 1, random_text(rng, 3, 30), ts(i / (posts + 1)))
+            for i in range(1, posts + 1)
+        ),
+        "posts",
+        posts,
+    )
+
+    def engagement_post() -> int:
+        # recent (high id) posts collect most of the engagement
+        return posts - skewed_index(rng, posts, 3.0)
+
+    total_likes = insert_batches(
+        conn,
+        "INSERT OR IGNORE INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)",
+        (
+            (skewed_index(rng, users, 1.5) + 1, pid, ts(min(pid / (posts + 1) + rng.random() * 0.01, 1.0)))
+            for pid in (engagement_post() for _ in range(likes))
+        ),
+        "likes",
+        likes,
+    )
+
+    insert_batches(
+        conn,
+        "INSERT INTO comments (post_id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
+        (
+            (pid, skewed_index(rng, users, 1.5) + 1, random_text(rng, 2, 15),
+             ts(min(pid / (posts + 1) + rng.random() * 0.01, 1.0)))
+            for pid in (engagement_post() for _ in range(comments))
+        ),
+        "comments",
+        comments,
+    )
+
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {"users": users, "follows": total_follows, "posts": posts, "likes": total_likes, "comments": comments}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic mini_social dataset.")
+    parser.add_argument("--db", required=True, help="SQLite file to create")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--posts", type=int)
+    parser.add_argument("--follows-per-user", type=int)
+    parser.add_argument("--likes", type=int)
+    parser.add_argument("--comments", type=int)
+    parser.add_argument("--days", type=int, default=365, help="time span covered by created_at")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    params = dict(SCALES[args.scale])
+    for key in params:
+        value = getattr(args, key)
+        if value is not None:
+            params[key] = value
+
+    started = time.perf_counter()
+    generate(args.db, days=args.days, password=args.password, seed=args.seed, **params)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,596 @@
+"""
+Sharding of posts, likes and comments by author user id.
+
+    SHARD_PATHS=s0.db,s1.db,s2.db python shards.py split    # copy the main DB's rows into the shards
+    SHARD_PATHS=s0.db,s1.db,s2.db gunicorn "app_api:create_app()"
+    python shards.py status                                 # rows and users per shard
+    python shards.py check [--users 200] [--pages 3]        # sharded feeds against the main DB's
+    python shards.py rebalance [--tolerance 0.1] [--dry-run]
+    python shards.py move <username> <shard>
+    python shards.py feed <username> [--limit 20]           # following feed, scatter-gather
+
+users and follows stay in the main database (SQLITE_PATH).  A user's posts,
+and every like and comment on those posts, live in one shard, so counts and
+the viewer's liked state are computed inside a single shard.  The main
+database also holds the directory:
+
+    shard_directory(user_id, shard, state)   where each author's rows live;
+                                             state is 'moving' during a move
+    post_directory(post_id, user_id)         post owners, and the global post
+                                             id sequence (AUTOINCREMENT)
+    shard_sequences(name, next_id)           other global ids (comments)
+
+New authors are placed on user_id % N.  Lookups are cached per process for
+CACHE_SECONDS; a move marks the user 'moving' (writes for them raise
+ShardMoving) and waits that long before copying, and the source rows are
+deleted only another CACHE_SECONDS after the directory points at the new
+shard, so a stale cache never sees a half-moved user.
+
+A shard connection (Shards.connect) opens the shard file with the main
+database attached, so the app's own SQL runs on it unchanged: posts, likes
+and comments resolve to the shard, users, follows and the trending tables to
+the main database.  With SHARD_PATHS set, app_api (install()) reads and
+writes through this module:
+
+    feeds      the page query runs on every shard that holds one of the
+               feed's authors, in parallel (ORDER BY id DESC LIMIT n on each),
+               and the sorted lists are merged, keeping the id cursor
+    profiles   the author's shard only
+    writes     Shards.write() takes the writer ops (writer.py) to the shard
+               that owns the post; post and comment ids come from the main
+               database, follows are written there
+
+A write transaction on a shard also locks the main database, where the
+trending counters are, so sharding spreads rows and reads, not SQLite's one
+writer per file.  The writer service (WRITER_SOCKET) and the archive
+(ARCHIVE_PATH) work on the main database only and cannot be combined with
+SHARD_PATHS; the ranked feed, trending, recommendations and export read the
+main database's posts and are not offered while sharded.
+
+split leaves the main database's own posts / likes / comments in place; check
+compares sharded feeds with them, so run it before new writes land.
+Rebalancing moves the users whose load best closes the gap between the
+fullest and the emptiest shard until they are within --tolerance of the
+mean; adding a path to SHARD_PATHS and rebalancing fills the new shard.
+"""
+import argparse
+import contextvars
+import heapq
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
+
+import metrics
+import writer
+
+CACHE_SECONDS = float(os.environ.get("SHARD_CACHE_SECONDS", 5))
+ID_BLOCK = 100
+
+SHARD_SCHEMA = """
+    PRAGMA journal_mode = WAL;
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS likes (
+        user_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, post_id)
+    );
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY,
+        post_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS posts_user_id ON posts (user_id, id, created_at);
+    CREATE INDEX IF NOT EXISTS likes_post_id ON likes (post_id, created_at);
+    CREATE INDEX IF NOT EXISTS comments_post_id ON comments (post_id, created_at);
+"""
+
+DIRECTORY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shard_directory (
+        user_id INTEGER PRIMARY KEY,
+        shard INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'active'
+    );
+    CREATE TABLE IF NOT EXISTS post_directory (
+        post_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS shard_sequences (
+        name TEXT PRIMARY KEY,
+        next_id INTEGER NOT NULL
+    );
+"""
+
+FEED_SQL = """
+    SELECT
+        posts.id,
+        posts.user_id,
+        users.username,
+        posts.content,
+        posts.created_at,
+        (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id) AS like_count,
+        (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) AS comment_count,
+        EXISTS (SELECT 1 FROM likes WHERE likes.post_id = posts.id AND likes.user_id = ?) AS liked_by_me
+    FROM posts
+    JOIN users ON users.id = posts.user_id
+    WHERE {where}
+    ORDER BY posts.id DESC
+    LIMIT ?
+"""
+
+SHARD_QUERY_SECONDS = metrics.Histogram(
+    "mini_social_shard_query_seconds",
+    "Per-shard query time of scatter-gather reads.",
+    ("shard",),
+)
+
+
+class ShardMoving(writer.WriteError):
+    """The user's rows are being moved to another shard; retry shortly."""
+
+
+def paths() -> list[str]:
+    """SHARD_PATHS as a list; empty when sharding is off."""
+    return [p.strip() for p in os.environ.get("SHARD_PATHS", "").split(",") if p.strip()]
+
+
+class Shards:
+    def __init__(self, main_path: str, shard_paths: list[str], cache_seconds: float = CACHE_SECONDS):
+        if not shard_paths:
+            raise ValueError("no shards configured (SHARD_PATHS)")
+        self.main_path = main_path
+        self.paths = list(shard_paths)
+        self.cache_seconds = cache_seconds
+        self._cache: dict[int, tuple[int, str, float]] = {}
+        self._ids: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        # the writer ops (writer.py) applied directly, one client per database
+        self._main_writer = writer.Client(self.main)
+        self._writers = [writer.Client(partial(self.connect, i)) for i in range(len(self.paths))]
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("SQLITE_PATH", "database.db"), paths())
+
+    # -- connections --
+
+    def main(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.main_path, timeout=30, factory=metrics.InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def shard(self, index: int) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.paths[index], timeout=30, factory=metrics.InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect(self, index: int) -> sqlite3.Connection:
+        """A shard with the main database attached: unqualified users / follows resolve there."""
+        conn = self.shard(index)
+        conn.execute("ATTACH DATABASE ? AS main_db", (self.main_path,))
+        return conn
+
+    def init(self):
+        conn = self.main()
+        conn.executescript(DIRECTORY_SCHEMA)
+        conn.close()
+        for i in range(len(self.paths)):
+            conn = self.shard(i)
+            conn.executescript(SHARD_SCHEMA)
+            conn.close()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # sqlite3 releases the GIL while it works, so threads do query the shards in parallel
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=len(self.paths), thread_name_prefix="shard")
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    # -- directory --
+
+    def locate(self, user_ids) -> dict[int, tuple[int, str]]:
+        """user_id -> (shard, state); unplaced users are placed on user_id % N."""
+        now = time.monotonic()
+        found, missing = {}, []
+        for uid in user_ids:
+            hit = self._cache.get(uid)
+            if hit is not None and hit[2] > now:
+                found[uid] = hit[:2]
+            else:
+                missing.append(uid)
+        if missing:
+            conn = self.main()
+            try:
+                for chunk in _chunks(missing, 500):
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT user_id, shard, state FROM shard_directory WHERE user_id IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                    known = {r["user_id"]: (r["shard"], r["state"]) for r in rows}
+                    new = [(uid, uid % len(self.paths)) for uid in chunk if uid not in known]
+                    if new:
+                        conn.executemany("INSERT OR IGNORE INTO shard_directory (user_id, shard) VALUES (?, ?)", new)
+                        conn.commit()
+                        known.update({uid: (shard, "active") for uid, shard in new})
+                    for uid, entry in known.items():
+                        found[uid] = entry
+                        self._cache[uid] = (*entry, now + self.cache_seconds)
+            finally:
+                conn.close()
+        return found
+
+    def shard_of(self, user_id: int, for_write: bool = False) -> int:
+        shard, state = self.locate([user_id])[user_id]
+        if for_write and state != "active":
+            raise ShardMoving(f"user {user_id} is being moved to another shard; try again shortly")
+        return shard
+
+    def shards_of_users(self, user_ids) -> list[int]:
+        return sorted({shard for shard, _ in self.locate(user_ids).values()})
+
+    def post_owners(self, post_ids) -> dict[int, int]:
+        """post_id -> author user_id, for the posts that exist."""
+        owners = {}
+        conn = self.main()
+        try:
+            for chunk in _chunks(list(post_ids), 500):
+                rows = conn.execute(
+                    f"SELECT post_id, user_id FROM post_directory WHERE post_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                owners.update((r["post_id"], r["user_id"]) for r in rows)
+        finally:
+            conn.close()
+        return owners
+
+    def shards_of_posts(self, post_ids) -> list[int]:
+        owners = self.post_owners(post_ids)
+        return self.shards_of_users(set(owners.values())) if owners else []
+
+    def next_id(self, name: str) -> int:
+        """Global id from shard_sequences, reserved ID_BLOCK at a time per process."""
+        with self._lock:
+            nxt, end = self._ids.get(name, (0, 0))
+            if nxt >= end:
+                conn = self.main()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("INSERT OR IGNORE INTO shard_sequences (name, next_id) VALUES (?, 1)", (name,))
+                    nxt = conn.execute("SELECT next_id FROM shard_sequences WHERE name = ?", (name,)).fetchone()[0]
+                    end = nxt + ID_BLOCK
+                    conn.execute("UPDATE shard_sequences SET next_id = ? WHERE name = ?", (end, name))
+                    conn.commit()
+                finally:
+                    conn.close()
+            self._ids[name] = (nxt + 1, end)
+            return nxt
+
+    # -- writes --
+
+    def write(self, name: str, **args):
+        """writer.Client.write() for a sharded app: each op goes to the database that owns its rows."""
+        if name in ("follow", "unfollow"):
+            return self._main_writer.write(name, **args)
+        if name == "post":
+            shard = self.shard_of(args["user_id"], for_write=True)
+            # a failed insert below leaves a gap in the ids, nothing else
+            conn = self.main()
+            try:
+                args["post_id"] = conn.execute(
+                    "INSERT INTO post_directory (user_id) VALUES (?)", (args["user_id"],)
+                ).lastrowid
+                conn.commit()
+            finally:
+                conn.close()
+        else:
+            owner = self.post_owners([args["post_id"]]).get(args["post_id"])
+            if owner is None:
+                if name == "comment":
+                    raise writer.WriteError(f"post {args['post_id']} does not exist")
+                return False
+            shard = self.shard_of(owner, for_write=True)
+            if name == "comment":
+                args["comment_id"] = self.next_id("comments")
+        return self._writers[shard].write(name, **args)
+
+    # -- scatter-gather reads --
+
+    def _query_shard(self, shard: int, sql: str, params) -> list[dict]:
+        started = time.perf_counter()
+        conn = self.connect(shard)
+        try:
+            rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+        SHARD_QUERY_SECONDS.observe(time.perf_counter() - started, str(shard))
+        return rows
+
+    def scatter(self, sql: str, params, shard_ids=None, order_by: str = "id", reverse: bool = False,
+                limit: int | None = None) -> list[dict]:
+        """
+        Runs one query on each of shard_ids (every shard when None) in
+        parallel and merges the rows, which each shard returns sorted by the
+        order_by column; the first `limit` of the merged list.
+        """
+        shard_ids = range(len(self.paths)) if shard_ids is None else shard_ids
+        # each query runs in a copy of this context, so it counts in the request's SQL stats
+        futures = [
+            self._executor().submit(contextvars.copy_context().run, self._query_shard, shard, sql, params)
+            for shard in shard_ids
+        ]
+        merged = heapq.merge(*(f.result() for f in futures), key=itemgetter(order_by), reverse=reverse)
+        return list(itertools.islice(merged, limit))
+
+    def feed(self, author_ids: list[int] | None, viewer_id: int | None, before_id: int | None, limit: int) -> list[dict]:
+        """Newest posts (id DESC) by author_ids, or by everyone when None, older than before_id."""
+        conditions, params = [], [viewer_id]
+        if author_ids is not None:
+            if not author_ids:
+                return []
+            conditions.append(f"posts.user_id IN ({','.join('?' * len(author_ids))})")
+            params.extend(author_ids)
+        if before_id is not None:
+            conditions.append("posts.id < ?")
+            params.append(before_id)
+        sql = FEED_SQL.format(where=" AND ".join(conditions) or "1")
+        targets = None if author_ids is None else self.shards_of_users(author_ids)
+        return self.scatter(sql, (*params, limit), targets, order_by="id", reverse=True, limit=limit)
+
+    def following_feed(self, viewer_id: int, before_id: int | None = None, limit: int = 20) -> list[dict]:
+        """The viewer's and their followees' posts, as app_api's following feed."""
+        conn = self.main()
+        authors = [r[0] for r in conn.execute("SELECT followee_id FROM follows WHERE follower_id = ?", (viewer_id,))]
+        conn.close()
+        return self.feed([*authors, viewer_id], viewer_id, before_id, limit)
+
+    # -- maintenance --
+
+    def split(self):
+        """Copies posts / likes / comments from the main database into the shards."""
+        self.init()
+        n = len(self.paths)
+        conn = self.main()
+        conn.execute("INSERT OR IGNORE INTO shard_directory (user_id, shard) SELECT id, id % ? FROM users", (n,))
+        conn.execute("INSERT OR IGNORE INTO post_directory (post_id, user_id) SELECT id, user_id FROM posts")
+        top = conn.execute("SELECT COALESCE(MAX(id), 0) FROM comments").fetchone()[0]
+        conn.execute(
+            "INSERT INTO shard_sequences (name, next_id) VALUES ('comments', ?)"
+            " ON CONFLICT (name) DO UPDATE SET next_id = MAX(next_id, excluded.next_id)",
+            (top + 1,),
+        )
+        conn.commit()
+        conn.close()
+
+        for i in range(n):
+            conn = self.shard(i)
+            conn.execute("ATTACH DATABASE ? AS main_db", (self.main_path,))
+            conn.execute(
+                """INSERT OR IGNORE INTO posts (id, user_id, content, created_at, version)
+                SELECT p.id, p.user_id, p.content, p.created_at, p.version
+                FROM main_db.posts p JOIN main_db.shard_directory d ON d.user_id = p.user_id
+                WHERE d.shard = ?""",
+                (i,),
+            )
+            conn.execute(
+                """INSERT OR IGNORE INTO likes (user_id, post_id, created_at)
+                SELECT l.user_id, l.post_id, l.created_at FROM main_db.likes l JOIN posts p ON p.id = l.post_id"""
+            )
+            conn.execute(
+                """INSERT OR IGNORE INTO comments (id, post_id, user_id, content, created_at)
+                SELECT c.id, c.post_id, c.user_id, c.content, c.created_at
+                FROM main_db.comments c JOIN posts p ON p.id = c.post_id"""
+            )
+            conn.commit()
+            conn.execute("DETACH DATABASE main_db")
+            conn.close()
+
+    def check(self, users: int = 200, pages: int = 3, limit: int = 20, log=print) -> int:
+        """
+        Reads following feeds of `users` random users from the shards and
+        with the same query from the main database's own tables (as split left
+        them); returns the number of pages that differ.
+        """
+        fields = itemgetter("id", "username", "like_count", "comment_count", "liked_by_me")
+        conn = self.main()
+        viewers = [r[0] for r in conn.execute("SELECT id FROM users ORDER BY RANDOM() LIMIT ?", (users,))]
+        differ = 0
+        for viewer in viewers:
+            authors = [r[0] for r in conn.execute("SELECT followee_id FROM follows WHERE follower_id = ?", (viewer,))]
+            authors.append(viewer)
+            before = None
+            for _ in range(pages):
+                where = f"posts.user_id IN ({','.join('?' * len(authors))})"
+                params = [viewer, *authors]
+                if before is not None:
+                    where += " AND posts.id < ?"
+                    params.append(before)
+                expected = [fields(dict(r)) for r in conn.execute(FEED_SQL.format(where=where), (*params, limit))]
+                got = [fields(p) for p in self.following_feed(viewer, before, limit)]
+                if got != expected:
+                    differ += 1
+                    log(f"  user {viewer} before {before}: {len(got)} sharded posts, {len(expected)} expected")
+                if len(expected) < limit:
+                    break
+                before = expected[-1][0]
+        conn.close()
+        return differ
+
+    def loads(self) -> dict[int, dict[int, int]]:
+        """shard -> {user_id: rows (posts + likes and comments on them)}."""
+        out = {}
+        for i in range(len(self.paths)):
+            conn = self.shard(i)
+            rows = conn.execute(
+                """SELECT p.user_id,
+                          COUNT(*) + COALESCE(SUM(lc.n), 0) + COALESCE(SUM(cc.n), 0) AS load
+                   FROM posts p
+                   LEFT JOIN (SELECT post_id, COUNT(*) AS n FROM likes GROUP BY post_id) lc ON lc.post_id = p.id
+                   LEFT JOIN (SELECT post_id, COUNT(*) AS n FROM comments GROUP BY post_id) cc ON cc.post_id = p.id
+                   GROUP BY p.user_id"""
+            ).fetchall()
+            conn.close()
+            out[i] = {r["user_id"]: r["load"] for r in rows}
+        return out
+
+    def move(self, user_id: int, target: int, log=print):
+        source = self.shard_of(user_id)
+        if source == target:
+            log(f"user {user_id} is already on shard {target}")
+            return
+        conn = self.main()
+        conn.execute("UPDATE shard_directory SET state = 'moving' WHERE user_id = ?", (user_id,))
+        conn.commit()
+        # every process's cache now sees 'moving' and stops writing for this user
+        time.sleep(self.cache_seconds)
+
+        src = self.shard(source)
+        src.execute("ATTACH DATABASE ? AS dst", (self.paths[target],))
+        src.execute("INSERT OR REPLACE INTO dst.posts SELECT * FROM posts WHERE user_id = ?", (user_id,))
+        owned = "(SELECT id FROM posts WHERE user_id = ?)"
+        src.execute(f"INSERT OR REPLACE INTO dst.likes SELECT * FROM likes WHERE post_id IN {owned}", (user_id,))
+        src.execute(f"INSERT OR REPLACE INTO dst.comments SELECT * FROM comments WHERE post_id IN {owned}", (user_id,))
+        src.commit()
+
+        conn.execute("UPDATE shard_directory SET shard = ?, state = 'active' WHERE user_id = ?", (target, user_id))
+        conn.commit()
+        conn.close()
+        self._cache.pop(user_id, None)
+        # stale caches may still read the source for a little while
+        time.sleep(self.cache_seconds)
+
+        src.execute(f"DELETE FROM likes WHERE post_id IN {owned}", (user_id,))
+        src.execute(f"DELETE FROM comments WHERE post_id IN {owned}", (user_id,))
+        src.execute("DELETE FROM posts WHERE user_id = ?", (user_id,))
+        src.commit()
+        src.execute("DETACH DATABASE dst")
+        src.close()
+        log(f"moved user {user_id}: shard {source} -> {target}")
+
+    def plan_rebalance(self, tolerance: float = 0.1) -> list[tuple[int, int, int, int]]:
+        """[(user_id, load, from, to)] that brings every shard within tolerance of the mean."""
+        loads = self.loads()
+        totals = {s: sum(users.values()) for s, users in loads.items()}
+        mean = sum(totals.values()) / len(totals)
+        moves = []
+        while True:
+            hi = max(totals, key=totals.get)
+            lo = min(totals, key=totals.get)
+            gap = totals[hi] - totals[lo]
+            if gap <= 2 * tolerance * mean or not loads[hi]:
+                break
+            # the user whose load is closest to half the gap closes it best
+            uid = min(loads[hi], key=lambda u: abs(loads[hi][u] - gap / 2))
+            load = loads[hi][uid]
+            if load >= gap:
+                break  # moving it would only flip the imbalance
+            moves.append((uid, load, hi, lo))
+            del loads[hi][uid]
+            loads[lo][uid] = load
+            totals[hi] -= load
+            totals[lo] += load
+        return moves
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def install(app, db_path: str):
+    """Shards for an sqlite-backed app when SHARD_PATHS is set, else None."""
+    shard_paths = paths()
+    if not shard_paths:
+        return None
+    for name in ("WRITER_SOCKET", "ARCHIVE_PATH"):
+        if os.environ.get(name):
+            raise SystemExit(f"{name} works on the main database only and cannot be combined with SHARD_PATHS")
+    shards = Shards(db_path, shard_paths)
+    app.extensions["shards"] = shards
+    return shards
+
+
+# -- CLI --
+
+def _user_id(shards: Shards, username: str) -> int:
+    conn = shards.main()
+    row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+    conn.close()
+    if not row:
+        raise SystemExit(f"No such user: {username}")
+    return row["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard posts, likes and comments by author.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("split", help="copy the main database's posts / likes / comments into the shards")
+    sub.add_parser("status", help="rows and users per shard")
+    ck = sub.add_parser("check", help="compare sharded following feeds with the main database's")
+    ck.add_argument("--users", type=int, default=200)
+    ck.add_argument("--pages", type=int, default=3)
+    rb = sub.add_parser("rebalance", help="move users until shards are within tolerance of the mean")
+    rb.add_argument("--tolerance", type=float, default=0.1)
+    rb.add_argument("--dry-run", action="store_true")
+    mv = sub.add_parser("move", help="move one user's rows to a shard")
+    mv.add_argument("username")
+    mv.add_argument("shard", type=int)
+    fd = sub.add_parser("feed", help="print a user's following feed (scatter-gather)")
+    fd.add_argument("username")
+    fd.add_argument("--limit", type=int, default=20)
+    fd.add_argument("--before", type=int)
+    args = parser.parse_args()
+
+    shards = Shards.from_env()
+    if args.cmd == "split":
+        started = time.perf_counter()
+        shards.split()
+        print(f"split into {len(shards.paths)} shards in {time.perf_counter() - started:.1f}s")
+        args.cmd = "status"
+    if args.cmd == "status":
+        for shard, users in shards.loads().items():
+            print(f"  shard {shard} {shards.paths[shard]}: {len(users):,} authors, {sum(users.values()):,} rows")
+    elif args.cmd == "check":
+        started = time.perf_counter()
+        differ = shards.check(args.users, args.pages)
+        print(f"{differ} differing pages for {args.users} users in {time.perf_counter() - started:.1f}s")
+        return 1 if differ else 0
+    elif args.cmd == "rebalance":
+        moves = shards.plan_rebalance(args.tolerance)
+        for uid, load, src, dst in moves:
+            print(f"  user {uid}: {load:,} rows, shard {src} -> {dst}")
+        if not moves:
+            print("  balanced")
+        if not args.dry_run:
+            for uid, _, _, dst in moves:
+                shards.move(uid, dst)
+    elif args.cmd == "move":
+        shards.move(_user_id(shards, args.username), args.shard)
+    elif args.cmd == "feed":
+        started = time.perf_counter()
+        posts = shards.following_feed(_user_id(shards, args.username), args.before, args.limit)
+        elapsed = time.perf_counter() - started
+        for p in posts:
+            print(f"  {p['id']:>8}  {p['username']:<16} likes {p['like_count']:>4}  {p['content'][:50]}")
+        print(f"{len(posts)} posts from {len(shards.paths)} shards in {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Slow-query log.
+
+Any statement whose execute + fetch time reaches SLOW_QUERY_MS is written as
+one JSON line to a rotating file, with the calling route, the shape of the
+bound parameters (never the values) and the query plan.  Plans are captured
+once per distinct SQL text and reused for later entries.
+
+Environment:
+    SLOW_QUERY_MS            threshold in ms; unset or negative disables the log
+    SLOW_QUERY_LOG           output path (default slow_queries.jsonl)
+    SLOW_QUERY_LOG_MAX_BYTES rotate after this many bytes (default 10 MB)
+    SLOW_QUERY_LOG_BACKUPS   rotated files to keep (default 5)
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+import metrics
+
+logger = logging.getLogger("mini_social.slowlog")
+
+MAX_PLANS = 1000
+
+_plans: dict[str, list | None] = {}
+_plans_lock = threading.Lock()
+
+
+def _shape(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def param_shapes(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _shape(v) for k, v in params.items()}
+    try:
+        return [_shape(v) for v in params]
+    except TypeError:
+        return _shape(params)
+
+
+def sql_id(sql: str) -> str:
+    normalized = " ".join(sql.split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def _plan_for(key: str, explain):
+    with _plans_lock:
+        if key in _plans:
+            return _plans[key]
+
+    plan = None
+    if explain is not None:
+        try:
+            plan = [list(r) for r in explain()]
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {e}"]
+
+    with _plans_lock:
+        if len(_plans) >= MAX_PLANS:
+            _plans.pop(next(iter(_plans)))
+        _plans[key] = plan
+    return plan
+
+
+def log_slow_statement(sql: str, params, seconds: float, explain):
+    try:
+        key = sql_id(sql)
+        st = metrics.current_stats()
+        entry = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "ms": round(seconds * 1000, 3),
+            "route": st.route if st is not None else None,
+            "sql_id": key,
+            "sql": " ".join(sql.split()),
+            "params": param_shapes(params),
+            "plan": _plan_for(key, explain),
+        }
+        logger.warning(json.dumps(entry, default=str))
+    except Exception:
+        # never let logging break the request
+        logger.exception("slow query logging failed")
+
+
+def install():
+    threshold_ms = os.environ.get("SLOW_QUERY_MS")
+    if threshold_ms in (None, ""):
+        return
+    threshold_ms = float(threshold_ms)
+    if threshold_ms < 0:
+        return
+
+    if not any(getattr(h, "_mini_social_slowlog", False) for h in logger.handlers):
+        handler = RotatingFileHandler(
+            os.environ.get("SLOW_QUERY_LOG", "slow_queries.jsonl"),
+            maxBytes=int(os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", 5)),
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._mini_social_slowlog = True
+        logger.addHandler(handler)
+        logger.setLevel(logging.WARNING)
+        logger.propagate = False
+
+    metrics.set_slow_statement_hook(threshold_ms / 1000.0, log_slow_statement)
@@ -0,0 +1,88 @@
+"""
+Helpers for streamed HTML / JSON responses.
+
+Streaming is opt-in: STREAM_RESPONSES=1 turns it on for every page that
+supports it, and ?stream=1 / ?stream=0 overrides that per request.  Rows
+are read in keyset pages of BATCH_SIZE, so a request holds at most one batch
+of posts (and their comments) in memory, and the first bytes go out before
+the last rows are read.  Each page is fetched completely before any of it is
+yielded: a slow client never keeps a statement or read transaction open.
+"""
+import os
+
+from flask import Response, current_app, request, stream_template, stream_with_context
+
+BATCH_SIZE = 50
+
+# first flush early so the page header reaches the client quickly, then
+# coalesce Jinja's many tiny chunks into larger writes
+FIRST_FLUSH_BYTES = 1024
+FLUSH_BYTES = 16 * 1024
+
+
+def enabled() -> bool:
+    arg = request.args.get("stream")
+    if arg is not None:
+        return arg not in ("0", "false", "")
+    return os.environ.get("STREAM_RESPONSES") == "1"
+
+
+def pages(fetch, key, size: int = BATCH_SIZE):
+    """
+    Yields lists of rows from fetch(after, size), which must return the first
+    size rows past the keyset position after (None for the first page).
+    key(row) gives that position for the last row of a page; it is taken
+    before the page is yielded, so callers may modify the rows.
+    """
+    after = None
+    while True:
+        rows = fetch(after, size)
+        if rows:
+            last = key(rows[-1])
+            yield rows
+        if len(rows) < size:
+            return
+        after = last
+
+
+def buffered(chunks):
+    buf: list[str] = []
+    size = 0
+    limit = FIRST_FLUSH_BYTES
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            yield "".join(buf)
+            buf, size, limit = [], 0, FLUSH_BYTES
+    if buf:
+        yield "".join(buf)
+
+
+def template_response(template_name: str, **context) -> Response:
+    """stream_template() with chunk coalescing; context values may be generators."""
+    return Response(buffered(stream_template(template_name, **context)), mimetype="text/html")
+
+
+def json_list_response(head: dict, key: str, items, tail) -> Response:
+    """
+    Streams {**head, key: [items...], **tail()} as one JSON object.
+    tail is called after the last item, so it can report things like the
+    next cursor that are only known at the end.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        prefix = dumps(head)[:-1]
+        yield prefix + ("," if head else "") + dumps(key) + ":["
+        first = True
+        for item in items:
+            yield ("" if first else ",") + dumps(item)
+            first = False
+        rest = tail()
+        yield "]," + dumps(rest)[1:] if rest else "]}"
+
+    return Response(
+        buffered(stream_with_context(generate())),
+        mimetype=current_app.json.mimetype,
+    )
@@ -0,0 +1,335 @@
+"""
+Trending posts: time-decayed like / comment scores, top K per window.
+
+    GET /api/trending?window=24h&limit=20      (window: 1h, 24h or 7d)
+    python trending.py [--db PATH] [--window 24h]    # decay, refresh and print
+    python trending.py --backfill                    # scores from existing likes / comments
+
+    TRENDING_K                 posts kept per window (default 100, also the max limit)
+    TRENDING_REFRESH_SECONDS   how often the top K are rebuilt (default 5)
+    TRENDING_DECAY_SECONDS     how often scores are decayed (default 60)
+
+trending_scores holds one decayed score per post and window.  Every like and
+comment adds its weight in the same transaction as the write (writer.py
+calls record()); an unlike takes the like's weight back off, decayed by the
+like's age at the last decay pass.  A decay pass multiplies every score by
+exp(-elapsed / tau), with a half-life of a quarter of the window, so an
+event one window old counts 1/16; scores that fell
+below MIN_SCORE in every window are deleted, which keeps the table to
+recently active posts.  Requests never touch likes or comments.
+
+Every worker runs a refresh thread.  A lock file next to the database lets
+one of them at a time do the work: the decay pass when due, the top K per
+window (ORDER BY score LIMIT K on the small table), the posts' details, and
+a snapshot file (<db>.trending.json, written atomically).  The others only
+reload the snapshot when it changed.  A worker starts from the snapshot, so
+it serves right away, and the endpoint slices a prepared list: O(limit),
+with no query, however busy the site is.
+"""
+import argparse
+import fcntl
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+
+WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+WEIGHTS = {"like": 1.0, "comment": 3.0}
+MIN_SCORE = 0.01
+
+TOP_K = int(os.environ.get("TRENDING_K", 100))
+REFRESH_SECONDS = float(os.environ.get("TRENDING_REFRESH_SECONDS", 5))
+DECAY_SECONDS = float(os.environ.get("TRENDING_DECAY_SECONDS", 60))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS trending_scores (
+        post_id INTEGER PRIMARY KEY,
+        score_1h REAL NOT NULL DEFAULT 0,
+        score_24h REAL NOT NULL DEFAULT 0,
+        score_7d REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS trending_state (
+        name TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+"""
+
+TRENDING_REFRESH_SECONDS = metrics.Histogram(
+    "mini_social_trending_refresh_seconds",
+    "Time to decay (when due), rank and snapshot trending posts.",
+)
+
+
+def _column(window: str) -> str:
+    return f"score_{window}"
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+# -- writes (inside the write transaction) --
+
+def record(conn, post_id: int, kind: str, sign: int = 1, created_at: str | None = None):
+    """Adds (sign=1) or takes back (sign=-1) one like / comment of post_id.
+
+    Pass the event's created_at when taking it back: the stored scores hold it
+    decayed up to the last decay pass, so that is what comes off each window.
+    SQLite parses it (offsets included); one it cannot parse comes off
+    undecayed, clamped at zero, rather than failing the like / unlike.
+    """
+    weights = {w: WEIGHTS[kind] * sign for w in WINDOWS}
+    if created_at is not None:
+        row = conn.execute(
+            "SELECT value - (julianday(?) - 2440587.5) * 86400.0 FROM trending_state WHERE name = 'decayed_at'",
+            (created_at,),
+        ).fetchone()
+        if row is not None and row[0] is not None:
+            age = max(row[0], 0.0)
+            weights = {w: weight * _factor(age, WINDOWS[w]) for w, weight in weights.items()}
+    conn.execute(
+        f"INSERT INTO trending_scores (post_id, {', '.join(_column(w) for w in WINDOWS)}) "
+        f"VALUES (:post_id, {', '.join(f'MAX(:w_{w}, 0)' for w in WINDOWS)}) "
+        f"ON CONFLICT (post_id) DO UPDATE SET "
+        + ", ".join(f"{_column(w)} = MAX({_column(w)} + :w_{w}, 0)" for w in WINDOWS),
+        {"post_id": post_id, **{f"w_{w}": weight for w, weight in weights.items()}},
+    )
+
+
+def _factor(elapsed: float, window_seconds: float) -> float:
+    """Decay over `elapsed` seconds: the half-life is a quarter of the window."""
+    return math.exp(-elapsed * math.log(2) / (window_seconds / 4))
+
+
+# -- decay and ranking --
+
+def decay(conn, now: float | None = None) -> int:
+    """Applies the decay since the last pass; returns the rows deleted."""
+    now = now if now is not None else time.time()
+    row = conn.execute("SELECT value FROM trending_state WHERE name = 'decayed_at'").fetchone()
+    last = row[0] if row else now
+    elapsed = max(now - last, 0.0)
+    factors = {w: _factor(elapsed, seconds) for w, seconds in WINDOWS.items()}
+    with conn:
+        if elapsed:
+            sets = ", ".join(f"{_column(w)} = {_column(w)} * ?" for w in WINDOWS)
+            conn.execute(f"UPDATE trending_scores SET {sets}", tuple(factors.values()))
+        deleted = conn.execute(
+            "DELETE FROM trending_scores WHERE " + " AND ".join(f"{_column(w)} < ?" for w in WINDOWS),
+            (MIN_SCORE,) * len(WINDOWS),
+        ).rowcount
+        conn.execute("INSERT OR REPLACE INTO trending_state (name, value) VALUES ('decayed_at', ?)", (now,))
+    return deleted
+
+
+def top(conn, k: int = TOP_K) -> dict[str, list[dict]]:
+    """window -> up to k posts, best first, with their details and counts."""
+    ranked = {
+        w: conn.execute(
+            f"SELECT post_id, {_column(w)} FROM trending_scores WHERE {_column(w)} >= ? "
+            f"ORDER BY {_column(w)} DESC LIMIT ?",
+            (MIN_SCORE, k),
+        ).fetchall()
+        for w in WINDOWS
+    }
+    ids = sorted({r[0] for rows in ranked.values() for r in rows})
+    details = {}
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"""
+            SELECT
+                posts.id,
+                posts.content,
+                posts.created_at,
+                users.username,
+                (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id) AS like_count,
+                (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) AS comment_count
+            FROM posts
+            JOIN users ON users.id = posts.user_id
+            WHERE posts.id IN ({placeholders})
+            """,
+            ids,
+        ).fetchall()
+        names = ("id", "content", "created_at", "username", "like_count", "comment_count")
+        details = {r[0]: dict(zip(names, r)) for r in rows}
+    # posts deleted or archived since their last like drop out here
+    return {
+        w: [{**details[pid], "score": round(score, 3)} for pid, score in rows if pid in details]
+        for w, rows in ranked.items()
+    }
+
+
+def backfill(conn, now: float | None = None) -> int:
+    """Recomputes every score from the likes and comments of the longest window."""
+    now = now if now is not None else time.time()
+    span = max(WINDOWS.values())
+    now_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now))
+    scores: dict[int, list[float]] = {}
+    for kind, table in (("like", "likes"), ("comment", "comments")):
+        rows = conn.execute(
+            f"SELECT post_id, (julianday(?) - julianday(created_at)) * 86400 FROM {table} "
+            f"WHERE created_at >= ?",
+            (now_iso, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now - span))),
+        )
+        for post_id, age in rows:
+            s = scores.setdefault(post_id, [0.0] * len(WINDOWS))
+            for i, seconds in enumerate(WINDOWS.values()):
+                s[i] += WEIGHTS[kind] * _factor(max(age, 0.0), seconds)
+    with conn:
+        conn.execute("DELETE FROM trending_scores")
+        conn.executemany(
+            f"INSERT INTO trending_scores (post_id, {', '.join(_column(w) for w in WINDOWS)}) VALUES (?, ?, ?, ?)",
+            ((pid, *s) for pid, s in scores.items()),
+        )
+        conn.execute("INSERT OR REPLACE INTO trending_state (name, value) VALUES ('decayed_at', ?)", (now,))
+    return len(scores)
+
+
+# -- per-worker snapshot --
+
+class Trending(threading.Thread):
+    def __init__(self, db_path: str, k: int = TOP_K, refresh: float = REFRESH_SECONDS, decay_every: float = DECAY_SECONDS):
+        super().__init__(name="trending", daemon=True)
+        self.db_path = db_path
+        self.snapshot_path = db_path + ".trending.json"
+        self.k = k
+        self.refresh = refresh
+        self.decay_every = decay_every
+        self.windows: dict[str, list[dict]] = {w: [] for w in WINDOWS}
+        self.generated_at = None
+        self._snapshot_mtime = None
+        self._decayed = 0.0
+        self.stopped = threading.Event()
+
+    def load_snapshot(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+            if mtime == self._snapshot_mtime:
+                return False
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # swap whole lists: a request sees the old top K or the new one, never a mix
+        self.windows = {w: data["windows"].get(w, []) for w in WINDOWS}
+        self.generated_at = data["generated_at"]
+        self._snapshot_mtime = mtime
+        return True
+
+    def rebuild(self) -> bool:
+        """Decays when due, ranks and writes the snapshot; False if another process holds the lock."""
+        with open(self.db_path + ".trending-lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            started = time.perf_counter()
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                init(conn)
+                now = time.time()
+                if now - self._decayed >= self.decay_every:
+                    decay(conn, now)
+                    self._decayed = now
+                windows = top(conn, self.k)
+            finally:
+                conn.close()
+            data = {"generated_at": time.time(), "windows": windows}
+            tmp = f"{self.snapshot_path}.{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.snapshot_path)
+            self.windows, self.generated_at = windows, data["generated_at"]
+            self._snapshot_mtime = os.path.getmtime(self.snapshot_path)
+            TRENDING_REFRESH_SECONDS.observe(time.perf_counter() - started)
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.refresh):
+            try:
+                if not self.rebuild():
+                    self.load_snapshot()
+            except sqlite3.Error:
+                pass  # database busy; serve the previous snapshot and retry next round
+
+    def stop(self):
+        self.stopped.set()
+
+
+_trending = None
+_trending_pid = None
+_start_lock = threading.Lock()
+
+
+def get(db_path: str) -> Trending:
+    """This process's Trending, started on first use (again after a fork)."""
+    global _trending, _trending_pid
+    if _trending_pid != os.getpid():
+        with _start_lock:
+            if _trending_pid != os.getpid():
+                t = Trending(db_path)
+                if not t.load_snapshot():
+                    try:
+                        t.rebuild()
+                    except sqlite3.Error:
+                        pass
+                t.start()
+                _trending, _trending_pid = t, os.getpid()
+    return _trending
+
+
+def install(app, db_path: str, format_time=None):
+    """Adds GET /api/trending to an sqlite-backed app."""
+    from flask import jsonify, request
+
+    def api_trending():
+        window = request.args.get("window") or "24h"
+        if window not in WINDOWS:
+            return jsonify({"error": f"Invalid window. Use one of: {', '.join(WINDOWS)}."}), 400
+        try:
+            limit = min(max(int(request.args.get("limit") or 20), 1), TOP_K)
+        except ValueError:
+            return jsonify({"error": "Invalid limit."}), 400
+
+        t = get(db_path)
+        posts = t.windows[window][:limit]
+        if format_time is not None:
+            posts = [{**p, "created_at": format_time(p["created_at"])} for p in posts]
+        return jsonify({"window": window, "limit": limit, "generated_at": t.generated_at, "posts": posts})
+
+    app.add_url_rule("/api/trending", "api_trending", api_trending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decay, rank and snapshot trending posts.")
+    parser.add_argument("--db", default=os.environ.get("SQLITE_PATH", "database.db"))
+    parser.add_argument("--window", choices=list(WINDOWS), default="24h")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--backfill", action="store_true", help="recompute scores from likes and comments first")
+    args = parser.parse_args()
+
+    if args.backfill:
+        conn = sqlite3.connect(args.db, timeout=30)
+        init(conn)
+        started = time.perf_counter()
+        n = backfill(conn)
+        conn.close()
+        print(f"backfilled {n:,} posts in {time.perf_counter() - started:.1f}s")
+
+    t = Trending(args.db, decay_every=0)
+    if not t.rebuild():
+        print("another process is refreshing; showing its snapshot", file=sys.stderr)
+        t.load_snapshot()
+    for p in t.windows[args.window][: args.limit]:
+        print(f"  {p['score']:>9.2f}  {p['id']:>8}  {p['username']:<16} {p['content'][:50]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,461 @@
+"""
+Single-writer service for SQLite deployments.
+
+    python writer.py serve [--db PATH] [--socket PATH]   # one per host
+    WRITER_SOCKET=/tmp/mini_social.sock gunicorn "app_api:create_app()"
+    python writer.py bench [--procs 8] [--seconds 5]     # direct vs. writer
+
+With several workers on one SQLite file, every write route opens its own
+transaction and they queue on the database lock: each one pays a journal
+fsync, and under load some give up with "database is locked".  With
+WRITER_SOCKET set, the routes instead send a write intent (an operation name
+from OPS plus its arguments, one JSON line) to a single writer process over
+a Unix socket.  The writer takes whatever intents are waiting (up to
+WRITER_MAX_BATCH), applies each inside its own SAVEPOINT in one
+BEGIN IMMEDIATE transaction, commits once and answers every caller: one
+fsync for the whole batch, and batches grow with the request rate.  A failing
+intent only rolls back its own savepoint.
+
+gunicorn.conf.py starts the writer next to the workers when WRITER_SOCKET is
+set.  If the socket cannot be reached, Client.write() applies the intent
+directly (BEGIN IMMEDIATE, so it waits on the busy timeout instead of
+failing on a lock upgrade), which is also what happens without
+WRITER_SOCKET.
+
+With ARCHIVE_PATH set, both paths attach the archive (archive.py), so
+likes, unlikes and comments on archived posts land in the right tier.
+
+Metrics (in the workers' /metrics): mini_social_write_seconds by op and path
+(writer / direct), mini_social_write_batch_size, and
+mini_social_writer_fallback_total.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import archive
+import metrics
+import trending
+
+MAX_BATCH = int(os.environ.get("WRITER_MAX_BATCH", 256))
+# extra time the writer waits for more intents once one arrived; 0 = only what is already queued
+LINGER_SECONDS = float(os.environ.get("WRITER_LINGER_MS", 0)) / 1000
+
+WRITE_SECONDS = metrics.Histogram(
+    "mini_social_write_seconds",
+    "Time from submitting a write intent to its commit, by op and path (writer or direct).",
+    ("op", "path"),
+)
+WRITE_BATCH = metrics.Histogram(
+    "mini_social_write_batch_size",
+    "Intents in the transaction that committed each write.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+WRITER_FALLBACK = metrics.Counter(
+    "mini_social_writer_fallback_total",
+    "Writes applied directly because the writer socket was unreachable.",
+)
+
+
+class WriteError(Exception):
+    """The intent failed inside the writer; the message says why."""
+
+
+# -- operations --
+
+OPS = {}
+
+
+def op(name: str):
+    def register(fn):
+        OPS[name] = fn
+        return fn
+
+    return register
+
+
+def _bump(conn, post_id: int):
+    conn.execute("UPDATE posts SET version = version + 1 WHERE id = ?", (post_id,))
+    if archive.PATH:
+        # an archived post, or one archive.py is moving and both tiers hold
+        conn.execute("UPDATE archive.posts SET version = version + 1 WHERE id = ?", (post_id,))
+
+
+@op("post")
+def _post(conn, user_id: int, content: str, created_at: str, post_id: int | None = None):
+    # post_id: a global id handed out by shards.py; otherwise the table's own
+    cur = conn.execute(
+        "INSERT INTO posts (id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
+        (post_id, user_id, content, created_at),
+    )
+    return cur.lastrowid
+
+
+@op("like")
+def _like(conn, user_id: int, post_id: int, created_at: str):
+    if archive.PATH:
+        # the archive may already hold this like
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO likes (user_id, post_id, created_at) SELECT ?, ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM archive.likes WHERE user_id = ? AND post_id = ?)",
+            (user_id, post_id, created_at, user_id, post_id),
+        )
+    else:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)",
+            (user_id, post_id, created_at),
+        )
+    if cur.rowcount:
+        _bump(conn, post_id)
+        trending.record(conn, post_id, "like")
+    return cur.rowcount > 0
+
+
+@op("unlike")
+def _unlike(conn, user_id: int, post_id: int):
+    sql = "DELETE FROM {}likes WHERE user_id = ? AND post_id = ? RETURNING created_at"
+    row = conn.execute(sql.format(""), (user_id, post_id)).fetchone()
+    if archive.PATH:
+        # both tiers hold the like while archive.py moves its post
+        archived = conn.execute(sql.format("archive."), (user_id, post_id)).fetchone()
+        row = row or archived
+    if row is not None:
+        _bump(conn, post_id)
+        trending.record(conn, post_id, "like", sign=-1, created_at=row[0])
+    return row is not None
+
+
+@op("comment")
+def _comment(conn, user_id: int, post_id: int, content: str, created_at: str, with_count: bool = False,
+             comment_id: int | None = None):
+    cur = conn.execute(
+        "INSERT INTO comments (id, user_id, post_id, content, created_at) VALUES (?, ?, ?, ?, ?)",
+        (comment_id, user_id, post_id, content, created_at),
+    )
+    _bump(conn, post_id)
+    trending.record(conn, post_id, "comment")
+    result = {"id": cur.lastrowid}
+    if with_count and archive.PATH:
+        result["comment_count"] = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM comments WHERE post_id = ?)"
+            " + (SELECT COUNT(*) FROM archive.comments WHERE post_id = ?)",
+            (post_id, post_id),
+        ).fetchone()[0]
+    elif with_count:
+        result["comment_count"] = conn.execute("SELECT COUNT(*) FROM comments WHERE post_id = ?", (post_id,)).fetchone()[0]
+    return result
+
+
+@op("follow")
+def _follow(conn, follower_id: int, followee_id: int, created_at: str):
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO follows (follower_id, followee_id, created_at) VALUES (?, ?, ?)",
+        (follower_id, followee_id, created_at),
+    )
+    return cur.rowcount > 0
+
+
+@op("unfollow")
+def _unfollow(conn, follower_id: int, followee_id: int):
+    cur = conn.execute("DELETE FROM follows WHERE follower_id = ? AND followee_id = ?", (follower_id, followee_id))
+    return cur.rowcount > 0
+
+
+def apply_batch(conn, intents: list[tuple[str, dict]]) -> list[tuple[bool, object]]:
+    """
+    Runs the intents in one transaction; returns (ok, result or error message)
+    per intent.  A lone intent has the transaction to itself: no savepoint,
+    and its error is raised.
+    """
+    savepoints = len(intents) > 1
+    out = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name, args in intents:
+            if savepoints:
+                conn.execute("SAVEPOINT intent")
+            try:
+                result = OPS[name](conn, **args)
+            except Exception as e:
+                if not savepoints:
+                    raise
+                conn.execute("ROLLBACK TO intent")
+                out.append((False, f"{type(e).__name__}: {e}"))
+            else:
+                out.append((True, result))
+            if savepoints:
+                conn.execute("RELEASE intent")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return out
+
+
+# -- client (in the web workers) --
+
+class Client:
+    def __init__(self, connect, socket_path: str | None = None, timeout: float = 10.0):
+        self.connect = connect
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def write(self, name: str, **args):
+        """Applies one write intent and returns the op's result; raises WriteError if it failed."""
+        if name not in OPS:
+            raise ValueError(f"unknown write op {name!r}")
+        started = time.perf_counter()
+        reply = self._remote(name, args) if self.socket_path else None
+        if reply is None:
+            path = "direct"
+            conn = self.connect()
+            try:
+                archive.attach(conn)
+                (ok, result), = apply_batch(conn, [(name, args)])
+            finally:
+                conn.close()
+            batch = 1
+        else:
+            path = "writer"
+            ok, result, batch = reply["ok"], reply.get("result", reply.get("error")), reply["batch"]
+        WRITE_SECONDS.observe(time.perf_counter() - started, name, path)
+        WRITE_BATCH.observe(batch)
+        if not ok:
+            raise WriteError(result)
+        return result
+
+    def _sock(self):
+        # one connection per thread, never shared with a process forked from this one
+        s = getattr(self._local, "sock", None)
+        if s is None or self._local.pid != os.getpid():
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(self.timeout)
+            s.connect(self.socket_path)
+            self._local.sock, self._local.file, self._local.pid = s, s.makefile("rb"), os.getpid()
+        return s
+
+    def _drop(self):
+        s = getattr(self._local, "sock", None)
+        if s is not None:
+            try:
+                self._local.file.close()
+                s.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def _remote(self, name: str, args: dict) -> dict | None:
+        """The writer's reply, or None when the intent could not be delivered."""
+        data = json.dumps({"op": name, "args": args}).encode("utf-8") + b"\n"
+        for attempt in (1, 2):
+            try:
+                self._sock().sendall(data)
+                break
+            except OSError:
+                # a kept connection goes stale when the writer restarts; reconnect once
+                self._drop()
+                if attempt == 2:
+                    WRITER_FALLBACK.inc()
+                    return None
+        try:
+            line = self._local.file.readline()
+        except OSError as e:
+            line, error = b"", e
+        else:
+            error = "connection closed"
+        if not line:
+            # delivered but unanswered: applying it again could write it twice
+            self._drop()
+            raise WriteError(f"writer did not answer ({error}); the write may not have been applied")
+        return json.loads(line)
+
+
+def install(app, connect):
+    """Client for this app's write routes; WRITER_SOCKET turns the writer on."""
+    client = Client(connect, os.environ.get("WRITER_SOCKET") or None)
+    app.extensions["writer"] = client
+    return client
+
+
+# -- server (one per host) --
+
+class _Pending:
+    __slots__ = ("name", "args", "done", "reply")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+        self.done = threading.Event()
+        self.reply = None
+
+
+class WriterServer:
+    def __init__(self, db_path: str, socket_path: str, max_batch: int = MAX_BATCH, linger: float = LINGER_SECONDS):
+        self.db_path = db_path
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.linger = linger
+        self.queue: queue.Queue = queue.Queue()
+        self.batches = 0
+        self.intents = 0
+        self.commit_seconds = 0.0
+
+    def _take_batch(self) -> list[_Pending]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                wait = deadline - time.monotonic()
+                batch.append(self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_writer(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        archive.init()
+        archive.attach(conn)
+        while True:
+            batch = self._take_batch()
+            started = time.perf_counter()
+            try:
+                results = apply_batch(conn, [(p.name, p.args) for p in batch])
+            except Exception as e:
+                results = [(False, f"{type(e).__name__}: {e}")] * len(batch)
+            elapsed = time.perf_counter() - started
+            self.batches += 1
+            self.intents += len(batch)
+            self.commit_seconds += elapsed
+            for p, (ok, result) in zip(batch, results):
+                p.reply = {"ok": ok, "batch": len(batch), **({"result": result} if ok else {"error": result})}
+                p.done.set()
+
+    def submit(self, name: str, args: dict) -> dict:
+        if name not in OPS:
+            return {"ok": False, "batch": 0, "error": f"unknown write op {name!r}"}
+        p = _Pending(name, args)
+        self.queue.put(p)
+        p.done.wait()
+        return p.reply
+
+    def report(self, every: float = 10.0):
+        while True:
+            time.sleep(every)
+            if self.batches:
+                print(
+                    f"writer: {self.intents:,} intents in {self.batches:,} transactions "
+                    f"(avg batch {self.intents / self.batches:.1f}, "
+                    f"avg transaction {self.commit_seconds / self.batches * 1000:.1f} ms)",
+                    file=sys.stderr,
+                    flush=True,
+                )
+
+    def serve_forever(self):
+        server_self = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        req = json.loads(line)
+                        reply = server_self.submit(req["op"], req.get("args") or {})
+                    except (ValueError, KeyError, TypeError) as e:
+                        reply = {"ok": False, "batch": 0, "error": f"bad request: {e}"}
+                    self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        threading.Thread(target=self.run_writer, name="writer", daemon=True).start()
+        threading.Thread(target=self.report, name="writer-report", daemon=True).start()
+        with socketserver.ThreadingUnixStreamServer(self.socket_path, Handler) as srv:
+            srv.daemon_threads = True
+            print(f"writer: {self.db_path} on {self.socket_path}", file=sys.stderr, flush=True)
+            srv.serve_forever()
+
+
+# -- benchmark --
+
+def _bench_worker(db_path: str, socket_path: str | None, seconds: float, worker: int, users: int, out):
+    def connect():
+        return sqlite3.connect(db_path, timeout=30)
+
+    client = Client(connect, socket_path)
+    done = errors = 0
+    stop = time.monotonic() + seconds
+    i = 0
+    while time.monotonic() < stop:
+        i += 1
+        user_id = 1 + (worker * 7919 + i) % users
+        try:
+            client.write("like", user_id=user_id, post_id=1 + i % 5000, created_at=datetime.utcnow().isoformat())
+            done += 1
+        except (WriteError, sqlite3.OperationalError):
+            errors += 1
+    out.put((done, errors))
+
+
+def bench(procs: int, seconds: float):
+    import multiprocessing
+    import tempfile
+
+    import seed
+
+    tmp = tempfile.mkdtemp(prefix="mini_social_writer_")
+    db_path = os.path.join(tmp, "bench.db")
+    seed.generate(db_path, users=200, posts=5000, follows_per_user=2, likes=0, comments=0)
+    socket_path = os.path.join(tmp, "writer.sock")
+
+    server = multiprocessing.Process(target=WriterServer(db_path, socket_path).serve_forever, daemon=True)
+    server.start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.05)
+
+    print(f"{procs} processes writing likes for {seconds:.0f}s each way")
+    for label, sock in (("direct transactions", None), ("single writer", socket_path)):
+        out = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_bench_worker, args=(db_path, sock, seconds, w, 200, out))
+            for w in range(procs)
+        ]
+        for w in workers:
+            w.start()
+        results = [out.get() for _ in workers]
+        for w in workers:
+            w.join()
+        done = sum(r[0] for r in results)
+        errors = sum(r[1] for r in results)
+        print(f"  {label:<22}{done / seconds:>9,.0f} writes/s   {errors:,} errors")
+    server.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-writer service for SQLite.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    serve = sub.add_parser("serve", help="run the writer")
+    serve.add_argument("--db", default=os.environ.get("SQLITE_PATH", "database.db"))
+    serve.add_argument("--socket", default=os.environ.get("WRITER_SOCKET"))
+    b = sub.add_parser("bench", help="compare direct writes with the writer")
+    b.add_argument("--procs", type=int, default=8)
+    b.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == "bench":
+        bench(args.procs, args.seconds)
+        return 0
+    if not args.socket:
+        parser.error("--socket or WRITER_SOCKET is required")
+    WriterServer(args.db, args.socket).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())